@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Compare RSS and per-sample latency of the thread and asyncio engines.
+
+Lines are written to a pty read by the engine, and each of the SafeCast
+handlers posts them to a local stub server. Latency is measured from
+writing a line to the stub server receiving it.
+
+    python -m benchmarks.bench_engine --samples 500 --handlers 4
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from benchmarks.common import StubServer, max_rss_kb, open_pty, percentile
+
+
+def run_thread_engine(handlers, device, stop_event):
+    from event_listener.trigger import DataIsUpdatedTrigger
+    from radiation_monitor.config import ListTrigger
+    from radiation_monitor.source import GeigerMeter
+
+    triggers = ListTrigger()
+    for name, handler in handlers:
+        trigger = DataIsUpdatedTrigger()
+        trigger.append(handler)
+        triggers.append(trigger, name)
+    triggers.start()
+
+    geiger_meter = GeigerMeter("bench", device, 115200, triggers.put, usv_per_cpm=1.0)
+    geiger_meter.start()
+    stop_event.wait()
+    geiger_meter.stop()
+    geiger_meter.join()
+    triggers.stop()
+
+
+def run_asyncio_engine(handlers, device, stop_event):
+    from radiation_monitor.aio import AsyncEngine
+
+    engine = AsyncEngine(handlers)
+    engine.add_serial("bench", device, 115200, usv_per_cpm=1.0)
+
+    watcher = threading.Thread(target=lambda: (stop_event.wait(), engine.stop()))
+    watcher.start()
+    engine.run()
+    watcher.join()
+
+
+def run_child(engine, samples, num_handlers, rate):
+    from radiation_monitor.event import SafeCastFixedLocationEventHandler
+
+    server = StubServer()
+    master, device = open_pty()
+    handlers = []
+
+    for i in range(num_handlers):
+        handler = SafeCastFixedLocationEventHandler("benchkey", i, 35.0, 139.0)
+        handler.API_URL = server.url
+        handlers.append(("safecast{}".format(i), handler))
+
+    stop_event = threading.Event()
+    target = run_thread_engine if engine == "thread" else run_asyncio_engine
+    runner = threading.Thread(target=target, args=(handlers, device, stop_event))
+    runner.start()
+    time.sleep(0.5)
+
+    sent = {}
+    max_threads = threading.active_count()
+    cpu_started = time.process_time()
+
+    for i in range(1, samples + 1):
+        sent[i] = time.monotonic()
+        os.write(master, "{} [cpm]\n".format(i).encode("ascii"))
+        max_threads = max(max_threads, threading.active_count())
+        time.sleep(1.0 / rate)
+
+    is_completed = server.wait_for(samples * num_handlers, timeout=30)
+    cpu_sec = time.process_time() - cpu_started
+    stop_event.set()
+    runner.join()
+    server.close()
+    os.close(master)
+
+    latencies = [at - sent[int(float(value))] for value, at in server.received]
+
+    return {
+        "engine": engine,
+        "samples": samples,
+        "handlers": num_handlers,
+        "completed": is_completed,
+        "received": len(latencies),
+        "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+        "cpu_sec": cpu_sec,
+        "max_rss_kb": max_rss_kb(),
+        "max_threads": max_threads,
+    }
+
+
+def main(argv=sys.argv[1:]):
+    arg = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg.add_argument("--samples", type=int, default=500)
+    arg.add_argument("--handlers", type=int, default=4)
+    arg.add_argument("--rate", type=float, default=200.0, help="lines per second")
+    arg.add_argument("--child", choices=["thread", "asyncio"], default=None, help=argparse.SUPPRESS)
+    args = arg.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.samples, args.handlers, args.rate)))
+        return
+
+    # run each engine in its own process so that RSS is not shared.
+    results = []
+    for engine in ("thread", "asyncio"):
+        output = subprocess.check_output([
+            sys.executable, "-m", "benchmarks.bench_engine", "--child", engine,
+            "--samples", str(args.samples), "--handlers", str(args.handlers), "--rate", str(args.rate)])
+        results.append(json.loads(output.decode("utf-8").splitlines()[-1]))
+
+    for result in results:
+        print("{engine:8} p50 {latency_p50_ms:7.2f} ms  p99 {latency_p99_ms:7.2f} ms  "
+              "rss {max_rss_kb:7d} KB  threads {max_threads:3d}  cpu {cpu_sec:.2f} s".format(**result))
+
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Load test of the whole pipeline from synthetic geiger counters to SafeCast.
+
+Poisson sources are read by GeigerMeterGroup, put to ListTrigger through the
+same callback as the daemon, and posted by SafeCast handlers to a local stub
+server. Latency is measured from reading a sample to the stub server
+receiving it.
+
+    python -m benchmarks.bench_pipeline --detectors 1000 --interval 1 --duration 10
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from benchmarks.common import StubServer, max_rss_kb, percentile
+from radiation_monitor.sample import Sample
+from radiation_monitor.source import GeigerMeterGroup
+from radiation_monitor.source import create_sources
+
+
+def run(detectors, interval, duration, num_handlers, q_max, drain_timeout=30.0):
+    from event_listener.trigger import DataIsUpdatedTrigger
+    from radiation_monitor import logger
+    from radiation_monitor.config import ListTrigger
+    from radiation_monitor.event import SafeCastFixedLocationEventHandler
+
+    server = StubServer()
+    triggers = ListTrigger(q_max=q_max)
+
+    for i in range(num_handlers):
+        handler = SafeCastFixedLocationEventHandler("benchkey", i, 35.0, 139.0, retries=0)
+        handler.API_URL = server.url
+        trigger = DataIsUpdatedTrigger()
+        trigger.append(handler)
+        triggers.append(trigger, "safecast{}".format(i))
+    triggers.start()
+
+    lock = threading.Lock()
+    read_at = {}
+
+    def put_to_triggers(sample):
+        # number each sample by the value to find it at the stub server.
+        with lock:
+            seq = len(read_at) + 1
+            read_at[seq] = sample.monotonic
+
+        logger.info("%s: %s[cpm] %s[usv]", sample.device, sample.cpm, sample.usv)
+        triggers.put(Sample(sample.device, sample.monotonic, sample.epoch, seq, float(seq)))
+
+    sources = create_sources("bench", "poisson://20?interval={}&count={}&seed=0".format(interval, detectors))
+    geiger_meter = GeigerMeterGroup(sources, put_to_triggers, usv_per_cpm=1.0)
+
+    max_threads = threading.active_count()
+    cpu_started = time.process_time()
+    started = time.monotonic()
+    geiger_meter.start()
+
+    while time.monotonic() - started < duration:
+        time.sleep(0.1)
+        max_threads = max(max_threads, threading.active_count())
+
+    geiger_meter.stop()
+    geiger_meter.join()
+    samples = len(read_at)
+
+    is_completed = server.wait_for(samples * num_handlers, drain_timeout)
+    elapsed = time.monotonic() - started
+    cpu_sec = time.process_time() - cpu_started
+    triggers.stop()
+    server.close()
+
+    latencies = [at - read_at[int(float(value))] for value, at in server.received]
+
+    return {
+        "name": "pipeline",
+        "detectors": detectors,
+        "handlers": num_handlers,
+        "samples": samples,
+        "received": len(latencies),
+        "completed": is_completed,
+        "offered_per_sec": detectors / interval,
+        "samples_per_sec": len(latencies) / num_handlers / elapsed,
+        "latency_p50_ms": (percentile(latencies, 0.5) or 0.0) * 1000,
+        "latency_p99_ms": (percentile(latencies, 0.99) or 0.0) * 1000,
+        "cpu_sec": cpu_sec,
+        "cpu_percent": cpu_sec / elapsed * 100,
+        "max_rss_kb": max_rss_kb(),
+        "max_threads": max_threads,
+    }
+
+
+def main(argv=sys.argv[1:]):
+    arg = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg.add_argument("--detectors", type=int, default=1000, help="number of synthetic geiger counters")
+    arg.add_argument("--interval", type=float, default=1.0, help="seconds between reports of each counter")
+    arg.add_argument("--duration", type=float, default=10.0, help="seconds to read the counters")
+    arg.add_argument("--handlers", type=int, default=2, help="number of SafeCast handlers")
+    arg.add_argument("--q-max", type=int, default=100000, help="max pending samples per handler")
+    args = arg.parse_args(argv)
+
+    result = run(args.detectors, args.interval, args.duration, args.handlers, args.q_max)
+
+    print("{name:10} {samples_per_sec:8.1f} samples/s (offered {offered_per_sec:.1f})  "
+          "p50 {latency_p50_ms:8.2f} ms  p99 {latency_p99_ms:8.2f} ms  "
+          "cpu {cpu_percent:5.1f} %  rss {max_rss_kb:7d} KB".format(**result))
+
+    print(json.dumps([result]))
+
+
+if __name__ == "__main__":
+    main()
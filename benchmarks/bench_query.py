@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Measure write and range query time of the local database on a synthetic
+dataset like several detectors reporting every second.
+
+    python -m benchmarks.bench_query --rows 2000000 --devices 4
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from radiation_monitor import query
+from radiation_monitor.sample import Sample
+from radiation_monitor.storage import SQLiteStore
+
+
+def populate(store, rows, devices, batch):
+    started = time.monotonic()
+    epoch = 1451606400.0
+    per_device = rows // devices
+    rand = random.Random(0)
+
+    for offset in range(0, per_device, batch):
+        samples = []
+        for i in range(offset, min(offset + batch, per_device)):
+            for device in range(devices):
+                cpm = rand.randint(10, 40)
+                samples.append(Sample("dev{}".format(device), 0.0, epoch + i, cpm, cpm * 0.00812))
+        store.write(samples)
+
+    return time.monotonic() - started
+
+
+def timed(func, repeat=5):
+    best = None
+    for i in range(repeat):
+        started = time.monotonic()
+        count = func()
+        sec = time.monotonic() - started
+        best = sec if best is None else min(best, sec)
+    return best, count
+
+
+def main(argv=sys.argv[1:]):
+    arg = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg.add_argument("--rows", type=int, default=2000000)
+    arg.add_argument("--devices", type=int, default=4)
+    arg.add_argument("--batch", type=int, default=60, help="seconds of samples per transaction")
+    args = arg.parse_args(argv)
+
+    path = tempfile.mkdtemp()
+    try:
+        store = SQLiteStore(os.path.join(path, "bench.db"))
+        write_sec = populate(store, args.rows, args.devices, args.batch)
+
+        start = 1451606400.0 + args.rows // args.devices // 2
+        results = {
+            "rows": args.rows,
+            "devices": args.devices,
+            "write_rows_per_sec": args.rows / write_sec,
+        }
+
+        cases = {
+            "readings_1h": lambda: sum(1 for row in query.iter_rows(store, ["dev0"], start, start + 3600)),
+            "rollups_1m_1d": lambda: sum(1 for row in query.iter_rows(store, ["dev0"], start, start + 86400, "1m")),
+            "rollups_1d_all": lambda: sum(1 for row in query.iter_rows(store, ["dev0"], 0, 2e9, "1d")),
+            # the same range without the index for reference.
+            "full_scan_1h": lambda: sum(1 for row in store.db_.execute(
+                "SELECT device, epoch, cpm, usv FROM reading NOT INDEXED"
+                " WHERE device = ? AND epoch >= ? AND epoch < ? ORDER BY epoch",
+                ("dev0", start, start + 3600))),
+        }
+
+        for name, func in sorted(cases.items()):
+            sec, count = timed(func)
+            results[name + "_ms"] = sec * 1000
+            results[name + "_rows"] = count
+            print("{:16} {:9.3f} ms {:8d} rows".format(name, sec * 1000, count))
+
+        store.close()
+        print("write {:.0f} rows/sec".format(results["write_rows_per_sec"]))
+        print(json.dumps(results))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Compare CPU time of reading lines by Serial.readline() and by
+source.CpmLineParser with bulk reads, on a pty standing in for the
+geiger counter.
+
+    python -m benchmarks.bench_reader --lines 20000
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from benchmarks.common import open_pty
+from radiation_monitor.source import CpmLineParser
+from serial import Serial
+
+
+def read_by_readline(uart, lines):
+    count = 0
+    while count < lines:
+        int(uart.readline().decode("ascii").split()[0])
+        count += 1
+
+
+def read_by_parser(uart, lines):
+    parser = CpmLineParser()
+    count = 0
+    while count < lines:
+        count += len(parser.feed(uart.read(uart.in_waiting or 1)))
+
+
+def measure(reader, lines, chunk_lines):
+    master, device = open_pty()
+    uart = Serial(device, 115200)
+    result = {}
+
+    def run_reader():
+        started = time.thread_time()
+        reader(uart, lines)
+        result["cpu_sec"] = time.thread_time() - started
+
+    thread = threading.Thread(target=run_reader)
+    thread.start()
+
+    chunk = b"".join("{} [cpm]\r\n".format(20 + i % 10).encode("ascii") for i in range(chunk_lines))
+    started = time.monotonic()
+    for i in range(lines // chunk_lines):
+        os.write(master, chunk)
+    thread.join()
+    result["wall_sec"] = time.monotonic() - started
+
+    uart.close()
+    os.close(master)
+
+    result["name"] = reader.__name__
+    result["lines"] = lines
+    result["usec_per_line"] = result["cpu_sec"] / lines * 1e6
+    return result
+
+
+def main(argv=sys.argv[1:]):
+    arg = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg.add_argument("--lines", type=int, default=20000)
+    arg.add_argument("--chunk-lines", type=int, default=10, help="lines written at once")
+    args = arg.parse_args(argv)
+
+    results = [
+        measure(read_by_readline, args.lines, args.chunk_lines),
+        measure(read_by_parser, args.lines, args.chunk_lines),
+    ]
+
+    for result in results:
+        print("{name:18} cpu {cpu_sec:6.3f} s  {usec_per_line:7.2f} usec/line".format(**result))
+
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Measure the cost per sample of rolling statistics over a 24-hour window
+at 1 Hz, compared with recalculating the window by NumPy on every sample.
+
+    python -m benchmarks.bench_rolling --size 86400
+"""
+
+import argparse
+import json
+import sys
+import time
+import numpy
+from radiation_monitor.rolling import RollingStatistics
+
+
+def run_rolling(values, size):
+    stats = RollingStatistics(size)
+    alarms = 0
+
+    started = time.perf_counter()
+    for value in values:
+        alarms += stats.update(value)
+    sec = time.perf_counter() - started
+
+    return {
+        "name": "rolling",
+        "usec_per_sample": sec / len(values) * 1e6,
+        "alarms": alarms,
+    }
+
+
+def run_recalculate(values, size, samples):
+    """ Recalculate mean/std of the full window for the last samples values. """
+    buf = numpy.asarray(values, dtype=numpy.float64)
+
+    started = time.perf_counter()
+    for i in range(len(buf) - samples, len(buf)):
+        window = buf[max(0, i - size + 1):i + 1]
+        window.mean()
+        window.std(ddof=1)
+    sec = time.perf_counter() - started
+
+    return {
+        "name": "recalculate",
+        "usec_per_sample": sec / samples * 1e6,
+        "alarms": None,
+    }
+
+
+def main(argv=sys.argv[1:]):
+    arg = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg.add_argument("--size", type=int, default=86400, help="window size (samples)")
+    arg.add_argument("--cpm", type=float, default=20.0, help="mean cpm of samples")
+    args = arg.parse_args(argv)
+
+    numpy.random.seed(0)
+    # fill the window once, then measure one more window of samples.
+    values = numpy.random.poisson(args.cpm, args.size * 2).tolist()
+
+    results = [
+        run_rolling(values, args.size),
+        run_recalculate(values, args.size, min(args.size, 2000)),
+    ]
+
+    for result in results:
+        print("{name:12} {usec_per_sample:8.3f} usec per sample".format(**result))
+
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
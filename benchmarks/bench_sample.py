@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Compare allocations and time per sample of the old nested dicts and
+sample.Sample.
+
+    python -m benchmarks.bench_sample --samples 100000
+"""
+
+import argparse
+import json
+import sys
+import time
+import timeit
+import tracemalloc
+from collections import OrderedDict
+from datetime import datetime
+from radiation_monitor.sample import Sample
+
+
+def make_dicts(name, cpm, usv_per_cpm):
+    """ The way of GeigerMeter.run and put_to_triggers before Sample. """
+    data = OrderedDict({
+        "Count Per Minute": OrderedDict({
+            "value": cpm,
+            "unit": "cpm"
+        }),
+        "Micro Sievert Per Hour": OrderedDict({
+            "value": cpm * usv_per_cpm,
+            "unit": "usv"
+        }),
+    })
+    rawdata = {}
+    rawdata["source"] = name
+    rawdata["data"] = data
+    rawdata["at"] = datetime.utcnow()
+    return rawdata
+
+
+def make_sample(name, cpm, usv_per_cpm):
+    return Sample(name, time.monotonic(), time.time(), cpm, cpm * usv_per_cpm)
+
+
+def measure(factory, samples):
+    # keep all of them like a queue full of pending samples.
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [factory("bench", i, 0.00812) for i in range(samples)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    del kept
+
+    sec = min(timeit.repeat(lambda: factory("bench", 20, 0.00812), number=samples, repeat=3))
+
+    return {
+        "name": factory.__name__,
+        "blocks_per_sample": float(blocks) / samples,
+        "bytes_per_sample": float(size) / samples,
+        "usec_per_sample": sec / samples * 1e6,
+    }
+
+
+def main(argv=sys.argv[1:]):
+    arg = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg.add_argument("--samples", type=int, default=100000)
+    args = arg.parse_args(argv)
+
+    results = [measure(make_dicts, args.samples), measure(make_sample, args.samples)]
+
+    for result in results:
+        print("{name:12} {blocks_per_sample:6.2f} blocks {bytes_per_sample:8.1f} bytes "
+              "{usec_per_sample:6.3f} usec per sample".format(**result))
+
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
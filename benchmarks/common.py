@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Helpers shared by the benchmarks."""
+
+import os
+import resource
+import threading
+import time
+import tty
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """ Local HTTP server standing in for SafeCast. It records the time
+        when each measurement value is received.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.received = []
+        HTTPServer.__init__(self, ("127.0.0.1", 0), _StubRequestHandler)
+
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/measurements".format(self.server_port)
+
+    def count(self):
+        with self.lock:
+            return len(self.received)
+
+    def wait_for(self, count, timeout):
+        deadline = time.monotonic() + timeout
+        while self.count() < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.count() >= count
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        now = time.monotonic()
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+        values = parse_qs(body).get("measurement[value]", [None])
+
+        with self.server.lock:
+            self.server.received.append((values[0], now))
+
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def open_pty():
+    """ Return (master fd, slave path) of new raw pty. """
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    return master, os.ttyname(slave)
+
+
+def percentile(values, rate):
+    """ Return the percentile of values like percentile(values, 0.99). """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * rate))]
+
+
+def max_rss_kb():
+    """ Return the max resident set size of this process in KB. """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Run the benchmarks, save the results as JSON and compare with old ones.
+
+Each benchmark runs in its own process so that RSS is not shared. The
+results are saved to benchmarks/results/ with the version and git revision,
+and the exit status is 1 if any metric regressed from --compare file.
+
+    python -m benchmarks.run
+    python -m benchmarks.run pipeline reader --compare benchmarks/results/old.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# default arguments to finish each benchmark in dozens of seconds.
+BENCHMARKS = {
+    "engine": ["--samples", "500", "--handlers", "4"],
+    "pipeline": ["--detectors", "200", "--duration", "10"],
+    "query": ["--rows", "200000", "--devices", "4"],
+    "reader": ["--lines", "20000"],
+    "rolling": ["--size", "86400"],
+    "sample": ["--samples", "100000"],
+}
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def run_benchmark(name, args):
+    """ Run one benchmark and return the results printed at the last line.
+
+    Args:
+        name: Benchmark name like "pipeline".
+        args: list of command line arguments.
+    Returns:
+        list of result dicts.
+    """
+    output = subprocess.check_output(
+        [sys.executable, "-m", "benchmarks.bench_" + name] + args)
+    lines = output.decode("utf-8").splitlines()
+
+    for line in lines[:-1]:
+        print("  " + line)
+
+    return json.loads(lines[-1])
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def version():
+    try:
+        import pkg_resources
+        return pkg_resources.get_distribution("radiation_monitor").version
+    except Exception:
+        return None
+
+
+def direction(key):
+    """ Return 1 if higher is better for the metric, -1 if lower is better,
+        or 0 if the key is not a metric to compare.
+    """
+    if key.endswith("_per_sec"):
+        return 1
+    if key.endswith(("_ms", "_sec", "_kb", "_per_sample", "_per_line", "_percent")):
+        return -1
+    return 0
+
+
+def compare(old, new, threshold):
+    """ Compare results of the same benchmarks.
+
+    Args:
+        old: dict of benchmark name and results loaded from old file.
+        new: dict of benchmark name and new results.
+        threshold: Rate of change to be regression like 0.1.
+    Returns:
+        list of (benchmark, entry, key, old value, new value, rate) tuples
+        of regressions.
+    """
+    regressions = []
+
+    for name, results in sorted(new.items()):
+        for i, (old_result, new_result) in enumerate(zip(old.get(name, []), results)):
+            entry = new_result.get("name", new_result.get("engine", i))
+
+            for key, value in sorted(new_result.items()):
+                old_value = old_result.get(key)
+                sign = direction(key)
+
+                if not sign or not isinstance(value, (int, float)) or not old_value:
+                    continue
+
+                rate = (value - old_value) / float(old_value)
+                mark = ""
+                if rate * sign < -threshold:
+                    regressions.append((name, entry, key, old_value, value, rate))
+                    mark = "  REGRESSION"
+
+                print("{}/{} {:24} {:12.3f} -> {:12.3f} ({:+6.1%}){}".format(
+                    name, entry, key, old_value, value, rate, mark))
+
+    return regressions
+
+
+def main(argv=sys.argv[1:]):
+    arg = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg.add_argument("benchmarks", nargs="*", default=[],
+                     help="benchmarks to run from {}. All if not specified".format(", ".join(sorted(BENCHMARKS))))
+    arg.add_argument("-o", "--output", default=None,
+                     help="JSON file to save the results. Saved in {} if not specified".format(RESULTS_DIR))
+    arg.add_argument("-c", "--compare", default=None, help="JSON file of old results to compare with")
+    arg.add_argument("-t", "--threshold", type=float, default=0.1, help="rate of change to be regression")
+    args = arg.parse_args(argv)
+
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            arg.error("unknown benchmark: {}".format(name))
+
+    report = {
+        "version": version(),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "timestamp": time.time(),
+        "results": {},
+    }
+
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        print(name)
+        report["results"][name] = run_benchmark(name, BENCHMARKS[name])
+
+    output = args.output
+    if output is None:
+        if not os.path.isdir(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+        output = os.path.join(RESULTS_DIR, "{}-{}.json".format(
+            time.strftime("%Y%m%d-%H%M%S"), report["git"] or "unknown"))
+
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print("saved to {}".format(output))
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            old = json.load(f)
+
+        print("compared with {} ({})".format(args.compare, old.get("git")))
+        if compare(old["results"], report["results"], args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
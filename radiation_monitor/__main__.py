@@ -15,61 +15,287 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import json
+import signal
+import socket
 import sys
-import time
+import threading
 from radiation_monitor import argparser
 from radiation_monitor import config
+from radiation_monitor import control
 from radiation_monitor import logger
-from radiation_monitor.source import GeigerMeter
+from radiation_monitor import metrics
+from radiation_monitor.capture import CaptureWriter
+from radiation_monitor.capture import ReplaySource
+from radiation_monitor.sample import Gap
+from radiation_monitor.source import GeigerMeterGroup
+from radiation_monitor.source import create_sources
+from radiation_monitor.source import read_once
+
+
+def get_devices(args):
+    """ Return the geiger counters specified by arguments.
+
+    Args:
+        args: parsed arguments.
+    Returns:
+        list of (name, uart_dev, uart_baud) tuples.
+    """
+    paths = args.serial_device_path
+    names = args.device_name or []
+
+    if len(paths) == 1 and not names:
+        names = ["Sparkfun SEN-11345"]
+
+    # name the rest of devices with the path.
+    names = names + ["Sparkfun SEN-11345 ({})".format(path) for path in paths[len(names):]]
+
+    return [(name, path, args.serial_baudrate[0]) for name, path in zip(names, paths)]
+
+
+def get_sources(args):
+    """ Return the sources of geiger counters specified by arguments. The
+        device path may be URL like "tcp://host:port" or "poisson://20".
+
+    Args:
+        args: parsed arguments.
+    Returns:
+        list of source.ISource objects.
+    """
+    return [
+        source
+        for name, spec, uart_baud in get_devices(args)
+        for source in create_sources(name, spec, uart_baud)]
+
+
+def get_status(args):
+    """ Print the current radiation of each device as JSON list. The last
+        readings are got from the daemon if it is running, or one line is
+        read from each device otherwise.
+
+    Args:
+        args: parsed arguments.
+    Returns:
+        Exit status. 0 if any reading is printed.
+    """
+    readings = None
+
+    if args.control_socket:
+        try:
+            readings = control.query(args.control_socket, "last", timeout=args.status_timeout)
+        except socket.timeout:
+            # the daemon holds the device. don't read it.
+            logger.error("Daemon at {} doesn't respond.".format(args.control_socket))
+            return 1
+        except control.ControlError as e:
+            logger.error("ControlError raised in get_status: {}".format(e))
+            return 1
+        except (IOError, OSError):
+            pass
+
+    if readings is None:
+        readings = []
+
+        for source in get_sources(args):
+            try:
+                sample = read_once(source, timeout=args.status_timeout, usv_per_cpm=0.00812)
+            except (IOError, OSError) as e:
+                logger.error("{} raised at reading {}.".format(type(e).__name__, source.name))
+                continue
+
+            if sample is not None:
+                readings.append(control.sample_to_dict(sample))
+
+    print(json.dumps(readings))
+
+    return 0 if readings else 1
+
+
+def run_control(args):
+    """ Send one command to the control socket of the daemon and print the
+        result as JSON.
+
+    Args:
+        args: parsed arguments of control subcommand.
+    Returns:
+        Exit status. 0 if the command succeeded.
+    """
+    params = {}
+    if args.name:
+        params["device" if args.command == "last" else "name"] = args.name
+
+    try:
+        result = control.query(args.control_socket, args.command, timeout=args.timeout, **params)
+    except control.ControlError as e:
+        sys.stderr.write("{}\n".format(e))
+        return 1
+    except (IOError, OSError) as e:
+        sys.stderr.write("Daemon at {} is not running: {}\n".format(args.control_socket, e))
+        return 1
+
+    print(json.dumps(result, indent=2))
+
+    return 0
+
+
+def reload_config(triggers, kwargs):
+    """ Read the config file again and rebuild the changed event handlers.
+        Devices and logging are not changed until restart.
+
+    Args:
+        triggers: config.ListTrigger object running.
+        kwargs: settings which the triggers are built with.
+    Returns:
+        New settings, or kwargs if the config file is invalid.
+    """
+    try:
+        new_kwargs = dict(argparser.init()._get_kwargs())
+    except SystemExit:
+        logger.error("Config file {} is not reloaded since it is invalid.".format(kwargs["config_file"]))
+        return kwargs
+
+    # a typo in the config file must not stop the daemon. the handler which
+    # fails to be built keeps running with the old settings.
+    try:
+        changed = config.reload_triggers(triggers, kwargs, new_kwargs)
+    except Exception as e:
+        logger.error("{} at reloading config file {}: {}".format(type(e).__name__, kwargs["config_file"], e))
+        return kwargs
+
+    logger.info("Config file %s is reloaded. Rebuilt: %s", kwargs["config_file"], ", ".join(changed) or "none")
+
+    return new_kwargs
+
+
+def run_async_engine(args, handlers):
+    """ Run the geiger meter and event handlers on one asyncio event loop
+        until SIGTERM or SIGINT. The pending data is sent and the handlers
+        are closed before returning.
+
+    Args:
+        args: parsed arguments.
+        handlers: list of (name, event handler) tuples.
+    Returns:
+        None
+    """
+    from radiation_monitor.aio import AsyncEngine
+
+    kwargs = dict(args._get_kwargs())
+    handlers = [
+        (name, config.init_breaker(name, handler, **kwargs) or handler) for name, handler in handlers]
+
+    engine = AsyncEngine(handlers)
+
+    for source in get_sources(args):
+        engine.add_source(source, usv_per_cpm=0.00812)
+
+    def stop(signum, frame):
+        logger.info("Monitor program is terminated by signal %s.", signum)
+        engine.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, lambda signum, frame: logger.warning(
+        "SIGHUP is ignored since config file is not reloaded by asyncio engine."))
+
+    engine.run()
 
 
 def main_routine():
+    if sys.argv[1:2] == ["query"]:
+        from radiation_monitor import query
+        sys.exit(query.run(argparser.init_query(sys.argv[2:])))
+
+    if sys.argv[1:2] == ["control"]:
+        sys.exit(run_control(argparser.init_control(sys.argv[2:])))
+
     args = argparser.init()
-    logger.configure(path_file=args.log_file, is_debug=args.debug)
+    logger.configure(
+        path_file=args.log_file,
+        is_debug=args.debug,
+        max_bytes=args.log_max_mb * 1024 * 1024,
+        backup_count=args.log_backup_count,
+        when=args.log_rotate_when)
 
     if args.just_get_status:
-        exit()
+        sys.exit(get_status(args))
 
     kwargs = dict(args._get_kwargs())
+
+    if args.metrics_port is not None:
+        metrics_server = metrics.MetricsServer(args.metrics_port, args.metrics_host)
+        metrics_server.start()
+
+    if args.engine == "asyncio":
+        run_async_engine(args, config.init_handlers(**kwargs))
+        return
+
     triggers = config.init_triggers(**kwargs)
     triggers.start()
 
-    def put_to_triggers(device_name, data, date_time):
+    control_server = None
+    if args.control_socket:
+        control_server = control.ControlServer(args.control_socket)
+        control_server.add_triggers(triggers)
+        control_server.start()
+
+    def put_to_triggers(sample):
         """ Monitor charge controller and update database like xively or
             internal database. This method should be called with a timer.
 
         Args:
-            device_name: geiger counter device name
-            data: got data
-            date_time: date and time when the data is got
+            sample: sample.Sample object got from geiger counter.
         Returns:
             None
-        Exceptions:
-            queue.Full: If queue of event handler is full
         """
-        rawdata = {}
-        rawdata["source"] = device_name
-        rawdata["data"] = data    # { "Count Per Minute": { "value": 30, "unit": "cpm" }, "Micro Sievert Per Hour": { "value": 0.24, "unit": "usv" }, }
-        rawdata["at"] = date_time
+        if not isinstance(sample, Gap):
+            logger.info("%s: %s[cpm] %s[usv]", sample.device, sample.cpm, sample.usv)
+
+            if control_server is not None:
+                control_server.update(sample)
 
-        for key, val in data.items():
-            logger.info("{date}: {label}: {value}[{unit}]".format(
-                date=date_time, label=key, value=str(val["value"]), unit=val["unit"]))
+        triggers.put(sample)
 
-        triggers.put(rawdata)
+    capture = CaptureWriter(args.capture_file) if args.capture_file else None
 
-    geiger_meter = GeigerMeter(
-        name="Sparkfun SEN-11345",
-        uart_dev=args.serial_device_path[0],
-        uart_baud=args.serial_baudrate[0],
-        callback_to_get_val=put_to_triggers,
-        usv_per_cpm=0.00812)
+    if args.replay_file:
+        geiger_meter = ReplaySource(
+            args.replay_file,
+            callback_to_get_val=put_to_triggers,
+            speed=args.replay_speed,
+            usv_per_cpm=0.00812)
+    else:
+        geiger_meter = GeigerMeterGroup(
+            get_sources(args),
+            callback_to_get_val=put_to_triggers,
+            usv_per_cpm=0.00812,
+            capture=capture)
 
     geiger_meter.start()
 
+    # init.d reload sends SIGHUP even if the daemon has no config file.
+    reload_event = threading.Event()
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload_event.set())
+
+    # init.d stop sends SIGTERM. stop in finally to flush the handlers.
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+
     try:
-        while True:
-            time.sleep(10)
+        # replay ends at the end of file.
+        while geiger_meter.is_alive() and not stop_event.is_set():
+            geiger_meter.join(1)
+
+            if reload_event.is_set():
+                reload_event.clear()
+
+                if args.config_file:
+                    kwargs = reload_config(triggers, kwargs)
+                else:
+                    logger.warning("SIGHUP is ignored since no config file is specified.")
+
+        if stop_event.is_set():
+            logger.info("Monitor program is terminated by SIGTERM.")
     except KeyboardInterrupt:
         logger.info("Monitor program is terminated by user.")
         raise
@@ -82,4 +308,11 @@ def main_routine():
         geiger_meter.join()
         triggers.stop()
 
+        if control_server is not None:
+            control_server.stop()
+            control_server.join()
+
+        if capture is not None:
+            capture.close()
+
 main_routine()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Aggregation of samples over fixed time windows."""
+
+import math
+import threading
+from radiation_monitor.sample import Sample
+
+
+def poisson_interval(count, z=1.96):
+    """ Return the confidence interval of Poisson mean by Byar's approximation.
+
+    Args:
+        count: observed number of counts.
+        z: standard normal quantile. 1.96 for 95% interval.
+    Returns:
+        (lower, upper) tuple of the mean count.
+    """
+    if count > 0:
+        lower = count * (1.0 - 1.0 / (9.0 * count) - z / (3.0 * math.sqrt(count))) ** 3
+    else:
+        lower = 0.0
+
+    upper = count + 1.0
+    upper = upper * (1.0 - 1.0 / (9.0 * upper) + z / (3.0 * math.sqrt(upper))) ** 3
+
+    return max(lower, 0.0), upper
+
+
+class AggregatedSample(Sample):
+    """ Measurement averaged over a window. cpm and usv are the mean of the
+        window and the bounds are the Poisson confidence interval of them.
+
+    Args:
+        device: Name of the geiger counter device.
+        monotonic: time.monotonic() of the first sample in the window.
+        epoch: time.time() of the first sample in the window.
+        cpm: Mean count per minute.
+        usv: Mean micro sievert per hour.
+        window: Length of the window as second.
+        samples: Number of samples in the window.
+        counts: Estimated number of counts in the window.
+        cpm_low, cpm_high: Confidence interval of cpm.
+        usv_low, usv_high: Confidence interval of usv.
+    Returns:
+        Instance object
+    """
+
+    __slots__ = ("window", "samples", "counts", "cpm_low", "cpm_high", "usv_low", "usv_high")
+
+    def __init__(self, device, monotonic, epoch, cpm, usv, window=0.0, samples=0, counts=0.0,
+                 cpm_low=0.0, cpm_high=0.0, usv_low=0.0, usv_high=0.0):
+        Sample.__init__(self, device, monotonic, epoch, cpm, usv)
+        self.window = window
+        self.samples = samples
+        self.counts = counts
+        self.cpm_low = cpm_low
+        self.cpm_high = cpm_high
+        self.usv_low = usv_low
+        self.usv_high = usv_high
+
+    def __eq__(self, other):
+        return Sample.__eq__(self, other) and isinstance(other, AggregatedSample) and all(
+            getattr(self, name) == getattr(other, name) for name in AggregatedSample.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}(device={!r}, epoch={!r}, cpm={!r}, usv={!r}, window={!r}, samples={!r}, " \
+               "cpm_low={!r}, cpm_high={!r})".format(
+                   type(self).__name__, self.device, self.epoch, self.cpm, self.usv,
+                   self.window, self.samples, self.cpm_low, self.cpm_high)
+
+
+class _Accumulator(object):
+    __slots__ = ("monotonic", "epoch", "samples", "cpm_sum", "usv_sum", "usv_per_cpm")
+
+    def __init__(self, sample):
+        self.monotonic = sample.monotonic
+        self.epoch = sample.epoch
+        self.samples = 0
+        self.cpm_sum = 0.0
+        self.usv_sum = 0.0
+        self.usv_per_cpm = 0.0
+
+
+class WindowAggregator(object):
+    """ Sum samples of each device and emit one AggregatedSample per device
+        every window seconds. put() is cheap enough to call on every sample,
+        the statistics are calculated only at the end of window.
+
+        The number of counts in the window is estimated as the mean cpm
+        multiplied by the window length in minutes, and the confidence
+        interval is calculated on it.
+
+    Args:
+        window: Length of the window as second.
+        callback: function called with AggregatedSample at the end of window.
+        scheduler: timer.Scheduler to run the window. It must be started by the caller.
+        z: standard normal quantile of the confidence interval.
+    Returns:
+        Instance object
+    """
+
+    def __init__(self, window, callback, scheduler, z=1.96):
+        self.window_ = window
+        self.callback_ = callback
+        self.scheduler_ = scheduler
+        self.z_ = z
+        self.lock_ = threading.Lock()
+        self.accumulators_ = {}
+        self.job_ = None
+
+    def start(self):
+        """ Start emitting the windows. """
+        self.job_ = self.scheduler_.every(self.window_, self.emit)
+
+    def stop(self):
+        """ Stop the window and emit the samples of current partial window. """
+        if self.job_ is not None:
+            self.scheduler_.cancel(self.job_)
+            self.job_ = None
+
+        self.emit()
+
+    def put(self, sample):
+        """ Add the sample to the current window.
+
+        Args:
+            sample: sample.Sample object.
+        Returns:
+            None
+        """
+        with self.lock_:
+            acc = self.accumulators_.get(sample.device)
+            if acc is None:
+                acc = self.accumulators_[sample.device] = _Accumulator(sample)
+
+            acc.samples += 1
+            acc.cpm_sum += sample.cpm
+            acc.usv_sum += sample.usv
+            if sample.cpm:
+                acc.usv_per_cpm = sample.usv / sample.cpm
+
+    def aggregate(self, device, acc):
+        """ Return AggregatedSample calculated from the accumulator. """
+        minutes = self.window_ / 60.0
+        cpm = acc.cpm_sum / acc.samples
+        counts = cpm * minutes
+        low, high = poisson_interval(counts, self.z_)
+
+        return AggregatedSample(
+            device, acc.monotonic, acc.epoch,
+            cpm, acc.usv_sum / acc.samples,
+            window=self.window_,
+            samples=acc.samples,
+            counts=counts,
+            cpm_low=low / minutes,
+            cpm_high=high / minutes,
+            usv_low=low / minutes * acc.usv_per_cpm,
+            usv_high=high / minutes * acc.usv_per_cpm)
+
+    def emit(self):
+        """ Close the current window and call the callback for each device.
+            Nothing is emitted for devices without samples in the window.
+        """
+        with self.lock_:
+            accumulators, self.accumulators_ = self.accumulators_, {}
+
+        for device, acc in accumulators.items():
+            self.callback_(self.aggregate(device, acc))
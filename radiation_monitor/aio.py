@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""asyncio engine to run serial reading and event handlers on one thread."""
+
+import asyncio
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from radiation_monitor import logger
+from radiation_monitor.event import CircuitBreakerEventHandler
+from radiation_monitor.event import CircuitOpenError
+from radiation_monitor.event import SafeCastBatchEventHandler
+from radiation_monitor.event import SafeCastEventHandler
+from radiation_monitor.sample import Sample
+from radiation_monitor.source import CpmLineParser
+from radiation_monitor.source import SerialSource
+from radiation_monitor.source import _Outage
+try:
+    from urllib.parse import urlencode, urlsplit
+except ImportError:
+    from urllib import urlencode
+    from urlparse import urlsplit
+
+
+class AsyncHttpClient(object):
+    """ Minimal HTTP/1.1 client on asyncio streams keeping one connection
+        alive per host.
+
+    Args:
+        timeout: (connect, read) timeout seconds.
+    Returns:
+        Instance object
+    """
+
+    def __init__(self, timeout=(3.05, 10)):
+        self.timeout_ = timeout
+        self.connections_ = {}
+
+    async def post_form(self, url, data):
+        """ Post data as form.
+
+        Args:
+            url: URL string to post.
+            data: dict object to post.
+        Returns:
+            HTTP status code as int.
+        Raises:
+            OSError, asyncio.TimeoutError, asyncio.IncompleteReadError: If
+                the connection fails or times out.
+        """
+        parts = urlsplit(url)
+        is_https = parts.scheme == "https"
+        port = parts.port or (443 if is_https else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        body = urlencode(data).encode("utf-8")
+        request = (
+            "POST {} HTTP/1.1\r\n"
+            "Host: {}\r\n"
+            "Content-Type: application/x-www-form-urlencoded\r\n"
+            "Content-Length: {}\r\n"
+            "Connection: keep-alive\r\n"
+            "\r\n").format(path, parts.netloc, len(body)).encode("ascii") + body
+
+        connection = self.connections_.pop(key, None)
+        is_reused = connection is not None
+
+        try:
+            if connection is None:
+                connection = await asyncio.wait_for(
+                    asyncio.open_connection(
+                        parts.hostname, port, ssl=ssl.create_default_context() if is_https else None),
+                    self.timeout_[0])
+
+            reader, writer = connection
+            writer.write(request)
+            await writer.drain()
+            status, is_keep_alive = await asyncio.wait_for(self._read_response(reader), self.timeout_[1])
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            if connection is not None:
+                connection[1].close()
+            if is_reused:
+                # the kept connection may be closed by server. try new one.
+                return await self.post_form(url, data)
+            raise
+
+        if is_keep_alive:
+            self.connections_[key] = connection
+        else:
+            connection[1].close()
+
+        return status
+
+    @staticmethod
+    async def _read_response(reader):
+        """ Read the response and return (status, is_keep_alive). """
+        version, status = (await reader.readuntil(b"\r\n")).split(None, 2)[:2]
+        headers = {}
+
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip().lower()
+
+        is_keep_alive = headers.get("connection", "") != "close" and \
+            (version == b"HTTP/1.1" or headers.get("connection", "") == "keep-alive")
+
+        if headers.get("transfer-encoding", "") == "chunked":
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif "content-length" in headers:
+            await reader.readexactly(int(headers["content-length"]))
+        else:
+            await reader.read()
+            is_keep_alive = False
+
+        return int(status), is_keep_alive
+
+    async def close(self):
+        """ Close all kept connections. """
+        connections, self.connections_ = self.connections_, {}
+
+        for reader, writer in connections.values():
+            writer.close()
+            await writer.wait_closed()
+
+
+class AsyncEngine(object):
+    """ Engine to run serial reading and all event handlers as coroutines on
+        one event loop instead of one thread per handler. SafeCast handlers
+        post with the asyncio HTTP client. Other handlers which have only
+        blocking API are run on a small shared thread pool.
+
+    Args:
+        handlers: list of (name, event handler) tuples like the one returned
+            by config.init_handlers(). The handlers are not started as thread,
+            and closed with their close() if they have it at stopping. A
+            handler may be event.CircuitBreakerEventHandler in front of
+            another one.
+        q_max: max number of pending data per handler. The oldest one is
+            dropped if over.
+        executor_workers: number of threads to run blocking handlers.
+        backoff: Seconds to wait before opening a lost source again. The
+            wait is doubled every time up to backoff_max, and sample.Gap is
+            put when it is opened.
+        backoff_max: Max seconds to wait before reconnection.
+    Returns:
+        Instance object
+    """
+
+    def __init__(self, handlers, q_max=1000, executor_workers=2, backoff=1.0, backoff_max=60.0):
+        self.handlers_ = handlers
+        self.q_max_ = q_max
+        self.backoff_ = backoff
+        self.backoff_max_ = backoff_max
+        self.loop_ = asyncio.new_event_loop()
+        self.executor_ = ThreadPoolExecutor(executor_workers)
+        self.client_ = AsyncHttpClient()
+        self.sources_ = []
+        self.timers_ = {}
+        self.retries_ = {}
+        self.queues_ = []
+        self.stopped_ = None
+        self.is_stopping_ = False
+
+    def add_serial(self, name, uart_dev, uart_baud, usv_per_cpm=0.00812):
+        """ Add geiger counter connected to serial port.
+
+        Args:
+            name: Name string like geiger meter device.
+            uart_dev: Path to the device file like "/dev/tty.usb-serial".
+            uart_baud: UART baudrate like 9600.
+            usv_per_cpm: Rate of uSv/h.
+        Returns:
+            None
+        """
+        self.add_source(SerialSource(name, uart_dev, uart_baud), usv_per_cpm)
+
+    def add_source(self, source, usv_per_cpm=0.00812):
+        """ Add geiger counter of any source like TCP or synthetic one.
+
+        Args:
+            source: source.ISource object which is not opened yet.
+            usv_per_cpm: Rate of uSv/h.
+        Returns:
+            None
+        """
+        source.open()
+        self.sources_.append((source, usv_per_cpm, CpmLineParser(device=source.name)))
+
+    def put(self, data):
+        """ Put data to all event handlers without blocking. This must be
+            called in the event loop.
+
+        Args:
+            data: data object to be put to all handlers.
+        Returns:
+            None
+        """
+        for q in self.queues_:
+            if q.full():
+                q.get_nowait()
+                q.task_done()
+            q.put_nowait(data)
+
+    def _on_readable(self, source, usv_per_cpm, parser):
+        try:
+            values = parser.feed(source.read())
+        except Exception as e:
+            # any error of one source must not stop the loop and the others.
+            logger.error("{} raised at reading {} in {}".format(type(e).__name__, source.name, type(self).__name__))
+            if source.fileno() is not None:
+                self.loop_.remove_reader(source.fileno())
+            try:
+                source.close()
+            except Exception:
+                pass
+            # fileno() of the closed source may be invalid at stopping.
+            self.sources_ = [entry for entry in self.sources_ if entry[0] is not source]
+            if not self.is_stopping_:
+                outage = _Outage(source.name, self.backoff_, self.backoff_max_)
+                self.retries_[source] = self.loop_.call_later(
+                    outage.next_delay(), self._retry, source, usv_per_cpm, outage)
+            return False
+
+        if not values:
+            return True
+
+        monotonic, epoch = time.monotonic(), time.time()
+
+        for cpm in values:
+            self.put(Sample(source.name, monotonic, epoch, cpm, cpm * usv_per_cpm))
+
+        return True
+
+    def _retry(self, source, usv_per_cpm, outage):
+        """ Open the lost source again, same as GeigerMeterGroup. """
+        del self.retries_[source]
+        outage.count()
+
+        try:
+            source.open()
+        except (IOError, OSError, ValueError) as e:
+            logger.warning("%s: reconnecting failed by %s", source.name, type(e).__name__)
+            self.retries_[source] = self.loop_.call_later(
+                outage.next_delay(), self._retry, source, usv_per_cpm, outage)
+            return
+
+        parser = CpmLineParser(device=source.name)
+        self.sources_.append((source, usv_per_cpm, parser))
+        self._watch(source, usv_per_cpm, parser)
+
+        gap = outage.gap()
+        logger.info("%s: reconnected after %.1f seconds", source.name, gap.seconds)
+        self.put(gap)
+
+    def _watch(self, source, usv_per_cpm, parser):
+        if source.fileno() is not None:
+            self.loop_.add_reader(source.fileno(), self._on_readable, source, usv_per_cpm, parser)
+        else:
+            self._schedule(source, usv_per_cpm, parser)
+
+    def _schedule(self, source, usv_per_cpm, parser):
+        self.timers_[source] = self.loop_.call_later(
+            max(0.0, source.next_at() - time.monotonic()), self._on_timer, source, usv_per_cpm, parser)
+
+    def _on_timer(self, source, usv_per_cpm, parser):
+        if self._on_readable(source, usv_per_cpm, parser):
+            self._schedule(source, usv_per_cpm, parser)
+        else:
+            self.timers_.pop(source, None)
+
+    def _runner(self, handler):
+        is_breaker = isinstance(handler, CircuitBreakerEventHandler)
+        inner = handler.handler_ if is_breaker else handler
+
+        if not isinstance(inner, SafeCastEventHandler) or isinstance(inner, SafeCastBatchEventHandler):
+            async def run(data):
+                await self.loop_.run_in_executor(self.executor_, handler._run, data)
+        elif not is_breaker:
+            async def run(data):
+                await self._post_safecast(inner, data)
+        else:
+            async def run(data):
+                # same as CircuitBreakerEventHandler.call() but posting on
+                # the event loop. CircuitOpenError is raised while open.
+                handler._enter()
+
+                try:
+                    await self._post_safecast(inner, data)
+                except Exception as e:
+                    handler._failed(e)
+                    raise
+
+                handler._succeeded()
+
+        return run
+
+    async def _post_safecast(self, handler, data):
+        form = handler.measurement(**handler.fields(data))
+
+        for attempt in range(handler.retries_ + 1):
+            if attempt:
+                await asyncio.sleep(handler.backoff_ * (2 ** (attempt - 1)))
+
+            started = time.monotonic()
+
+            try:
+                status = await self.client_.post_form(handler.url(), form)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                if attempt >= handler.retries_:
+                    raise
+                continue
+
+            handler._record_latency(time.monotonic() - started)
+
+            if status < 500:
+                break
+
+        if not 200 <= status < 300:
+            handler.send_failures_.inc()
+            raise IOError("Status {} from {}".format(status, handler.API_URL))
+
+    async def _consume(self, name, handler, q):
+        run = self._runner(handler)
+
+        while True:
+            data = await q.get()
+
+            try:
+                await run(data)
+            except CircuitOpenError:
+                # data is shed while the service keeps failing.
+                pass
+            except Exception as e:
+                logger.error("{} raised in {} of {}".format(type(e).__name__, name, type(self).__name__))
+            finally:
+                q.task_done()
+
+    async def _main(self, flush_timeout):
+        self.stopped_ = asyncio.Event()
+        if self.is_stopping_:
+            self.stopped_.set()
+
+        self.queues_ = [asyncio.Queue(self.q_max_) for handler in self.handlers_]
+        tasks = [
+            self.loop_.create_task(self._consume(name, handler, q))
+            for (name, handler), q in zip(self.handlers_, self.queues_)]
+
+        for source, usv_per_cpm, parser in self.sources_:
+            self._watch(source, usv_per_cpm, parser)
+
+        await self.stopped_.wait()
+
+        for timer in list(self.timers_.values()) + list(self.retries_.values()):
+            timer.cancel()
+
+        for source, usv_per_cpm, parser in self.sources_:
+            if source.fileno() is not None:
+                self.loop_.remove_reader(source.fileno())
+            source.close()
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*[q.join() for q in self.queues_]), flush_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Some data is not sent before stopping {}".format(type(self).__name__))
+
+        for task in tasks:
+            task.cancel()
+
+        for name, handler in self.handlers_:
+            close = getattr(handler, "close", None)
+            if close is None:
+                continue
+
+            try:
+                await self.loop_.run_in_executor(self.executor_, close)
+            except Exception as e:
+                logger.error("{} at closing {} in {}".format(type(e).__name__, name, type(self).__name__))
+
+        await self.client_.close()
+
+    def _set_stopped(self):
+        self.is_stopping_ = True
+        if self.stopped_ is not None:
+            self.stopped_.set()
+
+    def run(self, flush_timeout=10.0):
+        """ Run the event loop until stop() is called.
+
+        Args:
+            flush_timeout: max seconds to wait for the handlers to consume
+                the pending data at stopping.
+        Returns:
+            None
+        """
+        try:
+            self.loop_.run_until_complete(self._main(flush_timeout))
+        finally:
+            self.executor_.shutdown()
+            self.loop_.close()
+
+    def stop(self):
+        """ Stop the event loop. This can be called from any thread. """
+        self.loop_.call_soon_threadsafe(self._set_stopped)
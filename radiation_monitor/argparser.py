@@ -17,29 +17,148 @@
 
 import sys
 import argparse
+import configparser
+
+# section of the config file for the options without prefix.
+MAIN_SECTION = "radiation_monitor"
+
+# options which the asyncio engine doesn't support. it has neither the
+# windows, detectors, spool nor control socket of the threaded triggers,
+# and alert only handlers like twitter are never called by it.
+ASYNC_UNSUPPORTED = (
+    "window", "safecast_window", "keenio_window", "xively_window",
+    "alert_usv", "anomaly_window", "spool_dir", "control_socket",
+    "capture_file", "replay_file", "twitter_consumer_key")
+
+
+def read_config(path):
+    """ Read the config file in INI format. The options of MAIN_SECTION are
+        the same as the long command line options like
+
+        [radiation_monitor]
+        serial_device_path = /dev/ttyUSB0 tcp://192.168.0.2:2000
+        serial_baudrate = 9600
+        window = 60
+
+        and the other sections are named by the event handler like
+
+        [safecast]
+        api_key = xxxx
+        window = 300
+
+        which is the same as --safecast-api-key and --safecast-window.
+
+    Args:
+        path: Config file path.
+    Returns:
+        configparser.ConfigParser object.
+    Raises:
+        IOError if the file is not readable.
+        configparser.Error if the file is not INI format.
+    """
+    config = configparser.ConfigParser(interpolation=None)
+
+    with open(path, "r") as f:
+        config.read_file(f)
+
+    return config
+
+
+def _config_defaults(arg, config):
+    """ Return the values of the config file as dict of the destinations of
+        the arguments.
+    """
+    actions = dict((action.dest, action) for action in arg._actions)
+    defaults = {}
+
+    for section in config.sections():
+        for key, value in config.items(section):
+            key = key.replace("-", "_")
+
+            if section == MAIN_SECTION:
+                candidates = [key]
+            else:
+                candidates = ["{}_{}".format(section, key), key]
+
+            dest = next((name for name in candidates if name in actions), None)
+            if dest is None:
+                arg.error("unknown option {} in [{}] of the config file".format(key, section))
+
+            action = actions[dest]
+            convert = action.type or str
+
+            try:
+                if action.nargs == 0:
+                    defaults[dest] = config.getboolean(section, key)
+                elif action.nargs in ("+", "*") or isinstance(action.nargs, int):
+                    defaults[dest] = [convert(val) for val in value.split()]
+                else:
+                    defaults[dest] = convert(value)
+            except ValueError:
+                arg.error("invalid value {} of {} in [{}] of the config file".format(value, key, section))
+
+    return defaults
 
 
 def init(argv=sys.argv[1:]):
-    """ Return the parsed arguments specified to sys.argv.
+    """ Return the parsed arguments specified to sys.argv. If --config-file
+        is specified, the values in the file are used as defaults and the
+        command line options override them.
 
     Args:
         argv: sys.argv[1:] as default.
     Returns:
         Dict like object.
     """
+    pre = argparse.ArgumentParser(add_help=False)
+    pre.add_argument("-c", "--config-file", type=str, default=None)
+    config_file = pre.parse_known_args(argv)[0].config_file
+
+    config = None
+    if config_file:
+        try:
+            config = read_config(config_file)
+        except (IOError, OSError, configparser.Error) as e:
+            pre.error("cannot read config file {}: {}".format(config_file, e))
+
     arg = argparse.ArgumentParser(
         description="Application program to monitor Geiger counter device.")
     arg.add_argument(
-        "serial_device_path",
+        "-c", "--config-file",
         type=str,
-        nargs=1,
-        help="Serial (UART) device file path connected to geiger counter"
+        default=None,
+        help="INI file of the options. Reloaded with SIGHUP"
+    )
+
+    # devices in the config file make the positional arguments unnecessary.
+    if config is not None and config.has_option(MAIN_SECTION, "serial_device_path"):
+        device_args = ("--serial-device-path",)
+        baudrate_args = ("--serial-baudrate",)
+    else:
+        device_args = ("serial_device_path",)
+        baudrate_args = ("serial_baudrate",)
+
+    arg.add_argument(
+        *device_args,
+        type=str,
+        nargs="+",
+        help="Serial (UART) device file paths connected to geiger counters, "
+             "or tcp://HOST:PORT, pty://[PATH] and "
+             "poisson://CPM?interval=SEC&count=N&seed=S for synthetic ones. "
+             "Ignored with --replay-file"
     )
     arg.add_argument(
-        "serial_baudrate",
+        *baudrate_args,
         type=int,
         nargs=1,
-        help="Serial (UART) device's baudrate to geiger counter"
+        help="Serial (UART) device's baudrate to geiger counters"
+    )
+    arg.add_argument(
+        "-n", "--device-name",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Name of each geiger counter in the same order as serial_device_path"
     )
     arg.add_argument(
         "-sk", "--safecast-api-key",
@@ -65,6 +184,19 @@ def init(argv=sys.argv[1:]):
         nargs='?', default=None, const=None,
         help="Longitude of this device"
     )
+    arg.add_argument(
+        "--safecast-batch-max",
+        type=int,
+        default=1,
+        help="Max number of measurements sent to SafeCast by one request. "
+             "Send each measurement if 1"
+    )
+    arg.add_argument(
+        "--safecast-batch-age",
+        type=float,
+        default=60.0,
+        help="Max seconds to keep a measurement before sending to SafeCast in bulk"
+    )
     arg.add_argument(
         "-xa", "--xively-api-key",
         type=str,
@@ -113,17 +245,198 @@ def init(argv=sys.argv[1:]):
         nargs='?', default=None, const=None,
         help="Access Token Secret"
     )
+    arg.add_argument(
+        "-w", "--window",
+        type=float,
+        default=0,
+        help="Seconds to average readings before sending to remote services. "
+             "Send every reading if 0"
+    )
+    arg.add_argument(
+        "--safecast-window",
+        type=float,
+        default=None,
+        help="Seconds to average readings before sending to SafeCast. "
+             "Same as --window if not specified"
+    )
+    arg.add_argument(
+        "--keenio-window",
+        type=float,
+        default=None,
+        help="Seconds to average readings before sending to keenio. "
+             "Same as --window if not specified"
+    )
+    arg.add_argument(
+        "--xively-window",
+        type=float,
+        default=None,
+        help="Seconds to average readings before sending to Xively. "
+             "Same as --window if not specified"
+    )
+    arg.add_argument(
+        "--alert-usv",
+        type=float,
+        default=None,
+        help="Alert to Twitter when a reading goes over this uSv/h"
+    )
+    arg.add_argument(
+        "--alert-clear-usv",
+        type=float,
+        default=None,
+        help="Alert again only after a reading goes below this uSv/h. 80%% of --alert-usv as default"
+    )
+    arg.add_argument(
+        "--alert-interval",
+        type=float,
+        default=3600.0,
+        help="Min seconds between alerts of the same device"
+    )
+    arg.add_argument(
+        "--anomaly-window",
+        type=int,
+        default=0,
+        help="Number of readings in the rolling window to alert anomalies of cpm to Twitter. "
+             "Disabled if 0 (numpy is required)"
+    )
+    arg.add_argument(
+        "--anomaly-threshold",
+        type=float,
+        default=8.0,
+        help="CUSUM level in standard deviations to alert"
+    )
+    arg.add_argument(
+        "--anomaly-drift",
+        type=float,
+        default=1.0,
+        help="CUSUM allowance in standard deviations per reading"
+    )
+    arg.add_argument(
+        "-db", "--database-path",
+        type=str,
+        default=None,
+        help="SQLite database file path to store readings locally"
+    )
+    arg.add_argument(
+        "--database-batch-max",
+        type=int,
+        default=60,
+        help="Max number of readings written to the database by one transaction"
+    )
+    arg.add_argument(
+        "--database-batch-age",
+        type=float,
+        default=10.0,
+        help="Max seconds to keep a reading before writing to the database"
+    )
+    arg.add_argument(
+        "--spool-dir",
+        type=str,
+        default=None,
+        help="Directory to spool data on disk in front of each event handler"
+    )
+    arg.add_argument(
+        "--spool-max-mb",
+        type=int,
+        default=64,
+        help="Max disk usage of the spool per event handler in MB"
+    )
+    arg.add_argument(
+        "--spool-replay-rate",
+        type=float,
+        default=2.0,
+        help="Max number of spooled data per second to replay to each event handler"
+    )
+    arg.add_argument(
+        "--breaker-failures",
+        type=int,
+        default=5,
+        help="Failures in a row to stop calling the event handler for a while. 0 to disable"
+    )
+    arg.add_argument(
+        "--breaker-reset",
+        type=float,
+        default=30.0,
+        help="Seconds to stop calling the failing event handler before retrying it"
+    )
+    arg.add_argument(
+        "--capture-file",
+        type=str,
+        default=None,
+        help="File path to record raw lines from geiger counters. Compressed if it ends with .gz"
+    )
+    arg.add_argument(
+        "--replay-file",
+        type=str,
+        default=None,
+        help="Capture file path to replay instead of reading serial devices"
+    )
+    arg.add_argument(
+        "--replay-speed",
+        type=float,
+        default=1.0,
+        help="Speed to replay the capture file. 1.0 is recorded speed and 0 is as fast as possible"
+    )
+    arg.add_argument(
+        "--engine",
+        type=str,
+        choices=["thread", "asyncio"],
+        default="thread",
+        help="Run each event handler on its own thread, or all of them on one asyncio event loop"
+    )
+    arg.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="TCP port to serve metrics in Prometheus text format at /metrics"
+    )
+    arg.add_argument(
+        "--metrics-host",
+        type=str,
+        default="127.0.0.1",
+        help="Address to bind the metrics server"
+    )
+    arg.add_argument(
+        "--control-socket",
+        type=str,
+        default=None,
+        help="Unix socket path to serve the last readings of the running daemon"
+    )
     arg.add_argument(
         "-l", "--log-file",
         type=str,
         default=None,
         help="log file path to output"
     )
+    arg.add_argument(
+        "--log-max-mb",
+        type=int,
+        default=10,
+        help="Rotate the log file when it gets larger than this MB. Never if 0"
+    )
+    arg.add_argument(
+        "--log-backup-count",
+        type=int,
+        default=5,
+        help="Number of rotated log files to keep"
+    )
+    arg.add_argument(
+        "--log-rotate-when",
+        type=str,
+        default=None,
+        help="Rotate the log file by time like \"midnight\" or \"W0\" instead of size"
+    )
     arg.add_argument(
         "--just-get-status",
         action='store_true',
         default=False,
-        help="Just get the current radiation"
+        help="Just print the current radiation as JSON. Got from the daemon at "
+             "--control-socket if running, or read from the device otherwise"
+    )
+    arg.add_argument(
+        "--status-timeout",
+        type=float,
+        default=5.0,
+        help="Seconds to wait for a reading of the device with --just-get-status"
     )
     arg.add_argument(
         "--debug",
@@ -132,4 +445,110 @@ def init(argv=sys.argv[1:]):
         help="Enable debug mode"
     )
 
+    if config is not None:
+        arg.set_defaults(**_config_defaults(arg, config))
+
+    args = arg.parse_args(argv)
+    if args.serial_baudrate is None:
+        arg.error("serial_baudrate is required in [{}] of the config file".format(MAIN_SECTION))
+
+    if args.engine == "asyncio":
+        unsupported = ["--" + key.replace("_", "-") for key in ASYNC_UNSUPPORTED if getattr(args, key)]
+        if unsupported:
+            arg.error("--engine asyncio doesn't support {}".format(", ".join(unsupported)))
+
+    return args
+
+
+def init_control(argv=sys.argv[2:]):
+    """ Return the parsed arguments of control subcommand like
+        "radiation_monitor control /var/run/radiation_monitor.sock pause safecast".
+
+    Args:
+        argv: sys.argv[2:] as default.
+    Returns:
+        Dict like object.
+    """
+    arg = argparse.ArgumentParser(
+        prog="radiation_monitor control",
+        description="Query or control the running daemon via its --control-socket.")
+    arg.add_argument(
+        "control_socket",
+        type=str,
+        help="Unix socket path given to the daemon by --control-socket"
+    )
+    arg.add_argument(
+        "command",
+        type=str,
+        help="last, devices, handlers, pause, resume, flush or commands"
+    )
+    arg.add_argument(
+        "name",
+        type=str,
+        nargs="?",
+        default=None,
+        help="Event handler name like \"safecast\" for pause and resume, or "
+             "device name for last"
+    )
+    arg.add_argument(
+        "-t", "--timeout",
+        type=float,
+        default=15.0,
+        help="Seconds to wait for the response"
+    )
+
+    return arg.parse_args(argv)
+
+
+def init_query(argv=sys.argv[2:]):
+    """ Return the parsed arguments of query subcommand like
+        "radiation_monitor query /var/lib/radiation_monitor.db --rollup 1h".
+
+    Args:
+        argv: sys.argv[2:] as default.
+    Returns:
+        Dict like object.
+    """
+    arg = argparse.ArgumentParser(
+        prog="radiation_monitor query",
+        description="Query readings stored in the local database.")
+    arg.add_argument(
+        "database_path",
+        type=str,
+        help="SQLite database file path"
+    )
+    arg.add_argument(
+        "-d", "--device",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Device names to query. All devices if not specified"
+    )
+    arg.add_argument(
+        "-s", "--start",
+        type=str,
+        default=None,
+        help="Start time as epoch seconds or UTC like 2016-01-01T10:00:00"
+    )
+    arg.add_argument(
+        "-e", "--end",
+        type=str,
+        default=None,
+        help="End time (exclusive) as epoch seconds or UTC like 2016-01-02"
+    )
+    arg.add_argument(
+        "-r", "--rollup",
+        type=str,
+        choices=["1m", "1h", "1d"],
+        default=None,
+        help="Output rollups of this resolution instead of raw readings"
+    )
+    arg.add_argument(
+        "-f", "--format",
+        type=str,
+        choices=["csv", "json", "jsonl"],
+        default="csv",
+        help="Output format"
+    )
+
     return arg.parse_args(argv)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Registry of event handler backends imported only when configured."""
+
+import importlib
+import threading
+try:
+    from importlib.metadata import entry_points
+except ImportError:
+    entry_points = None
+
+# group of the entry points to add or replace backends by other packages like
+#     entry_points={"radiation_monitor.handlers": ["twitter = mypkg.bot:TweetBot"]}
+ENTRY_POINT_GROUP = "radiation_monitor.handlers"
+
+# "module:attribute" of the built-in backends. Nothing is imported until load().
+_BUILTINS = {
+    "database": "radiation_monitor.event:LocalStorageEventHandler",
+    "safecast": "radiation_monitor.event:SafeCastFixedLocationEventHandler",
+    "safecast_batch": "radiation_monitor.event:SafeCastBatchEventHandler",
+    "keenio": "event_listener.handler:KeenIoEventHandler",
+    "xively": "event_listener.handler:XivelyEventHandler",
+    "twitter": "event_listener.handler:TweetBotEventHandler",
+    "spool": "radiation_monitor.event:SpooledEventHandler",
+    "breaker": "radiation_monitor.event:CircuitBreakerEventHandler",
+}
+
+_lock = threading.Lock()
+_specs = dict(_BUILTINS)
+_loaded = {}
+_registered = set()
+_is_entry_points_read = False
+
+
+def _read_entry_points():
+    """ Add the backends of the entry points. Only the metadata of the
+        installed packages is read and nothing is imported.
+    """
+    global _is_entry_points_read
+
+    if _is_entry_points_read or entry_points is None:
+        return
+    _is_entry_points_read = True
+
+    try:
+        points = entry_points()
+        if hasattr(points, "select"):
+            points = points.select(group=ENTRY_POINT_GROUP)
+        else:
+            points = points.get(ENTRY_POINT_GROUP, [])
+    except Exception:
+        return
+
+    for point in points:
+        # entry points replace the built-in backends but not registered ones.
+        if point.name not in _registered:
+            _specs[point.name] = point.value
+
+
+def register(name, spec):
+    """ Register the backend.
+
+    Args:
+        name: Name of the backend like "twitter".
+        spec: "module:attribute" string or the class itself.
+    Returns:
+        None
+    """
+    with _lock:
+        _specs[name] = spec
+        _registered.add(name)
+        _loaded.pop(name, None)
+
+
+def names():
+    """ Return the names of the registered backends. """
+    with _lock:
+        _read_entry_points()
+        return sorted(_specs)
+
+
+def load(name):
+    """ Import and return the class of the backend.
+
+    Args:
+        name: Name of the backend like "twitter".
+    Returns:
+        Class of the event handler.
+    Raises:
+        KeyError if the backend is not registered.
+        ImportError if the module of the backend is not installed.
+    """
+    with _lock:
+        if name in _loaded:
+            return _loaded[name]
+
+        _read_entry_points()
+        spec = _specs[name]
+
+        if isinstance(spec, str):
+            module_name, _, attribute = spec.partition(":")
+            backend = importlib.import_module(module_name)
+            for part in attribute.split("."):
+                backend = getattr(backend, part)
+        else:
+            backend = spec
+
+        _loaded[name] = backend
+        return backend
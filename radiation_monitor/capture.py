@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Capture of raw lines from geiger counters and replay of them."""
+
+import gzip
+import json
+import threading
+import time
+from radiation_monitor import logger
+from radiation_monitor.sample import Sample
+from radiation_monitor.source import CpmLineParser
+
+FORMAT_NAME = "radiation_monitor.capture"
+FORMAT_VERSION = 1
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode)
+
+
+class CaptureWriter(object):
+    """ Writer of raw lines to capture file in JSON lines. The first line is
+        the header with epoch and monotonic time at start, and each of the
+        following ones is [seconds from start, device name, raw line]. The
+        raw line is decoded as latin-1 to keep noise bytes as they are. The
+        file is compressed if the path ends with ".gz".
+
+    Args:
+        path: File path to write.
+        flush_interval: Seconds to flush the file.
+    Returns:
+        Instance object
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.file_ = _open(path, "w")
+        self.lock_ = threading.Lock()
+        self.flush_interval_ = flush_interval
+        self.monotonic_ = time.monotonic()
+        self.flushed_at_ = self.monotonic_
+        self.count_ = 0
+
+        self.file_.write(json.dumps({
+            "format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "epoch": time.time(),
+            "monotonic": self.monotonic_,
+        }) + "\n")
+
+    def write(self, device, line, monotonic=None):
+        """ Write one raw line.
+
+        Args:
+            device: Name of geiger counter.
+            line: Raw bytes of the line without newline.
+            monotonic: time.monotonic() when the line is read. Now if None.
+        Returns:
+            None
+        """
+        if monotonic is None:
+            monotonic = time.monotonic()
+
+        record = json.dumps(
+            [round(monotonic - self.monotonic_, 6), device, bytes(line).decode("latin-1")],
+            separators=(",", ":"))
+
+        with self.lock_:
+            self.file_.write(record + "\n")
+            self.count_ += 1
+
+            if monotonic - self.flushed_at_ >= self.flush_interval_:
+                self.file_.flush()
+                self.flushed_at_ = monotonic
+
+    @property
+    def count(self):
+        """ Number of lines written. """
+        return self.count_
+
+    def close(self):
+        """ Flush and close the file. """
+        with self.lock_:
+            self.file_.close()
+
+
+def read_capture(path):
+    """ Read capture file written by CaptureWriter.
+
+    Args:
+        path: File path to read.
+    Returns:
+        (header dict, generator of (seconds from start, device, raw bytes)).
+    Raises:
+        ValueError if the file is not a capture file.
+    """
+    f = _open(path, "r")
+
+    try:
+        header = json.loads(f.readline() or "{}")
+    except ValueError:
+        header = {}
+
+    if not isinstance(header, dict) or header.get("format") != FORMAT_NAME:
+        f.close()
+        raise ValueError("{} is not a capture file".format(path))
+
+    def records():
+        with f:
+            for line in f:
+                if not line.strip():
+                    continue
+                offset, device, raw = json.loads(line)
+                yield offset, device, raw.encode("latin-1")
+
+    return header, records()
+
+
+class ReplaySource(threading.Thread):
+    """ Source to read capture file and put the samples to the callback like
+        GeigerMeter. Each raw line is parsed by the same CpmLineParser as the
+        serial data. The samples have the recorded epoch time, so replaying
+        the same file gives the same samples.
+
+    Arguments:
+        path: Capture file path.
+        callback_to_get_val: Callback function object. See GeigerMeter.
+        speed: Replay speed. 1.0 is the recorded speed and 0 is as fast as possible.
+        usv_per_cpm: Rate of uSv/h.
+    """
+
+    def __init__(self, path, callback_to_get_val, speed=1.0, usv_per_cpm=0.00812):
+        self.header_, self.records_ = read_capture(path)
+        self.callback_ = callback_to_get_val
+        self.speed_ = speed
+        self.usv_per_cpm_ = usv_per_cpm
+        self.stop_event_ = threading.Event()
+        self.count_ = 0
+
+        threading.Thread.__init__(self, name=type(self).__name__)
+
+    def stop(self):
+        """ Stop this thread. """
+        self.stop_event_.set()
+
+    @property
+    def count(self):
+        """ Number of samples put to the callback. """
+        return self.count_
+
+    def run(self):
+        """ Target function of this thread. """
+        parsers = {}
+        epoch = self.header_.get("epoch", 0.0)
+        started = time.monotonic()
+
+        try:
+            for offset, device, raw in self.records_:
+                if self.speed_ > 0:
+                    wait = started + offset / self.speed_ - time.monotonic()
+                    if wait > 0 and self.stop_event_.wait(wait):
+                        break
+                elif self.stop_event_.is_set():
+                    break
+
+                parser = parsers.get(device)
+                if parser is None:
+                    parser = parsers[device] = CpmLineParser(device=device)
+
+                monotonic = time.monotonic()
+
+                for cpm in parser.feed(raw + b"\n"):
+                    self.callback_(Sample(
+                        device, monotonic, epoch + offset, cpm, cpm * self.usv_per_cpm_))
+                    self.count_ += 1
+        except Exception as e:
+            logger.error("{} raised in {}.".format(type(e).__name__, type(self).__name__))
+            raise
+        finally:
+            self.records_.close()
+
+        logger.info("%s samples are replayed by %s.", self.count_, type(self).__name__)
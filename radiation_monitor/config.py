@@ -15,18 +15,268 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from event_listener.trigger import DataIsUpdatedTrigger
-from event_listener.handler import KeenIoEventHandler
-from event_listener.handler import XivelyEventHandler
-from event_listener.handler import TweetBotEventHandler
-from radiation_monitor.event import SafeCastFixedLocationEventHandler
+from radiation_monitor import backends
+from radiation_monitor import logger
+from radiation_monitor import metrics
+from radiation_monitor.aggregate import WindowAggregator
+from radiation_monitor.sample import Gap
+from radiation_monitor.sample import USV_LABEL
+from radiation_monitor.threshold import ThresholdDetector
+from radiation_monitor.timer import Scheduler
+
+
+class _Dispatcher(threading.Thread):
+    """ Thread to hand data over to one event trigger so that the caller of
+        ListTrigger.put never waits for the trigger or its event handlers.
+
+    Args:
+        trigger: event trigger object to put data to.
+        name: name of the trigger to be shown in the statistics.
+        q_max: max number of pending data. The oldest one is dropped if over.
+    Returns:
+        Instance object
+    """
+
+    def __init__(self, trigger, name, q_max):
+        self.trigger_ = trigger
+        self.label_ = name
+        self.q_max_ = q_max
+        self.q_ = deque()
+        self.cond_ = threading.Condition()
+        self.is_busy_ = False
+        self.is_paused_ = False
+        self.is_stopped_ = False
+        self.put_count_ = 0
+        self.drop_count_ = 0
+        self.max_depth_ = 0
+        self.blocked_sec_ = 0.0
+
+        threading.Thread.__init__(self, name="{}({})".format(type(self).__name__, name))
+        self.daemon = True
+
+    def put(self, data):
+        """ Queue data without blocking.
+
+        Args:
+            data: data object to be put to the trigger.
+        Returns:
+            None
+        """
+        with self.cond_:
+            if len(self.q_) >= self.q_max_:
+                self.q_.popleft()
+                self.drop_count_ += 1
+
+            self.q_.append(data)
+            self.put_count_ += 1
+            self.max_depth_ = max(self.max_depth_, len(self.q_))
+            self.cond_.notify_all()
+
+    def drain(self, timeout=None):
+        """ Wait until all queued data is passed to the trigger.
+
+        Args:
+            timeout: max seconds to wait. Wait forever if None.
+        Returns:
+            True if drained, False if timed out.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.cond_:
+            while self.q_ or self.is_busy_:
+                if deadline is None:
+                    self.cond_.wait()
+                    continue
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.cond_.wait(remaining)
+
+        return True
+
+    def stop(self):
+        """ Stop this thread after the queued data is passed to the trigger. """
+        with self.cond_:
+            self.is_stopped_ = True
+            self.cond_.notify_all()
+
+    def stats(self):
+        """ Return the counters of this dispatcher.
+
+        Returns:
+            dict with name, depth, max_depth, put, dropped, blocked_sec and
+            paused.
+        """
+        with self.cond_:
+            return {
+                "name": self.label_,
+                "depth": len(self.q_) + (1 if self.is_busy_ else 0),
+                "max_depth": self.max_depth_,
+                "put": self.put_count_,
+                "dropped": self.drop_count_,
+                "blocked_sec": self.blocked_sec_,
+                "paused": self.is_paused_,
+            }
+
+    def pause(self, is_waiting=True):
+        """ Keep the data in the queue instead of passing it to the trigger
+            until resume().
+
+        Args:
+            is_waiting: If True, return after the data being passed now is
+                accepted by the trigger. If False, return at once and the
+                data being passed now still goes to the trigger.
+        Returns:
+            None
+        """
+        with self.cond_:
+            self.is_paused_ = True
+            while is_waiting and self.is_busy_:
+                self.cond_.wait()
+
+    def resume(self, trigger, is_paused=False):
+        """ Pass the data to the trigger again.
+
+        Args:
+            trigger: event trigger object to put data to from now on.
+            is_paused: If True, keep paused with the new trigger.
+        Returns:
+            None
+        """
+        with self.cond_:
+            self.trigger_ = trigger
+            self.is_paused_ = is_paused
+            self.cond_.notify_all()
+
+    def run(self):
+        """ Target function of this thread. """
+        while True:
+            with self.cond_:
+                while (not self.q_ or self.is_paused_) and not self.is_stopped_:
+                    self.cond_.wait()
+
+                # the data of paused dispatcher is discarded at stopping.
+                if not self.q_ or self.is_paused_:
+                    break
+
+                data = self.q_.popleft()
+                self.is_busy_ = True
+
+            started = time.monotonic()
+
+            try:
+                self.trigger_.put_q(data)
+            except Exception as e:
+                logger.error("{} at putting data to {} in {}".format(
+                    type(e).__name__, self.label_, type(self).__name__))
+            finally:
+                with self.cond_:
+                    self.blocked_sec_ += time.monotonic() - started
+                    self.is_busy_ = False
+                    self.cond_.notify_all()
 
 
 class ListTrigger(list):
-    """ List of trigger object extending list. """
+    """ List of trigger object extending list.
+
+        A trigger appended with window gets one aggregate.AggregatedSample
+        per device every window seconds instead of every sample. A trigger
+        appended as alert trigger gets only the alerts of detectors added by
+        add_detector() instead of samples.
 
-    def __init__(self):
+    Args:
+        is_blocking: If True, put() waits until all triggers consume the data
+            like the old behavior. Otherwise put() just queues the data and
+            returns immediately (fire-and-forget).
+        q_max: max number of pending data per trigger in non-blocking mode.
+    Returns:
+        Instance object
+    """
+
+    def __init__(self, is_blocking=False, q_max=1000):
         list.__init__(self)
+        self.is_blocking_ = is_blocking
+        self.q_max_ = q_max
+        self.names_ = {}
+        self.windows_ = {}
+        self.alerts_ = set()
+        self.breakers_ = {}
+        self.handlers_ = {}
+        self.paused_ = set()
+        self.detectors_ = []
+        self.dispatchers_ = []
+        self.aggregators_ = {}
+        self.scheduler_ = None
+        self.replace_lock_ = threading.Lock()
+        self.puts_ = []
+        self.alert_puts_ = []
+
+    def append(self, trigger, name=None, window=None, is_alert=False, breaker=None, handler=None):
+        """ Append event trigger.
+
+        Args:
+            trigger: event trigger object.
+            name: name of the trigger shown in stats(). Type name if None.
+            window: seconds to aggregate samples before putting to the
+                trigger. Every sample is put if None or 0.
+            is_alert: If True, the trigger gets alerts instead of samples.
+            breaker: event.CircuitBreakerEventHandler of the handler in the
+                trigger to show in health().
+            handler: event handler in the trigger to flush by flush_now().
+        Returns:
+            None
+        """
+        self.names_[id(trigger)] = name if name else type(trigger).__name__
+        if is_alert:
+            self.alerts_.add(id(trigger))
+        elif window:
+            self.windows_[id(trigger)] = window
+        if breaker is not None:
+            self.breakers_[id(trigger)] = breaker
+        if handler is not None:
+            self.handlers_[id(trigger)] = handler
+        list.append(self, trigger)
+
+    def _forget(self, trigger):
+        for settings in (self.names_, self.windows_, self.breakers_, self.handlers_):
+            settings.pop(id(trigger), None)
+        self.alerts_.discard(id(trigger))
+
+    def add_detector(self, detector):
+        """ Add detector which gets every sample put to this list. The
+            detector should call put_alert() when it detects something.
+
+        Args:
+            detector: object having put(sample) method.
+        Returns:
+            None
+        """
+        self.detectors_.append(detector)
+
+    def name_of(self, trigger):
+        """ Return the name of the specified trigger. """
+        return self.names_.get(id(trigger), type(trigger).__name__)
+
+    def window_of(self, trigger):
+        """ Return the aggregation window of the specified trigger or None. """
+        return self.windows_.get(id(trigger))
+
+    def is_alert(self, trigger):
+        """ Return True if the specified trigger gets alerts. """
+        return id(trigger) in self.alerts_
+
+    def _put_to_trigger(self, trigger):
+        def put(data):
+            trigger.put_q(data)
+            trigger.join_q()
+        return put
 
     def start(self):
         """ Start all event triggers. At the same time, the all event handler
@@ -35,38 +285,463 @@ class ListTrigger(list):
         for trigger in self:
             trigger.start()
 
+        if not self.is_blocking_:
+            self.dispatchers_ = [
+                _Dispatcher(trigger, self.name_of(trigger), self.q_max_) for trigger in self]
+
+            for dispatcher in self.dispatchers_:
+                dispatcher.start()
+
+            puts = [dispatcher.put for dispatcher in self.dispatchers_]
+        else:
+            puts = [self._put_to_trigger(trigger) for trigger in self]
+
+        if self.windows_:
+            self.scheduler_ = Scheduler()
+            self.aggregators_ = {}
+
+            for i, trigger in enumerate(self):
+                window = self.window_of(trigger)
+                if window:
+                    aggregator = WindowAggregator(window, puts[i], self.scheduler_)
+                    aggregator.start()
+                    self.aggregators_[id(trigger)] = aggregator
+                    puts[i] = aggregator.put
+
+            self.scheduler_.start()
+
+        self.puts_ = [put for put, trigger in zip(puts, self) if not self.is_alert(trigger)]
+        self.alert_puts_ = [put for put, trigger in zip(puts, self) if self.is_alert(trigger)]
+
+        metrics.REGISTRY.add_collector(self.collect_metrics)
+
     def stop(self):
-        """ Stop event trigger/handler. """
+        """ Stop event trigger/handler. The data not dispatched yet is passed
+            to the triggers before stopping, including the partial windows.
+        """
+        metrics.REGISTRY.remove_collector(self.collect_metrics)
+
+        if self.scheduler_ is not None:
+            self.scheduler_.stop()
+            self.scheduler_ = None
+
+        for aggregator in self.aggregators_.values():
+            aggregator.stop()
+
+        self.aggregators_ = {}
+        self.puts_ = []
+        self.alert_puts_ = []
+
+        # the data kept by pause() is passed to the triggers too.
+        for trigger, dispatcher in zip(self, self.dispatchers_):
+            if self.name_of(trigger) in self.paused_:
+                dispatcher.resume(trigger)
+        self.paused_.clear()
+
+        for dispatcher in self.dispatchers_:
+            dispatcher.stop()
+
+        for dispatcher in self.dispatchers_:
+            dispatcher.join()
+
+        self.dispatchers_ = []
+
+        # let the triggers pass the rest to their handlers.
+        for trigger in self:
+            trigger.join_q()
+
         for trigger in self:
             trigger.stop()
 
         for trigger in self:
             trigger.join()
 
+    def replace(self, name, create, restore=None):
+        """ Replace the trigger of the name while running. The data for the
+            trigger is kept in its queue while replacing, so nothing is
+            dropped unless the queue gets full. The old trigger passes the
+            data it already has to its handlers before stopping.
+
+        Args:
+            name: name of the trigger given to append(). The new trigger is
+                added if there is no trigger of the name.
+            create: function returning (trigger, window, is_alert, breaker,
+                handler) tuple of the new trigger, or None to remove it. This
+                is called after the old trigger stops, so that the new one
+                can use the same resources like the spool directory.
+            restore: function returning the same tuple as create with the
+                settings of the old trigger. This is called if create raises,
+                so that the handler keeps running with the old settings.
+        Returns:
+            None
+        Raises:
+            RuntimeError if this is blocking mode.
+            Exception raised by create. The trigger is restored or removed
+            before raising.
+        """
+        if self.is_blocking_:
+            raise RuntimeError("{} in blocking mode can't replace trigger".format(type(self).__name__))
+
+        with self.replace_lock_:
+            old = next((trigger for trigger in self if self.name_of(trigger) == name), None)
+            i = None
+            dispatcher = None
+            aggregator = None
+            old_window = None
+
+            if old is not None:
+                i = [id(trigger) for trigger in self].index(id(old))
+                dispatcher = self.dispatchers_[i]
+                aggregator = self.aggregators_.pop(id(old), None)
+                old_window = self.window_of(old)
+
+                dispatcher.pause()
+                old.join_q()
+                old.stop()
+                old.join()
+                self._forget(old)
+
+            try:
+                created = create()
+            except Exception:
+                # the old trigger has stopped. never leave its dispatcher
+                # paused with the data piling up.
+                created = None
+                if old is not None and restore is not None:
+                    try:
+                        created = restore()
+                    except Exception as e:
+                        logger.error("{} at restoring {} in {}".format(type(e).__name__, name, type(self).__name__))
+
+                self._install(name, created, i, dispatcher, aggregator, old_window)
+                raise
+
+            self._install(name, created, i, dispatcher, aggregator, old_window)
+
+    def _install(self, name, created, i, dispatcher, aggregator, old_window):
+        if created is None:
+            if i is not None:
+                if aggregator is not None:
+                    aggregator.stop()
+                dispatcher.stop()
+                dispatcher.join()
+                del self[i]
+                del self.dispatchers_[i]
+            self.paused_.discard(name)
+            self._update_puts()
+            return
+
+        trigger, window, is_alert, breaker, handler = created
+        self.names_[id(trigger)] = name
+        if is_alert:
+            self.alerts_.add(id(trigger))
+        elif window:
+            self.windows_[id(trigger)] = window
+        if breaker is not None:
+            self.breakers_[id(trigger)] = breaker
+        if handler is not None:
+            self.handlers_[id(trigger)] = handler
+
+        trigger.start()
+
+        if i is None:
+            dispatcher = _Dispatcher(trigger, name, self.q_max_)
+            dispatcher.start()
+            list.append(self, trigger)
+            self.dispatchers_.append(dispatcher)
+        else:
+            self[i] = trigger
+            dispatcher.resume(trigger, is_paused=name in self.paused_)
+
+        # the partial window is put to the new trigger if window changes.
+        window = self.window_of(trigger)
+        if aggregator is not None and window != old_window:
+            aggregator.stop()
+            aggregator = None
+
+        if aggregator is None and window:
+            if self.scheduler_ is None:
+                self.scheduler_ = Scheduler()
+                self.scheduler_.start()
+            aggregator = WindowAggregator(window, dispatcher.put, self.scheduler_)
+            aggregator.start()
+
+        if aggregator is not None:
+            self.aggregators_[id(trigger)] = aggregator
+
+        self._update_puts()
+
+    def _update_puts(self):
+        puts = []
+        alert_puts = []
+
+        for trigger, dispatcher in zip(self, self.dispatchers_):
+            aggregator = self.aggregators_.get(id(trigger))
+            put = aggregator.put if aggregator is not None else dispatcher.put
+            (alert_puts if self.is_alert(trigger) else puts).append(put)
+
+        self.puts_ = puts
+        self.alert_puts_ = alert_puts
+
     def put(self, data):
-        """ Put data to all event trigger.
+        """ Put data to all event trigger. This doesn't block in non-blocking
+            mode even if some event handler is slow.
 
         Args:
-            data: data object to be put to all trigger.
+            data: data object to be put to all trigger. sample.Gap is only
+                logged since the handlers and detectors need cpm.
         Returns:
             None
         """
-        for trigger in self:
+        if isinstance(data, Gap):
+            logger.warning("%s", data)
+            return
+
+        for detector in self.detectors_:
+            detector.put(data)
+
+        if not self.is_blocking_ or self.windows_:
+            for put in self.puts_:
+                put(data)
+            return
+
+        triggers = [trigger for trigger in self if not self.is_alert(trigger)]
+
+        for trigger in triggers:
             trigger.put_q(data)
 
+        for trigger in triggers:
+            trigger.join_q()
+
+    def put_alert(self, alert):
+        """ Put alert to the alert triggers in the same way as put().
+
+        Args:
+            alert: alert object like rolling.AnomalyAlert.
+        Returns:
+            None
+        """
+        logger.warning("%s", alert)
+
+        for put in self.alert_puts_:
+            put(alert)
+
+    def flush(self, timeout=None):
+        """ Wait until all data put so far is consumed by all triggers.
+            This is for shutdown and tests.
+
+        Args:
+            timeout: max seconds to wait for the dispatchers. Wait forever if None.
+        Returns:
+            True if all data is dispatched, False if timed out.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        for trigger, dispatcher in zip(self, self.dispatchers_):
+            # paused one keeps its data until resume().
+            if self.name_of(trigger) in self.paused_:
+                continue
+
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if not dispatcher.drain(remaining):
+                return False
+
         for trigger in self:
             trigger.join_q()
 
+        return True
 
-def init_triggers(**kwargs):
-    """ Initialize event triggers and handlers according to settings.
+    def flush_now(self, timeout=None):
+        """ Put the partial windows and let the event handlers send their
+            buffered data now instead of waiting for the window or batch age.
+
+        Args:
+            timeout: max seconds to wait for the dispatchers. Wait forever if None.
+        Returns:
+            True if all data is sent, False if timed out.
+        """
+        for aggregator in list(self.aggregators_.values()):
+            aggregator.emit()
+
+        if not self.flush(timeout):
+            return False
+
+        for trigger in self:
+            if self.name_of(trigger) in self.paused_:
+                continue
+
+            # flush the innermost handler having flush() like batch handlers.
+            handler = self.handlers_.get(id(trigger))
+            while handler is not None and not hasattr(handler, "flush"):
+                handler = getattr(handler, "handler_", None)
+
+            if handler is not None:
+                try:
+                    handler.flush()
+                except Exception as e:
+                    logger.error("{} at flushing {} in {}".format(
+                        type(e).__name__, self.name_of(trigger), type(self).__name__))
+
+        return True
+
+    @contextmanager
+    def _replace_lock_nowait(self):
+        # the control socket calls this on its selector thread, which must
+        # not wait for the rebuilding handlers.
+        if not self.replace_lock_.acquire(False):
+            raise RuntimeError("{} is replacing triggers now".format(type(self).__name__))
+
+        try:
+            yield
+        finally:
+            self.replace_lock_.release()
+
+    def _dispatcher_of(self, name):
+        if self.is_blocking_:
+            raise RuntimeError("{} in blocking mode can't pause trigger".format(type(self).__name__))
+
+        for trigger, dispatcher in zip(self, self.dispatchers_):
+            if self.name_of(trigger) == name:
+                return trigger, dispatcher
+
+        raise KeyError(name)
+
+    def pause(self, name):
+        """ Keep the data for the trigger in its queue instead of passing it
+            to the event handler until resume(), like while the remote service
+            is in maintenance. The oldest data is dropped if the queue is full.
+            This never waits for the event handler, and the data being
+            passed now still goes to it.
+
+        Args:
+            name: name of the trigger given to append().
+        Returns:
+            None
+        Raises:
+            KeyError if there is no trigger of the name.
+            RuntimeError if this is blocking mode or the triggers are being
+            replaced.
+        """
+        with self._replace_lock_nowait():
+            trigger, dispatcher = self._dispatcher_of(name)
+            dispatcher.pause(is_waiting=False)
+            self.paused_.add(name)
+
+    def resume(self, name):
+        """ Pass the data kept by pause() to the trigger.
+
+        Args:
+            name: name of the trigger given to append().
+        Returns:
+            None
+        Raises:
+            KeyError if there is no trigger of the name.
+            RuntimeError if this is blocking mode or the triggers are being
+            replaced.
+        """
+        with self._replace_lock_nowait():
+            trigger, dispatcher = self._dispatcher_of(name)
+            dispatcher.resume(trigger)
+            self.paused_.discard(name)
+
+    def stats(self):
+        """ Return the dispatch counters of each trigger.
+
+        Returns:
+            list of dict with name, depth, max_depth, put, dropped,
+            blocked_sec and paused. blocked_sec is the total time spent
+            waiting for the trigger to accept data. Empty in blocking mode.
+        """
+        return [dispatcher.stats() for dispatcher in self.dispatchers_]
+
+    def health(self):
+        """ Return the health of the event handlers behind circuit breakers.
+
+        Returns:
+            list of dict. See CircuitBreakerEventHandler.health().
+        """
+        return [self.breakers_[id(trigger)].health() for trigger in self if id(trigger) in self.breakers_]
+
+    def collect_metrics(self):
+        """ Return stats() and health() as metrics. This is called by
+            metrics.Registry.
 
+        Returns:
+            list of (name, type, help, samples) tuples.
+        """
+        stats = self.stats()
+        states = ("closed", "half-open", "open")
+
+        def samples(key):
+            return [({"handler": stat["name"]}, stat[key]) for stat in stats]
+
+        return [
+            ("radiation_monitor_circuit_state", "gauge",
+             "Circuit breaker state of event handler. 0: closed, 1: half-open, 2: open",
+             [({"handler": health["name"]}, states.index(health["state"])) for health in self.health()]),
+            ("radiation_monitor_queue_depth", "gauge",
+             "Data waiting to be put to event handler", samples("depth")),
+            ("radiation_monitor_queue_max_depth", "gauge",
+             "Max number of data waited to be put to event handler", samples("max_depth")),
+            ("radiation_monitor_queue_dropped_total", "counter",
+             "Data dropped since the queue of event handler is full", samples("dropped")),
+            ("radiation_monitor_queue_blocked_seconds_total", "counter",
+             "Seconds waiting for event handler to accept data", samples("blocked_sec")),
+        ]
+
+
+# handlers which get alerts instead of readings.
+ALERT_HANDLERS = ("twitter",)
+
+# names of all event handlers in the order of init_handlers().
+HANDLER_NAMES = ("database", "safecast", "keenio", "xively", "twitter")
+
+# settings without the handler name prefix which the handler depends on.
+HANDLER_KEYS = {
+    "safecast": ("latitude", "longitude"),
+}
+
+# settings which all handlers except the local database depend on.
+COMMON_KEYS = ("window", "spool_dir", "spool_max_mb", "spool_replay_rate", "breaker_failures", "breaker_reset")
+
+# settings of the detectors.
+DETECTOR_KEYS = ("alert_usv", "alert_clear_usv", "alert_interval", "anomaly_window", "anomaly_threshold", "anomaly_drift")
+
+
+def handler_config(name, **kwargs):
+    """ Return the settings which the event handler depends on.
+
+    Args:
+        name: Name of the event handler like "safecast".
+        kwargs: see init_args() function to know what option is there.
+    Returns:
+        dict of the settings.
+    """
+    keys = HANDLER_KEYS.get(name, ()) + (COMMON_KEYS if name != "database" else ())
+    prefix = "{}_".format(name)
+
+    return dict((key, val) for key, val in kwargs.items() if key.startswith(prefix) or key in keys)
+
+
+def init_handlers(names=HANDLER_NAMES, **kwargs):
+    """ Initialize event handlers according to settings.
+
+    Args:
+        names: Names of the event handlers to initialize.
     Keyword Args:
         kwargs: see init_args() function to know what option is there.
     Returns:
-        list of event triggers which have event hnadlers according to config setting.
+        list of (name, event handler) tuples according to config setting.
     """
-    data_updated_trigger = DataIsUpdatedTrigger()
+    # backends are imported here only if configured. requests, numpy and
+    # the clients of remote services are slow to import and use memory.
+    handlers = []
+
+    if "database" in names and kwargs.get("database_path"):
+        handlers.append(("database", backends.load("database")(
+            kwargs["database_path"],
+            batch_max=kwargs["database_batch_max"],
+            batch_age=kwargs["database_batch_age"])))
 
     def get_configs(*configs):
         for conf in configs:
@@ -80,22 +755,29 @@ def init_triggers(**kwargs):
         kwargs["latitude"],
         kwargs["longitude"])
 
-    if configs:
-        data_updated_trigger.append(SafeCastFixedLocationEventHandler(*configs))
+    if configs and "safecast" in names:
+        if kwargs.get("safecast_batch_max", 1) > 1:
+            handler = backends.load("safecast_batch")(
+                *configs,
+                batch_max=kwargs["safecast_batch_max"],
+                batch_age=kwargs["safecast_batch_age"])
+        else:
+            handler = backends.load("safecast")(*configs)
+        handlers.append(("safecast", handler))
 
     configs = get_configs(
         kwargs["keenio_project_id"],
         kwargs["keenio_write_key"])
 
-    if configs:
-        data_updated_trigger.append(KeenIoEventHandler(*configs))
+    if configs and "keenio" in names:
+        handlers.append(("keenio", backends.load("keenio")(*configs)))
 
     configs = get_configs(
         kwargs["xively_api_key"],
         kwargs["xively_feed_key"])
 
-    if configs:
-        data_updated_trigger.append(XivelyEventHandler(*configs))
+    if configs and "xively" in names:
+        handlers.append(("xively", backends.load("xively")(*configs)))
 
     configs = get_configs(
         kwargs["twitter_consumer_key"],
@@ -103,23 +785,173 @@ def init_triggers(**kwargs):
         kwargs["twitter_key"],
         kwargs["twitter_secret"])
 
-    if configs:
+    if configs and "twitter" in names:
         kwconfigs = {}
         kwconfigs["msgs"] = [
-            "バッテリ電圧がかなり低下しています。",
-            "現在{VALUE}[{UNIT}]ですので、PCサーバ等の電源を落とします。",
+            "放射線量が上昇しています。",
+            "現在{VALUE}[{UNIT}]です。",
             "{YEAR}年{MONTH}月{DAY}日{HOUR}時{MINUTE}分に取得したデータを元にしています。"]
-        kwconfigs["value_label"] = "Battery Voltage"
+        kwconfigs["value_label"] = USV_LABEL
 
-        # remove "battery_limit" member.
-        configs.pop(0)
-        data_updated_trigger.append(TweetBotEventHandler(*configs, **kwconfigs))
+        handlers.append(("twitter", backends.load("twitter")(*configs, **kwconfigs)))
 
+    return handlers
+
+
+def init_triggers(**kwargs):
+    """ Initialize event triggers and handlers according to settings.
+
+    Keyword Args:
+        kwargs: see init_args() function to know what option is there.
+    Returns:
+        list of event triggers which have event hnadlers according to config setting.
+        Each event handler has its own trigger so that a slow handler never
+        delays the others. Remote handlers get samples averaged over the
+        window specified for each.
+    """
     triggers = ListTrigger()
-    triggers.append(data_updated_trigger)
+
+    for name, handler in init_handlers(**kwargs):
+        trigger, window, is_alert, breaker, handler = init_trigger(name, handler, **kwargs)
+        triggers.append(trigger, name, window=window, is_alert=is_alert, breaker=breaker, handler=handler)
+
+    for detector in init_detectors(triggers, **kwargs):
+        triggers.add_detector(detector)
+
+    if not triggers.detectors_ and any(triggers.is_alert(t) for t in triggers):
+        logger.warning("No alert is sent since neither --alert-usv nor --anomaly-window is set.")
 
     return triggers
 
 
+def init_trigger(name, handler, **kwargs):
+    """ Initialize event trigger of the event handler.
+
+    Args:
+        name: Name of the event handler like "safecast".
+        handler: event handler object.
+    Keyword Args:
+        kwargs: see init_args() function to know what option is there.
+    Returns:
+        (trigger, window, is_alert, breaker, handler) tuple to be appended to
+        ListTrigger. handler is the outermost one like the spool.
+    """
+    breaker = init_breaker(name, handler, **kwargs)
+    if breaker is not None:
+        handler = breaker
+
+    # local database doesn't need spool in front of it.
+    if kwargs.get("spool_dir") and name != "database":
+        handler = backends.load("spool")(
+            handler,
+            os.path.join(kwargs["spool_dir"], name),
+            replay_rate=kwargs["spool_replay_rate"],
+            max_bytes=kwargs["spool_max_mb"] * 1024 * 1024)
+
+    # local database keeps every reading and has rollups itself.
+    window = None
+    if name != "database":
+        window = kwargs.get("{}_window".format(name))
+        if window is None:
+            window = kwargs.get("window")
+
+    data_updated_trigger = DataIsUpdatedTrigger()
+    data_updated_trigger.append(handler)
+
+    return data_updated_trigger, window, name in ALERT_HANDLERS, breaker, handler
+
+
+def init_breaker(name, handler, **kwargs):
+    """ Initialize circuit breaker in front of the event handler.
+
+    Args:
+        name: Name of the event handler like "safecast".
+        handler: event handler object.
+    Keyword Args:
+        kwargs: see init_args() function to know what option is there.
+    Returns:
+        event.CircuitBreakerEventHandler object, or None if disabled.
+    """
+    # remote services may be down for long. stop calling them while they
+    # fail. spool keeps the data instead of shedding it if enabled.
+    if not kwargs.get("breaker_failures") or name == "database":
+        return None
+
+    return backends.load("breaker")(
+        handler,
+        name,
+        failures=kwargs["breaker_failures"],
+        reset_timeout=kwargs["breaker_reset"],
+        is_shedding=not kwargs.get("spool_dir"))
+
+
+def init_detectors(triggers, **kwargs):
+    """ Initialize detectors which put alerts to the triggers.
+
+    Args:
+        triggers: ListTrigger object to put alerts to.
+    Keyword Args:
+        kwargs: see init_args() function to know what option is there.
+    Returns:
+        list of detectors.
+    """
+    detectors = []
+
+    if kwargs.get("anomaly_window"):
+        # numpy is imported only if anomaly detection is enabled.
+        from radiation_monitor.rolling import AnomalyDetector
+        detectors.append(AnomalyDetector(
+            triggers.put_alert,
+            kwargs["anomaly_window"],
+            threshold=kwargs["anomaly_threshold"],
+            drift=kwargs["anomaly_drift"]))
+
+    if kwargs.get("alert_usv"):
+        detectors.append(ThresholdDetector(
+            triggers.put_alert,
+            kwargs["alert_usv"],
+            low=kwargs.get("alert_clear_usv"),
+            interval=kwargs["alert_interval"]))
+
+    return detectors
+
+
+def reload_triggers(triggers, old_kwargs, new_kwargs):
+    """ Rebuild only the event handlers and detectors whose settings are
+        changed. The other handlers keep running with their queued data.
+
+    Args:
+        triggers: ListTrigger object returned by init_triggers() and started.
+        old_kwargs: settings which the triggers are built with.
+        new_kwargs: new settings.
+    Returns:
+        list of names of the rebuilt event handlers and "detectors" if the
+        detectors are rebuilt.
+    Raises:
+        Exception raised by building the handler of invalid settings. The
+        handler keeps running with the old settings.
+    """
+    changed = []
+
+    for name in HANDLER_NAMES:
+        if handler_config(name, **old_kwargs) == handler_config(name, **new_kwargs):
+            continue
+
+        def create(name=name, kwargs=new_kwargs):
+            handlers = init_handlers(names=(name,), **kwargs)
+            if not handlers:
+                return None
+            return init_trigger(name, handlers[0][1], **kwargs)
+
+        triggers.replace(name, create, restore=lambda name=name: create(name, old_kwargs))
+        changed.append(name)
+
+    if any(old_kwargs.get(key) != new_kwargs.get(key) for key in DETECTOR_KEYS):
+        triggers.detectors_ = init_detectors(triggers, **new_kwargs)
+        changed.append("detectors")
+
+    return changed
+
+
 if __name__ == "__main__":
     pass
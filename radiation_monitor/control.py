@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Local control socket to query the running daemon."""
+
+import json
+import os
+import selectors
+import socket
+import stat
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from radiation_monitor import logger
+from radiation_monitor import source
+
+
+class ControlError(Exception):
+    """Exception if the daemon returns an error for the request."""
+    pass
+
+
+def sample_to_dict(sample, monotonic=None):
+    """ Return the sample as JSON serializable dict.
+
+    Args:
+        sample: sample.Sample object.
+        monotonic: time.monotonic() now to tell the age of the sample.
+    Returns:
+        dict with device, at, epoch, cpm, usv and age in seconds.
+    """
+    if monotonic is None:
+        monotonic = time.monotonic()
+
+    return {
+        "device": sample.device,
+        "at": datetime.utcfromtimestamp(sample.epoch).isoformat() + "Z",
+        "epoch": sample.epoch,
+        "cpm": sample.cpm,
+        "usv": sample.usv,
+        "age": round(max(0.0, monotonic - sample.monotonic), 3),
+    }
+
+
+def query(path, command, timeout=1.0, **params):
+    """ Send the request to the control socket of the daemon and return the
+        result.
+
+    Args:
+        path: Path of the control socket.
+        command: Command name like "last".
+        timeout: Seconds to wait for connecting and the response.
+    Keyword Args:
+        params: Parameters of the command.
+    Returns:
+        Result of the command decoded from JSON.
+    Raises:
+        IOError or OSError if the daemon is not running.
+        ControlError if the daemon returns an error.
+    """
+    request = dict(params, command=command)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    finally:
+        sock.close()
+
+    if not line:
+        raise ControlError("No response from {}".format(path))
+
+    response = json.loads(line.decode("utf-8"))
+    if not response.get("ok"):
+        raise ControlError(response.get("error"))
+
+    return response.get("result")
+
+
+class _Connection(object):
+    __slots__ = ("sock", "rbuf", "wbuf", "is_closing", "is_waiting")
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.rbuf = bytearray()
+        self.wbuf = bytearray()
+        self.is_closing = False
+        # the next requests wait for the blocking command to keep the order.
+        self.is_waiting = False
+
+
+class ControlServer(threading.Thread):
+    """ Server thread of the local control socket. Each request and response
+        is one line of JSON like
+
+            {"command": "last"}
+            {"ok": true, "result": [{"device": "...", "cpm": 20, ...}]}
+
+        Commands:
+            last [device]     last sample of each device
+            devices           per-device counters. See devices().
+            handlers          queue and circuit state of each event handler
+            pause name        keep the data for the event handler queued
+            resume name       pass the queued data to the event handler
+            flush             send partial windows and batches now
+            commands          names of the commands
+
+        The event handler commands are added by add_triggers(). The last
+        sample of each device is cached by update(), which is only a few
+        dict operations to be called on the hot path. Clients are served on
+        a non-blocking selectors loop on this thread, so the geiger counters
+        are never blocked and a slow client never blocks the others. The
+        blocking commands like flush are run on a worker thread and replied
+        when they finish.
+
+    Args:
+        path: Path of the Unix domain socket. Stale socket file is removed.
+        max_request: Max length of one request line.
+        mode: Permission of the socket file.
+    Returns:
+        Instance object
+    Raises:
+        IOError or OSError if the socket is used by another daemon.
+    """
+
+    def __init__(self, path, max_request=4096, mode=0o660):
+        self.path_ = path
+        self.max_request_ = max_request
+        self.commands_ = {}
+        self.blocking_ = set()
+        self.jobs_ = queue.Queue()
+        self.done_ = deque()
+        self.worker_ = None
+        self.last_ = {}
+        self.counts_ = {}
+        self.conns_ = {}
+        self.stop_event_ = threading.Event()
+        self.selector_ = selectors.DefaultSelector()
+
+        self._remove_stale()
+        self.sock_ = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock_.bind(path)
+        os.chmod(path, mode)
+        self.sock_.listen(8)
+        self.sock_.setblocking(False)
+        self.selector_.register(self.sock_, selectors.EVENT_READ, None)
+
+        # socket pair to wake up the selector at stopping.
+        self.wakeup_r_, self.wakeup_w_ = socket.socketpair()
+        self.wakeup_r_.setblocking(False)
+        self.selector_.register(self.wakeup_r_, selectors.EVENT_READ, None)
+
+        self.add_command("last", self.last)
+        self.add_command("devices", self.devices)
+        self.add_command("commands", lambda: sorted(self.commands_))
+
+        threading.Thread.__init__(self, name=type(self).__name__)
+        self.daemon = True
+
+    def _remove_stale(self):
+        try:
+            if not stat.S_ISSOCK(os.stat(self.path_).st_mode):
+                return
+        except (IOError, OSError):
+            return
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path_)
+        except (IOError, OSError):
+            # nobody listens. left by the daemon killed.
+            os.remove(self.path_)
+            return
+        finally:
+            sock.close()
+
+        raise OSError("{} is used by another daemon".format(self.path_))
+
+    @property
+    def path(self):
+        """ Path of the socket. """
+        return self.path_
+
+    def add_command(self, name, function, is_blocking=False):
+        """ Add the command served by this server.
+
+        Args:
+            name: Command name in the request.
+            function: Called with the other keys of the request as keyword
+                arguments on this thread. Return value must be JSON
+                serializable.
+            is_blocking: If True, function is called on the worker thread
+                since it may wait for long, and the response is sent when it
+                returns. The blocking commands are run one by one.
+        Returns:
+            None
+        """
+        self.commands_[name] = function
+
+        if is_blocking:
+            self.blocking_.add(name)
+        else:
+            self.blocking_.discard(name)
+
+    def update(self, sample):
+        """ Cache the sample as the last value of the device.
+
+        Args:
+            sample: sample.Sample object.
+        Returns:
+            None
+        """
+        self.last_[sample.device] = sample
+        self.counts_[sample.device] = self.counts_.get(sample.device, 0) + 1
+
+    def last(self, device=None):
+        """ Return the last sample of each device.
+
+        Args:
+            device: Name of the device. All devices if None.
+        Returns:
+            list of dict. See sample_to_dict().
+        """
+        monotonic = time.monotonic()
+        samples = list(self.last_.values())
+
+        return [
+            sample_to_dict(sample, monotonic)
+            for sample in sorted(samples, key=lambda s: s.device)
+            if device is None or sample.device == device]
+
+    def devices(self):
+        """ Return the counters of each device seen.
+
+        Returns:
+            list of dict with device, samples, lines, parse_errors,
+            disconnects, downtime_sec and last. See sample_to_dict() about
+            last.
+        """
+        last = self.last()
+        counts = dict(self.counts_)
+
+        return [{
+            "device": reading["device"],
+            "samples": counts.get(reading["device"], 0),
+            "lines": source.LINES.labels(reading["device"]).value(),
+            "parse_errors": source.PARSE_ERRORS.labels(reading["device"]).value(),
+            "disconnects": source.DISCONNECTS.labels(reading["device"]).value(),
+            "downtime_sec": source.DOWNTIME.labels(reading["device"]).value(),
+            "last": reading,
+        } for reading in last]
+
+    def add_triggers(self, triggers, timeout=10.0):
+        """ Add the commands to control the event handlers.
+
+        Args:
+            triggers: config.ListTrigger object running.
+            timeout: max seconds for flush to wait for the event handlers.
+        Returns:
+            None
+        """
+        def handlers():
+            health = dict((h["name"], h) for h in triggers.health())
+            return [dict(stat, circuit=health.get(stat["name"])) for stat in triggers.stats()]
+
+        def pause(name):
+            triggers.pause(name)
+            logger.info("%s is paused by control socket.", name)
+
+        def resume(name):
+            triggers.resume(name)
+            logger.info("%s is resumed by control socket.", name)
+
+        self.add_command("handlers", handlers)
+        self.add_command("pause", pause)
+        self.add_command("resume", resume)
+        self.add_command("flush", lambda: triggers.flush_now(timeout), is_blocking=True)
+
+    def _handle(self, line, conn=None):
+        try:
+            request = json.loads(line.decode("utf-8"))
+            if not isinstance(request, dict):
+                raise ValueError("request must be an object")
+            name = request.pop("command", None)
+            function = self.commands_[name]
+        except KeyError:
+            return {"ok": False, "error": "unknown command"}
+        except ValueError as e:
+            return {"ok": False, "error": "invalid request: {}".format(e)}
+
+        if conn is not None and name in self.blocking_:
+            if self.worker_ is None:
+                self.worker_ = threading.Thread(target=self._work, name="{}Worker".format(type(self).__name__))
+                self.worker_.daemon = True
+                self.worker_.start()
+
+            conn.is_waiting = True
+            self.jobs_.put((conn, function, request))
+            return None
+
+        return self._call(function, request)
+
+    def _work(self):
+        while True:
+            job = self.jobs_.get()
+            if job is None:
+                break
+
+            conn, function, request = job
+            self.done_.append((conn, self._call(function, request)))
+
+            try:
+                self.wakeup_w_.send(b"\0")
+            except (IOError, OSError):
+                pass
+
+    def _call(self, function, request):
+        try:
+            return {"ok": True, "result": function(**request)}
+        except TypeError as e:
+            return {"ok": False, "error": "invalid parameters: {}".format(e)}
+        except (KeyError, ValueError, RuntimeError) as e:
+            return {"ok": False, "error": "{}: {}".format(type(e).__name__, e)}
+        except Exception as e:
+            logger.error("{} raised in {}".format(type(e).__name__, type(self).__name__))
+            return {"ok": False, "error": "{}: {}".format(type(e).__name__, e)}
+
+    def _accept(self):
+        while True:
+            try:
+                sock, address = self.sock_.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+
+            sock.setblocking(False)
+            conn = _Connection(sock)
+            self.conns_[sock.fileno()] = conn
+            self.selector_.register(sock, selectors.EVENT_READ, conn)
+
+    def _close(self, conn):
+        self.conns_.pop(conn.sock.fileno(), None)
+        self.selector_.unregister(conn.sock)
+        conn.sock.close()
+
+    def _read(self, conn):
+        try:
+            data = conn.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except (IOError, OSError):
+            data = b""
+
+        if not data:
+            self._close(conn)
+            return
+
+        conn.rbuf += data
+        self._process(conn)
+
+    def _process(self, conn):
+        while not conn.is_closing and not conn.is_waiting:
+            end = conn.rbuf.find(b"\n")
+            if end < 0:
+                if len(conn.rbuf) > self.max_request_:
+                    response = {"ok": False, "error": "request is too long"}
+                    conn.wbuf += json.dumps(response).encode("utf-8") + b"\n"
+                    conn.is_closing = True
+                break
+
+            line = bytes(conn.rbuf[:end])
+            del conn.rbuf[:end + 1]
+
+            if line.strip():
+                response = self._handle(line, conn)
+                if response is not None:
+                    conn.wbuf += json.dumps(response, default=str).encode("utf-8") + b"\n"
+
+        self._write(conn)
+
+    def _finish_blocking(self):
+        try:
+            self.wakeup_r_.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            pass
+
+        while self.done_:
+            conn, response = self.done_.popleft()
+            if self.conns_.get(conn.sock.fileno()) is not conn:
+                # the client has gone while waiting.
+                continue
+
+            conn.is_waiting = False
+            conn.wbuf += json.dumps(response, default=str).encode("utf-8") + b"\n"
+            self._process(conn)
+
+    def _write(self, conn):
+        if conn.wbuf:
+            try:
+                sent = conn.sock.send(conn.wbuf)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except (IOError, OSError):
+                self._close(conn)
+                return
+
+            del conn.wbuf[:sent]
+
+        if conn.wbuf:
+            self.selector_.modify(conn.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, conn)
+        elif conn.is_closing:
+            self._close(conn)
+        else:
+            self.selector_.modify(conn.sock, selectors.EVENT_READ, conn)
+
+    def run(self):
+        """ Target function of this thread. """
+        try:
+            while not self.stop_event_.is_set():
+                for key, events in self.selector_.select():
+                    if key.fileobj is self.sock_:
+                        self._accept()
+                    elif key.fileobj is self.wakeup_r_:
+                        self._finish_blocking()
+                    elif key.data is None:
+                        continue
+                    elif key.fd not in self.conns_:
+                        continue
+                    elif events & selectors.EVENT_WRITE:
+                        self._write(key.data)
+                    else:
+                        self._read(key.data)
+        except Exception as e:
+            logger.error("{} raised in {}.".format(type(e).__name__, type(self).__name__))
+            raise
+        finally:
+            self.jobs_.put(None)
+
+            for conn in list(self.conns_.values()):
+                self._close(conn)
+
+            self.selector_.close()
+            self.sock_.close()
+            self.wakeup_r_.close()
+            self.wakeup_w_.close()
+
+            try:
+                os.remove(self.path_)
+            except (IOError, OSError):
+                pass
+
+    def stop(self):
+        """ Stop this thread. The socket file is removed. """
+        self.stop_event_.set()
+
+        try:
+            self.wakeup_w_.send(b"\0")
+        except (IOError, OSError):
+            pass
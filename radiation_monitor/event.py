@@ -16,8 +16,26 @@
 #   limitations under the License.
 
 import requests
+import threading
+import time
 from collections import OrderedDict
 from event_listener.base import IEventHandler
+from radiation_monitor import logger
+from radiation_monitor import metrics
+from radiation_monitor.sample import Sample
+from radiation_monitor.sample import USV_LABEL
+from radiation_monitor.spool import Spool
+from radiation_monitor.storage import SQLiteStore
+from requests.adapters import HTTPAdapter
+
+SEND_SECONDS = metrics.histogram(
+    "radiation_monitor_send_seconds", "Seconds to send data by event handler", ("handler",))
+SEND_FAILURES = metrics.counter(
+    "radiation_monitor_send_failures_total", "Data which event handler failed to send", ("handler",))
+CIRCUIT_OPENS = metrics.counter(
+    "radiation_monitor_circuit_opens_total", "Times the circuit breaker of event handler opened", ("handler",))
+CIRCUIT_SHED = metrics.counter(
+    "radiation_monitor_circuit_shed_total", "Data not sent since the circuit breaker is open", ("handler",))
 
 
 class SafeCastEventHandler(IEventHandler):
@@ -27,17 +45,122 @@ class SafeCastEventHandler(IEventHandler):
         api_key: API key got from SafeCast web site.
         device_id: Device ID registered to SafeCast.
         q_max: max queue number
+        timeout: (connect, read) timeout seconds of each HTTP request.
+        retries: max number of retries if the request fails.
+        backoff: seconds to wait before the first retry. This is doubled
+            for each retry.
     Returns:
         Instance object
     """
 
     API_URL = "https://api.safecast.org/en-US/measurements"
 
-    def __init__(self, api_key, device_id, q_max=5):
+    def __init__(self, api_key, device_id, q_max=5, timeout=(3.05, 10), retries=3, backoff=0.5):
         self.api_key_ = str(api_key)
         self.device_id_ = str(device_id)
+        self.timeout_ = timeout
+        self.retries_ = retries
+        self.backoff_ = backoff
+
+        # keep the connection alive between measurements.
+        self.session_ = requests.Session()
+        self.session_.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.session_.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+        self.latency_lock_ = threading.Lock()
+        self.latency_count_ = 0
+        self.latency_total_ = 0.0
+        self.latency_last_ = None
+        self.latency_max_ = 0.0
+        self.send_seconds_ = SEND_SECONDS.labels(type(self).__name__)
+        self.send_failures_ = SEND_FAILURES.labels(type(self).__name__)
+
         IEventHandler.__init__(self, q_max)
 
+    def latency(self):
+        """ Return the measured latency of HTTP requests.
+
+        Returns:
+            dict with count, last, mean and max latency in seconds.
+        """
+        with self.latency_lock_:
+            return {
+                "count": self.latency_count_,
+                "last": self.latency_last_,
+                "mean": self.latency_total_ / self.latency_count_ if self.latency_count_ else None,
+                "max": self.latency_max_,
+            }
+
+    def _record_latency(self, sec):
+        with self.latency_lock_:
+            self.latency_count_ += 1
+            self.latency_total_ += sec
+            self.latency_last_ = sec
+            self.latency_max_ = max(self.latency_max_, sec)
+        self.send_seconds_.observe(sec)
+
+    def post(self, url, **kwargs):
+        """ Post data with the pooled session. The request is retried with
+            exponential backoff if the connection fails, it times out or the
+            server returns 5xx status.
+
+        Args:
+            url: URL string to post.
+            kwargs: passed to requests.Session.post like data or json.
+        Returns:
+            requests.Response object of the last request.
+        Raises:
+            requests.ConnectionError, requests.Timeout: If all retries fail.
+        """
+        for attempt in range(self.retries_ + 1):
+            if attempt:
+                time.sleep(self.backoff_ * (2 ** (attempt - 1)))
+
+            started = time.monotonic()
+
+            try:
+                response = self.session_.post(url, timeout=self.timeout_, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.retries_:
+                    self.send_failures_.inc()
+                    raise
+                continue
+
+            self._record_latency(time.monotonic() - started)
+
+            if response.status_code < 500:
+                break
+
+        if response.status_code >= 400:
+            self.send_failures_.inc()
+
+        return response
+
+    @staticmethod
+    def raise_for_status(response):
+        """ Raise requests.HTTPError if the final status is not 2xx so that
+            the caller like CircuitBreakerEventHandler sees the failure.
+
+        Args:
+            response: requests.Response object returned by post().
+        Returns:
+            None
+        """
+        if not 200 <= response.status_code < 300:
+            raise requests.HTTPError(
+                "Status {} from {}".format(response.status_code, response.url), response=response)
+
+    def close(self):
+        """ Close the pooled session. This is called by join() or by the
+            caller running _run() without starting this handler as thread.
+        """
+        self.session_.close()
+
+    def join(self, *args, **kwargs):
+        """ Wait for this handler to finish and close the pooled session. """
+        IEventHandler.join(self, *args, **kwargs)
+        self.close()
+
     def _run(self, data):
         """ Procedure to run when data received from trigger thread.
 
@@ -46,13 +169,41 @@ class SafeCastEventHandler(IEventHandler):
         Raises:
             KeyError: latitude or longitude is missing.
         """
-        self.send(
-            value=data["data"]["value"],
-            unit=data["data"]["unit"],
-            at=data["at"],
-            device_id=self.device_id_,
-            latitude=data["data"]["latitude"],
-            longitude=data["data"]["longitude"])
+        self.send(**self.fields(data))
+
+    def fields(self, data):
+        """ Return the arguments of send() for the data got from trigger.
+
+        Args:
+            data: sample.Sample object, or dict with "at" and "data". If
+                "data" has the value of GeigerMeter, the one in uSv/h is used.
+        Returns:
+            dict object.
+        """
+        if isinstance(data, Sample):
+            return {
+                "value": data.usv,
+                "unit": "usv",
+                "at": data.at,
+                "device_id": self.device_id_,
+                "latitude": None,
+                "longitude": None,
+            }
+
+        measured = data["data"].get(USV_LABEL, data["data"])
+
+        return {
+            "value": measured["value"],
+            "unit": measured["unit"],
+            "at": data["at"],
+            "device_id": self.device_id_,
+            "latitude": measured.get("latitude", data["data"].get("latitude")),
+            "longitude": measured.get("longitude", data["data"].get("longitude")),
+        }
+
+    def url(self):
+        """ Return the URL to post one measurement. """
+        return "{}?api_key={}".format(self.API_URL, self.api_key_)
 
     def send(self, value, unit, at, device_id, latitude, longitude, height="1m", surface="Soil", radiation="Air"):
         """ Send the measured sensor data to SafeCast server.
@@ -67,6 +218,21 @@ class SafeCastEventHandler(IEventHandler):
             height: Height from the ground like "1m" as string
             surface: The type of ground like "Soil" as string
             radiation: The type of radiation like "Air" as string
+        Raises:
+            requests.RequestException if the measurement is not accepted.
+        """
+        data = self.measurement(
+            value, unit, at, device_id, latitude, longitude, height, surface, radiation)
+
+        self.raise_for_status(self.post(self.url(), data=data))
+
+    @staticmethod
+    def measurement(value, unit, at, device_id, latitude, longitude, height="1m", surface="Soil", radiation="Air"):
+        """ Return the form data of one measurement to post to SafeCast.
+            See send() about the arguments.
+
+        Returns:
+            OrderedDict object.
         """
         data = OrderedDict()
         data["utf8"] = "✓"
@@ -81,7 +247,7 @@ class SafeCastEventHandler(IEventHandler):
         data["measurement[surface]"] = surface
         data["measurement[radiation]"] = radiation
 
-        requests.post("{}?api_key={}".format(self.API_URL, self.api_key_), data=data)
+        return data
 
 
 class SafeCastFixedLocationEventHandler(SafeCastEventHandler):
@@ -94,25 +260,550 @@ class SafeCastFixedLocationEventHandler(SafeCastEventHandler):
         latitude: Latitude of the location of geiger counter.
         longitude: Longitude of the location of geiger counter.
         q_max: max queue number
+        kwargs: see SafeCastEventHandler.
     Returns:
         Instance object
     """
 
-    def __init__(self, api_key, device_id, latitude, longitude, q_max=5):
+    def __init__(self, api_key, device_id, latitude, longitude, q_max=5, **kwargs):
         self.latitude_ = latitude
         self.longitude_ = longitude
-        SafeCastEventHandler.__init__(self, api_key, device_id, q_max)
+        SafeCastEventHandler.__init__(self, api_key, device_id, q_max, **kwargs)
+
+    def fields(self, data):
+        """ Return the arguments of send() with the fixed location.
+            See SafeCastEventHandler.fields().
+        """
+        fields = SafeCastEventHandler.fields(self, data)
+        fields["latitude"] = self.latitude_
+        fields["longitude"] = self.longitude_
+        return fields
+
+
+class SafeCastBatchEventHandler(SafeCastFixedLocationEventHandler):
+    """ Event handler class to send data to SafeCast in bulk. Measurements are
+        collected until batch_max of them are buffered or the oldest one gets
+        older than batch_age seconds, then sent by one request. If the bulk
+        request is rejected, each measurement is posted one by one.
+
+    Args:
+        api_key: API key got from SafeCast web site.
+        device_id: Device ID registered to SafeCast.
+        latitude: Latitude of the location of geiger counter.
+        longitude: Longitude of the location of geiger counter.
+        batch_max: max number of measurements sent by one request.
+        batch_age: max seconds to keep a measurement in the buffer.
+        q_max: max queue number
+        kwargs: see SafeCastEventHandler.
+    Returns:
+        Instance object
+    """
+
+    BULK_URL = "https://api.safecast.org/en-US/measurements.json"
+
+    def __init__(self, api_key, device_id, latitude, longitude, batch_max=20, batch_age=60.0, q_max=5, **kwargs):
+        self.batch_max_ = batch_max
+        self.batch_age_ = batch_age
+        self.batch_ = []
+        self.batch_lock_ = threading.Lock()
+        self.send_lock_ = threading.Lock()
+        self.age_timer_ = None
+        self.is_failing_ = False
+        SafeCastFixedLocationEventHandler.__init__(
+            self, api_key, device_id, latitude, longitude, q_max, **kwargs)
+
+    def send(self, *args, **kwargs):
+        """ Buffer the measured sensor data. See SafeCastEventHandler.send()
+            about the arguments. While the last batch is failing, it is sent
+            again first and the data is not buffered if it fails, so that the
+            caller like CircuitBreakerEventHandler sees every failure.
+
+        Raises:
+            requests.RequestException if the failed batch is not sent again.
+        """
+        data = self.measurement(*args, **kwargs)
+
+        if self.is_failing_:
+            self.flush()
+
+        with self.batch_lock_:
+            self.batch_.append(data)
+            is_full = len(self.batch_) >= self.batch_max_
+
+            if not is_full and self.age_timer_ is None:
+                self.age_timer_ = threading.Timer(self.batch_age_, self._flush_quietly)
+                self.age_timer_.daemon = True
+                self.age_timer_.start()
+
+        if is_full:
+            # the data is kept in the batch and sent again by the next send().
+            self._flush_quietly()
+
+    def _flush_quietly(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error("{} at sending batch in {}".format(type(e).__name__, type(self).__name__))
+
+    def flush(self):
+        """ Send all buffered measurements now. The measurements not sent are
+            kept in the buffer to be sent again.
+
+        Returns:
+            None
+        Raises:
+            requests.RequestException if the measurements are not sent.
+        """
+        with self.send_lock_:
+            with self.batch_lock_:
+                batch, self.batch_ = self.batch_, []
+
+                if self.age_timer_ is not None:
+                    self.age_timer_.cancel()
+                    self.age_timer_ = None
+
+            if not batch:
+                return
+
+            try:
+                self.send_batch(batch)
+            except Exception:
+                with self.batch_lock_:
+                    self.batch_[:0] = batch
+                    self.is_failing_ = True
+                raise
+
+            self.is_failing_ = False
+
+    def send_batch(self, batch):
+        """ Send measurements by one bulk request. Fall back to post each of
+            them if the bulk request fails or is rejected.
+
+        Args:
+            batch: list of form data returned by measurement(). The
+                measurements sent are removed from it even if this raises.
+        Returns:
+            None
+        Raises:
+            requests.RequestException at the first measurement not sent.
+        """
+        url = self.url()
+        bulk_url = "{}?api_key={}".format(self.BULK_URL, self.api_key_)
+        bulk = [
+            dict((key[len("measurement["):-1], val) for key, val in data.items() if key.startswith("measurement["))
+            for data in batch]
+
+        try:
+            response = self.post(bulk_url, json={"measurements": bulk})
+            if 200 <= response.status_code < 300:
+                del batch[:]
+                return
+            logger.warning("Bulk upload is rejected with status {} in {}".format(
+                response.status_code, type(self).__name__))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            logger.warning("{} at bulk upload in {}".format(type(e).__name__, type(self).__name__))
+
+        while batch:
+            self.raise_for_status(self.post(url, data=batch[0]))
+            del batch[0]
+
+    def close(self):
+        """ Send the buffered measurements and close the pooled session. """
+        self._flush_quietly()
+        self.session_.close()
+
+    def join(self, *args, **kwargs):
+        """ Wait for this handler to finish and send the buffered measurements. """
+        IEventHandler.join(self, *args, **kwargs)
+        self.close()
+
+
+class SpooledEventHandler(IEventHandler):
+    """ Event handler class to put data into the on-disk spool in front of
+        another event handler. Data is kept on disk while the handler fails
+        and replayed with limited rate after recovery, so that the trigger
+        never waits for the network and data survives restart.
+
+        If the handler has flush() like SafeCastBatchEventHandler, up to
+        replay_batch data is passed and then flush() is called. The data is
+        removed from the spool only after flush() returns, so the data
+        buffered by the handler is not lost.
+
+    Args:
+        handler: Event handler object to pass data to. This is not started as
+            thread but its _run() is called by the replay thread.
+        path: Directory path of the spool.
+        replay_rate: max number of data passed to the handler per second.
+        retry_max: max seconds to wait before retrying the failed data.
+        replay_batch: max number of data passed before flush().
+        q_max: max queue number
+        spool_kwargs: passed to Spool like max_bytes.
+    Returns:
+        Instance object
+    """
+
+    def __init__(self, handler, path, replay_rate=2.0, retry_max=300.0, replay_batch=20, q_max=5, **spool_kwargs):
+        self.handler_ = handler
+        self.spool_ = Spool(path, **spool_kwargs)
+        self.replay_interval_ = 1.0 / replay_rate
+        self.retry_max_ = retry_max
+        self.flush_ = getattr(handler, "flush", None)
+        self.replay_batch_ = replay_batch if self.flush_ is not None else 1
+        self.has_data_ = threading.Event()
+        self.is_stopped_ = threading.Event()
+        self.replay_thread_ = threading.Thread(
+            target=self._replay, name="{}({})".format(type(self).__name__, type(handler).__name__))
+        self.send_seconds_ = SEND_SECONDS.labels(self.replay_thread_.name)
+        self.send_failures_ = SEND_FAILURES.labels(self.replay_thread_.name)
+        self.replay_thread_.daemon = True
+        IEventHandler.__init__(self, q_max)
 
     def _run(self, data):
         """ Procedure to run when data received from trigger thread.
 
         Args:
-            data: Pass to the registered event handlers.
+            data: Pass to the spool.
+        """
+        self.spool_.append(data)
+        self.has_data_.set()
+
+    def _replay(self):
+        retry_wait = self.replay_interval_
+        # number of the peeked data already passed to the handler. They are
+        # not passed again when retrying flush().
+        passed = 0
+
+        while not self.is_stopped_.is_set():
+            batch = self.spool_.peek_batch(self.replay_batch_)
+
+            if not batch:
+                self.spool_.compact()
+                self.has_data_.wait(self.spool_.sync_interval_)
+                self.has_data_.clear()
+                continue
+
+            started = time.monotonic()
+
+            try:
+                for data in batch[passed:]:
+                    self.handler_._run(data)
+                    passed += 1
+
+                if self.flush_ is not None:
+                    self.flush_()
+            except Exception as e:
+                self.send_failures_.inc()
+                logger.error("{} at replaying data to {}. retry after {} sec.".format(
+                    type(e).__name__, type(self.handler_).__name__, retry_wait))
+                self.is_stopped_.wait(retry_wait)
+                retry_wait = min(retry_wait * 2, self.retry_max_)
+                continue
+
+            self.send_seconds_.observe(time.monotonic() - started)
+            self.spool_.commit()
+            passed = 0
+            retry_wait = self.replay_interval_
+            self.is_stopped_.wait(max(0, self.replay_interval_ * len(batch) - (time.monotonic() - started)))
+
+    def start(self):
+        """ Start this handler and the replay thread. """
+        IEventHandler.start(self)
+        self.replay_thread_.start()
+
+    def stop(self):
+        """ Stop this handler and the replay thread. """
+        IEventHandler.stop(self)
+        self.is_stopped_.set()
+        self.has_data_.set()
+
+    def join(self, *args, **kwargs):
+        """ Wait for this handler and the replay thread to finish. """
+        IEventHandler.join(self, *args, **kwargs)
+        self.replay_thread_.join()
+        self.spool_.close()
+
+    def stats(self):
+        """ Return the statistics of the spool. See Spool.stats(). """
+        return self.spool_.stats()
+
+
+class CircuitOpenError(Exception):
+    """Exception if data is not sent since the circuit breaker is open."""
+    pass
+
+
+class CircuitBreakerEventHandler(IEventHandler):
+    """ Event handler class to stop calling another event handler while it
+        keeps failing. The circuit opens after the failures in a row and data
+        is shed without calling the handler. After reset_timeout seconds one
+        data is passed as probe (half-open), and the circuit closes if it
+        succeeds or opens again for the doubled time if it fails.
+
+    Args:
+        handler: Event handler object to pass data to. This is not started as
+            thread but its _run() is called by this handler.
+        name: Name shown in health() and metrics. Type name of handler if None.
+        failures: Number of failures in a row to open the circuit.
+        reset_timeout: Seconds to keep the circuit open before the probe.
+        reset_timeout_max: Max seconds to keep the circuit open.
+        is_shedding: If True, data is dropped while the circuit is open and
+            the failure is only logged. If False, CircuitOpenError or the
+            failure is raised to the caller like SpooledEventHandler to keep
+            the data.
+        q_max: max queue number
+        clock: Function returning the current time in seconds.
+    Returns:
+        Instance object
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, handler, name=None, failures=5, reset_timeout=30.0, reset_timeout_max=600.0,
+                 is_shedding=True, q_max=5, clock=time.monotonic):
+        self.handler_ = handler
+        self.name_ = name if name else type(handler).__name__
+        self.failures_max_ = failures
+        self.reset_timeout_ = reset_timeout
+        self.reset_timeout_max_ = reset_timeout_max
+        self.is_shedding_ = is_shedding
+        self.clock_ = clock
+        self.lock_ = threading.Lock()
+
+        self.state_ = self.CLOSED
+        self.failures_ = 0
+        self.timeout_ = reset_timeout
+        self.retry_at_ = None
+        self.is_probing_ = False
+        self.shed_ = 0
+        self.opens_ = 0
+        self.last_error_ = None
+        self.opens_counter_ = CIRCUIT_OPENS.labels(self.name_)
+        self.shed_counter_ = CIRCUIT_SHED.labels(self.name_)
+        IEventHandler.__init__(self, q_max)
+
+    def _run(self, data):
+        """ Procedure to run when data received from trigger thread.
+
+        Args:
+            data: Pass to the handler if the circuit is not open.
         """
-        self.send(
-            value=data["data"]["value"],
-            unit=data["data"]["unit"],
-            at=data["at"],
-            device_id=self.device_id_,
-            latitude=self.latitude_,
-            longitude=self.longitude_)
+        try:
+            self.call(data)
+        except CircuitOpenError:
+            if not self.is_shedding_:
+                raise
+        except Exception as e:
+            if not self.is_shedding_:
+                raise
+            logger.error("{} raised in {} of {}".format(type(e).__name__, self.name_, type(self).__name__))
+
+    def call(self, data):
+        """ Pass data to the handler through the circuit.
+
+        Args:
+            data: Pass to the handler.
+        Returns:
+            None
+        Raises:
+            CircuitOpenError if the circuit is open, or the exception raised
+            by the handler.
+        """
+        self._through(self.handler_._run, data)
+
+    def flush(self):
+        """ Flush the buffered data of the handler through the circuit if the
+            handler has flush() like SafeCastBatchEventHandler.
+
+        Returns:
+            None
+        Raises:
+            CircuitOpenError if the circuit is open, or the exception raised
+            by the handler.
+        """
+        flush = getattr(self.handler_, "flush", None)
+        if flush is not None:
+            self._through(flush)
+
+    def _through(self, function, *args):
+        self._enter()
+
+        try:
+            function(*args)
+        except Exception as e:
+            self._failed(e)
+            raise
+
+        self._succeeded()
+
+    def _enter(self):
+        with self.lock_:
+            if self.state_ == self.OPEN and self.clock_() >= self.retry_at_:
+                self.state_ = self.HALF_OPEN
+                logger.info("%s: circuit is half-open to probe", self.name_)
+
+            if self.state_ == self.OPEN or (self.state_ == self.HALF_OPEN and self.is_probing_):
+                self.shed_ += 1
+                self.shed_counter_.inc()
+                raise CircuitOpenError(self.name_)
+
+            self.is_probing_ = self.state_ == self.HALF_OPEN
+
+    def _failed(self, error):
+        with self.lock_:
+            self.is_probing_ = False
+            self.failures_ += 1
+            self.last_error_ = "{}: {}".format(type(error).__name__, error)
+
+            if self.state_ == self.HALF_OPEN:
+                self.timeout_ = min(self.timeout_ * 2, self.reset_timeout_max_)
+            elif self.failures_ < self.failures_max_:
+                return
+
+            self.state_ = self.OPEN
+            self.retry_at_ = self.clock_() + self.timeout_
+            self.opens_ += 1
+            self.opens_counter_.inc()
+
+        logger.warning("%s: circuit is opened for %s seconds after %d failures", self.name_, self.timeout_, self.failures_)
+
+    def _succeeded(self):
+        with self.lock_:
+            self.failures_ = 0
+            self.is_probing_ = False
+
+            if self.state_ != self.HALF_OPEN:
+                return
+
+            self.state_ = self.CLOSED
+            self.timeout_ = self.reset_timeout_
+
+        logger.info("%s: circuit is closed", self.name_)
+
+    def health(self):
+        """ Return the health of the handler.
+
+        Returns:
+            dict with name, state ("closed", "open" or "half-open"), failures
+            in a row, shed (data not sent while open), opens (times opened),
+            last_error and retry_in (seconds until the probe while open).
+        """
+        with self.lock_:
+            return {
+                "name": self.name_,
+                "state": self.state_,
+                "failures": self.failures_,
+                "shed": self.shed_,
+                "opens": self.opens_,
+                "last_error": self.last_error_,
+                "retry_in": max(0.0, self.retry_at_ - self.clock_()) if self.state_ == self.OPEN else None,
+            }
+
+    def close(self):
+        """ Flush the buffered data of the handler if it has flush() like
+            SafeCastBatchEventHandler, and close the handler if it has close().
+        """
+        for method in ("flush", "close"):
+            function = getattr(self.handler_, method, None)
+            if function is None:
+                continue
+
+            try:
+                function()
+            except Exception as e:
+                logger.error("{} at {} {} in {}".format(
+                    type(e).__name__, "flushing" if method == "flush" else "closing", self.name_, type(self).__name__))
+
+    def join(self, *args, **kwargs):
+        """ Wait for this handler to finish and flush the buffered data of
+            the handler if it has flush() like SafeCastBatchEventHandler.
+        """
+        IEventHandler.join(self, *args, **kwargs)
+        self.close()
+
+
+class LocalStorageEventHandler(IEventHandler):
+    """ Event handler class to store samples into the local SQLite database
+        with rollups. Samples are written in one transaction when batch_max
+        of them are buffered or the oldest one gets older than batch_age
+        seconds.
+
+    Args:
+        path: File path of SQLite database.
+        batch_max: max number of samples written by one transaction.
+        batch_age: max seconds to keep a sample in the buffer.
+        q_max: max queue number
+    Returns:
+        Instance object
+    """
+
+    def __init__(self, path, batch_max=60, batch_age=10.0, q_max=5):
+        self.store_ = SQLiteStore(path)
+        self.batch_max_ = batch_max
+        self.batch_age_ = batch_age
+        self.batch_ = []
+        self.batch_lock_ = threading.Lock()
+        self.write_lock_ = threading.Lock()
+        self.age_timer_ = None
+        self.send_seconds_ = SEND_SECONDS.labels(type(self).__name__)
+        self.send_failures_ = SEND_FAILURES.labels(type(self).__name__)
+        IEventHandler.__init__(self, q_max)
+
+    def _run(self, data):
+        """ Procedure to run when data received from trigger thread.
+
+        Args:
+            data: sample.Sample object or the old dict shape.
+        """
+        if not isinstance(data, Sample):
+            data = Sample.from_dict(data)
+
+        with self.batch_lock_:
+            self.batch_.append(data)
+            is_full = len(self.batch_) >= self.batch_max_
+
+            if not is_full and self.age_timer_ is None:
+                self.age_timer_ = threading.Timer(self.batch_age_, self.flush)
+                self.age_timer_.daemon = True
+                self.age_timer_.start()
+
+        if is_full:
+            self.flush()
+
+    def flush(self):
+        """ Write all buffered samples now.
+
+        Returns:
+            None
+        """
+        with self.write_lock_:
+            with self.batch_lock_:
+                batch, self.batch_ = self.batch_, []
+
+                if self.age_timer_ is not None:
+                    self.age_timer_.cancel()
+                    self.age_timer_ = None
+
+            if batch:
+                started = time.monotonic()
+
+                try:
+                    self.store_.write(batch)
+                except Exception:
+                    self.send_failures_.inc()
+                    raise
+
+                self.send_seconds_.observe(time.monotonic() - started)
+
+    def close(self):
+        """ Write the buffered samples and close the database. """
+        try:
+            self.flush()
+        finally:
+            self.store_.close()
+
+    def join(self, *args, **kwargs):
+        """ Wait for this handler to finish and write the buffered samples. """
+        IEventHandler.join(self, *args, **kwargs)
+        self.close()
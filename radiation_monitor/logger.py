@@ -14,87 +14,243 @@
 #   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
-
+import atexit
 import logging
+import logging.handlers
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 _LOGGER = logging.getLogger("radiation_monitor")
+_WRITER = None
+
+
+class _BatchFlush(object):
+    """ Mixin for stream handlers to skip flush at each record. The writer
+        thread calls flush_batch() once after writing a batch of records.
+    """
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        logging.StreamHandler.flush(self)
+
+
+class _StreamHandler(_BatchFlush, logging.StreamHandler):
+    pass
+
+
+class _RotatingFileHandler(_BatchFlush, logging.handlers.RotatingFileHandler):
+    pass
+
+
+class _TimedRotatingFileHandler(_BatchFlush, logging.handlers.TimedRotatingFileHandler):
+    pass
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """ Handler to put records to the queue as they are. The message is
+        formatted with the arguments later by the writer thread, and the
+        record is dropped instead of blocking if the queue is full.
+    """
+
+    def __init__(self, q):
+        logging.handlers.QueueHandler.__init__(self, q)
+        self.dropped_ = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_ += 1
+
+
+class _Writer(threading.Thread):
+    """ Thread to write the queued records to the handlers. All records
+        available in the queue are written as one batch and the handlers are
+        flushed once per batch.
+
+    Args:
+        q: queue of records.
+        handlers: list of handlers with flush_batch().
+        batch_max: max number of records in one batch.
+    Returns:
+        Instance object
+    """
+
+    def __init__(self, q, handlers, batch_max=256):
+        self.q_ = q
+        self.handlers_ = handlers
+        self.batch_max_ = batch_max
+        threading.Thread.__init__(self, name=type(self).__name__)
+        self.daemon = True
+
+    def run(self):
+        """ Target function of this thread. """
+        is_stopped = False
+
+        while not is_stopped:
+            batch = [self.q_.get()]
+
+            try:
+                while len(batch) < self.batch_max_:
+                    batch.append(self.q_.get_nowait())
+            except queue.Empty:
+                pass
+
+            for record in batch:
+                if record is None:
+                    is_stopped = True
+                    continue
+
+                for handler in self.handlers_:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+
+            for handler in self.handlers_:
+                try:
+                    handler.flush_batch()
+                except (IOError, OSError):
+                    pass
+
+    def stop(self):
+        """ Write all queued records and stop this thread. """
+        self.q_.put(None)
+        self.join()
+
+        for handler in self.handlers_:
+            handler.close()
 
 
 def configure(
         path_file=None,
         log_format="%(asctime)s %(name)s %(levelname)s: %(message)s",
         date_format="%Y/%m/%d %p %l:%M:%S",
-        is_debug=False):
+        is_debug=False,
+        max_bytes=0,
+        backup_count=5,
+        when=None,
+        q_max=10000):
     """ Configure the logger module to store log onto some file or stdout.
+        Records are put to a queue and written by a background thread, so
+        slow stdout or disk never blocks the caller. Call again to change
+        the setting. shutdown() is called at exit to write the rest.
 
     Args:
         path_file: File path string to store log.
         log_format: String to specify the format to logging module.
         date_format: String to specify the format of date to logging module.
         debug: Set debug level as logging.DEBUG if True.
+        max_bytes: Rotate the log file when it gets larger than this. Never if 0.
+        backup_count: Number of rotated log files to keep.
+        when: Rotate the log file by time like "midnight" instead of size.
+            See logging.handlers.TimedRotatingFileHandler.
+        q_max: Max number of records waiting to be written. Records over
+            this are dropped.
     Returns:
         None
     """
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter(fmt=log_format, datefmt=date_format)
+    global _WRITER
+
+    shutdown()
 
-    handler.setFormatter(formatter)
-    _LOGGER.addHandler(handler)
+    formatter = logging.Formatter(fmt=log_format, datefmt=date_format)
+    handlers = [_StreamHandler()]
 
     if path_file:
-        handler = logging.FileHandler(path_file, mode="a")
+        if when:
+            handlers.append(_TimedRotatingFileHandler(path_file, when=when, backupCount=backup_count))
+        else:
+            handlers.append(_RotatingFileHandler(
+                path_file, mode="a", maxBytes=max_bytes, backupCount=backup_count))
+
+    for handler in handlers:
         handler.setFormatter(formatter)
-        _LOGGER.addHandler(handler)
+
+    q = queue.Queue(q_max)
+    _WRITER = _Writer(q, handlers)
+    _WRITER.start()
+    _LOGGER.addHandler(_QueueHandler(q))
 
     # to print message with all level if debug is True.
     _LOGGER.setLevel(logging.DEBUG if is_debug else logging.INFO)
 
 
-def debug(message):
+def shutdown():
+    """ Write all queued records and remove the handlers added by configure(). """
+    global _WRITER
+
+    for handler in list(_LOGGER.handlers):
+        if isinstance(handler, _QueueHandler):
+            _LOGGER.removeHandler(handler)
+
+    if _WRITER is not None:
+        _WRITER.stop()
+        _WRITER = None
+
+
+def dropped():
+    """ Return the number of records dropped since the queue was full. """
+    return sum(handler.dropped_ for handler in _LOGGER.handlers if isinstance(handler, _QueueHandler))
+
+
+atexit.register(shutdown)
+
+
+def debug(message, *args):
     """ Print message for debug to stdout, log file, or both according to
-        the initialized setting.
+        the initialized setting. The message is formatted with args like
+        message % args only if it is printed.
 
     Args:
         message: String of message to print.
+        args: Arguments to format the message.
     """
-    _LOGGER.debug(message)
+    _LOGGER.debug(message, *args)
 
 
-def info(message):
-    """ Print message for debug to stdout, log file, or both according to
-        the initialized setting.
+def info(message, *args):
+    """ Print message for information. See debug().
 
     Args:
         message: String of message to print.
+        args: Arguments to format the message.
     """
-    _LOGGER.debug(message)
+    _LOGGER.info(message, *args)
 
 
-def warning(message):
-    """ Print message for debug to stdout, log file, or both according to
-        the initialized setting.
+def warning(message, *args):
+    """ Print message for warning. See debug().
 
     Args:
         message: String of message to print.
+        args: Arguments to format the message.
     """
-    _LOGGER.debug(message)
+    _LOGGER.warning(message, *args)
 
 
-def error(message):
-    """ Print message for debug to stdout, log file, or both according to
-        the initialized setting.
+def error(message, *args):
+    """ Print message for error. See debug().
 
     Args:
         message: String of message to print.
+        args: Arguments to format the message.
     """
-    _LOGGER.debug(message)
+    _LOGGER.error(message, *args)
 
 
-def critical(message):
-    """ Print message for debug to stdout, log file, or both according to
-        the initialized setting.
+def critical(message, *args):
+    """ Print message for critical error. See debug().
 
     Args:
         message: String of message to print.
+        args: Arguments to format the message.
     """
-    _LOGGER.debug(message)
+    _LOGGER.critical(message, *args)
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Lightweight metrics exposed in Prometheus text format over HTTP."""
+
+import bisect
+import threading
+import weakref
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(
+        name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _ShardOwner(object):
+    """ Object which only the thread-local of the updating thread refers to.
+        It is freed when the thread ends.
+    """
+    __slots__ = ("__weakref__",)
+
+
+class _Sharded(object):
+    """ Base of metric child which keeps one shard per thread. The updating
+        thread only touches its own shard without lock, and the shards are
+        merged when collected. The shard of an ended thread is folded into
+        the base value, so that short lived threads like threading.Timer
+        don't make the shards grow.
+    """
+
+    def __init__(self):
+        self.local_ = threading.local()
+        self.lock_ = threading.Lock()
+        self.base_ = self._make_shard()
+        self.shards_ = []
+
+    def _new_shard(self):
+        shard = self._make_shard()
+        owner = _ShardOwner()
+        self.local_.shard = shard
+        self.local_.owner = owner
+
+        with self.lock_:
+            self.shards_.append(shard)
+
+        weakref.finalize(owner, self._fold, shard)
+
+        return shard
+
+    def _fold(self, shard):
+        with self.lock_:
+            for i, val in enumerate(shard):
+                self.base_[i] += val
+            self.shards_.remove(shard)
+
+    def _merged(self):
+        """ Return the sum of the base value and the shards of all threads. """
+        with self.lock_:
+            merged = list(self.base_)
+            for shard in self.shards_:
+                for i, val in enumerate(list(shard)):
+                    merged[i] += val
+
+        return merged
+
+
+class _CounterChild(_Sharded):
+    def _make_shard(self):
+        return [0]
+
+    def inc(self, amount=1):
+        """ Increase the counter of the current thread. """
+        try:
+            shard = self.local_.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard[0] += amount
+
+    def value(self):
+        """ Return the sum of all threads. """
+        return self._merged()[0]
+
+
+class _HistogramChild(_Sharded):
+    def __init__(self, buckets):
+        self.buckets_ = buckets
+        _Sharded.__init__(self)
+
+    def _make_shard(self):
+        # counts of each bucket and +Inf, then the sum.
+        return [0] * (len(self.buckets_) + 1) + [0.0]
+
+    def observe(self, value):
+        """ Add the value to the histogram of the current thread. """
+        try:
+            shard = self.local_.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard[bisect.bisect_left(self.buckets_, value)] += 1
+        shard[-1] += value
+
+    def value(self):
+        """ Return (cumulative counts of buckets with +Inf, sum). """
+        merged = self._merged()
+
+        counts, total = merged[:-1], merged[-1]
+        for i in range(1, len(counts)):
+            counts[i] += counts[i - 1]
+
+        return counts, total
+
+
+class _Metric(object):
+    type_name = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock_ = threading.Lock()
+        self.children_ = {}
+
+    def labels(self, *values):
+        """ Return the child metric of the label values. Keep it to update
+            the metric in hot path without looking up the labels.
+        """
+        if len(values) != len(self.labelnames):
+            raise ValueError("{} needs labels {}".format(self.name, self.labelnames))
+
+        child = self.children_.get(values)
+        if child is None:
+            with self.lock_:
+                child = self.children_.get(values)
+                if child is None:
+                    child = self.children_[values] = self._make_child()
+        return child
+
+    def _children(self):
+        with self.lock_:
+            return sorted(self.children_.items(), key=lambda item: tuple(map(str, item[0])))
+
+    def render(self):
+        """ Return the lines of this metric in Prometheus text format. """
+        lines = [
+            "# HELP {} {}".format(self.name, self.help),
+            "# TYPE {} {}".format(self.name, self.type_name),
+        ]
+        for values, child in self._children():
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class Counter(_Metric):
+    """ Monotonically increasing counter.
+
+    Args:
+        name: Metric name like "radiation_monitor_lines_total".
+        help: Description of the metric.
+        labelnames: Names of the labels.
+    Returns:
+        Instance object
+    """
+
+    type_name = "counter"
+
+    def _make_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        """ Increase the counter without labels. """
+        self.labels().inc(amount)
+
+    def _render_child(self, values, child):
+        return ["{}{} {}".format(
+            self.name, _format_labels(self.labelnames, values), _format_value(child.value()))]
+
+
+class Histogram(_Metric):
+    """ Histogram of observed values like latency.
+
+    Args:
+        name: Metric name like "radiation_monitor_send_seconds".
+        help: Description of the metric.
+        labelnames: Names of the labels.
+        buckets: Sorted upper bounds of the buckets. +Inf is added.
+    Returns:
+        Instance object
+    """
+
+    type_name = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        _Metric.__init__(self, name, help, labelnames)
+
+    def _make_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        """ Observe the value without labels. """
+        self.labels().observe(value)
+
+    def _render_child(self, values, child):
+        counts, total = child.value()
+        lines = []
+
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            lines.append("{}_bucket{} {}".format(
+                self.name, _format_labels(self.labelnames, values, [("le", _format_value(bound))]),
+                count))
+
+        labels = _format_labels(self.labelnames, values)
+        lines.append("{}_sum{} {}".format(self.name, labels, _format_value(total)))
+        lines.append("{}_count{} {}".format(self.name, labels, counts[-1]))
+        return lines
+
+
+class Registry(object):
+    """ Set of metrics and collectors rendered together.
+
+        Collector is a function returning the list of (name, type, help,
+        samples) tuples, where samples is the list of (labels dict, value).
+        It's called only when scraped, so it suits values which are already
+        counted somewhere like queue depth.
+
+    Returns:
+        Instance object
+    """
+
+    def __init__(self):
+        self.lock_ = threading.Lock()
+        self.metrics_ = {}
+        self.collectors_ = []
+
+    def register(self, metric):
+        """ Register the metric or return the one already registered with the same name.
+
+        Args:
+            metric: Counter or Histogram object.
+        Returns:
+            The registered metric.
+        """
+        with self.lock_:
+            return self.metrics_.setdefault(metric.name, metric)
+
+    def add_collector(self, collector):
+        """ Add the collector function. """
+        with self.lock_:
+            self.collectors_.append(collector)
+
+    def remove_collector(self, collector):
+        """ Remove the collector function if added. """
+        with self.lock_:
+            if collector in self.collectors_:
+                self.collectors_.remove(collector)
+
+    def render(self):
+        """ Return all metrics in Prometheus text format.
+
+        Returns:
+            str
+        """
+        with self.lock_:
+            metrics = [self.metrics_[name] for name in sorted(self.metrics_)]
+            collectors = list(self.collectors_)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        for collector in collectors:
+            for name, type_name, help, samples in collector():
+                lines.append("# HELP {} {}".format(name, help))
+                lines.append("# TYPE {} {}".format(name, type_name))
+                for labels, value in samples:
+                    lines.append("{}{} {}".format(
+                        name, _format_labels(list(labels.keys()), list(labels.values())),
+                        _format_value(value)))
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labelnames=()):
+    """ Create Counter and register it to REGISTRY. See Counter. """
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """ Create Histogram and register it to REGISTRY. See Histogram. """
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+class MetricsServer(threading.Thread):
+    """ HTTP server thread to serve the metrics at /metrics.
+
+    Args:
+        port: TCP port to listen. 0 to choose any free port.
+        host: Address to bind.
+        registry: Registry to serve.
+    Returns:
+        Instance object
+    """
+
+    def __init__(self, port, host="127.0.0.1", registry=REGISTRY):
+        registry_ = registry
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+
+                body = registry_.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server_ = HTTPServer((host, port), _Handler)
+        threading.Thread.__init__(self, name=type(self).__name__)
+        self.daemon = True
+
+    @property
+    def port(self):
+        """ TCP port listened actually. """
+        return self.server_.server_address[1]
+
+    def run(self):
+        """ Target function of this thread. """
+        self.server_.serve_forever()
+
+    def stop(self):
+        """ Stop serving and close the socket. """
+        self.server_.shutdown()
+        self.server_.server_close()
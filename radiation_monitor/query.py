@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Query historical readings in the local database."""
+
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from radiation_monitor.storage import RESOLUTIONS
+from radiation_monitor.storage import SQLiteStore
+
+READING_FIELDS = ("device", "at", "epoch", "cpm", "usv")
+ROLLUP_FIELDS = (
+    "device", "at", "epoch", "count",
+    "cpm_min", "cpm_max", "cpm_mean", "usv_min", "usv_max", "usv_mean")
+
+
+def parse_time(text):
+    """ Parse time string as epoch seconds.
+
+    Args:
+        text: epoch seconds like "1451606400", or UTC date and time like
+            "2016-01-01", "2016-01-01T10:00" or "2016-01-01T10:00:00".
+    Returns:
+        epoch seconds as float.
+    Raises:
+        ValueError: If the format is unknown.
+    """
+    try:
+        return float(text)
+    except ValueError:
+        pass
+
+    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return (datetime.strptime(text, fmt) - datetime(1970, 1, 1)).total_seconds()
+        except ValueError:
+            continue
+
+    raise ValueError("unknown time format: {}".format(text))
+
+
+def iter_rows(store, devices, start, end, rollup=None):
+    """ Return the generator of rows to output.
+
+    Args:
+        store: storage.SQLiteStore object.
+        devices: list of device names.
+        start: Start epoch seconds (inclusive).
+        end: End epoch seconds (exclusive).
+        rollup: Name of rollup resolution like "1h". Raw readings if None.
+    Returns:
+        generator of tuples in the order of READING_FIELDS or ROLLUP_FIELDS.
+    """
+    for device in devices:
+        if rollup is None:
+            rows = store.readings(device, start, end)
+        else:
+            sec = dict(RESOLUTIONS)[rollup]
+            rows = store.rollups(device, sec, start // sec * sec, end)
+
+        for row in rows:
+            at = datetime.utcfromtimestamp(row[1]).strftime("%Y-%m-%dT%H:%M:%SZ")
+            yield (row[0], at) + row[1:]
+
+
+def write_csv(rows, fields, out):
+    """ Write rows as CSV one by one. """
+    writer = csv.writer(out)
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow(row)
+
+
+def write_json(rows, fields, out):
+    """ Write rows as JSON array one by one without building the whole list. """
+    out.write("[")
+    for i, row in enumerate(rows):
+        out.write(",\n" if i else "\n")
+        out.write(json.dumps(dict(zip(fields, row)), sort_keys=True))
+    out.write("\n]\n")
+
+
+def write_jsonl(rows, fields, out):
+    """ Write rows as JSON lines. """
+    for row in rows:
+        out.write(json.dumps(dict(zip(fields, row)), sort_keys=True))
+        out.write("\n")
+
+
+WRITERS = {
+    "csv": write_csv,
+    "json": write_json,
+    "jsonl": write_jsonl,
+}
+
+
+def run(args, out=sys.stdout):
+    """ Run query subcommand.
+
+    Args:
+        args: parsed arguments by argparser.init_query().
+        out: file object to write the result.
+    Returns:
+        Exit status. 0 if the query succeeded.
+    """
+    # a mistyped path must not create an empty database.
+    if not os.path.isfile(args.database_path):
+        sys.stderr.write("Database {} doesn't exist\n".format(args.database_path))
+        return 1
+
+    try:
+        store = SQLiteStore(args.database_path, is_readonly=True)
+    except sqlite3.Error as e:
+        sys.stderr.write("Can't open database {}: {}\n".format(args.database_path, e))
+        return 1
+
+    try:
+        devices = args.device or store.devices()
+        start = parse_time(args.start) if args.start else 0.0
+        end = parse_time(args.end) if args.end else time.time() + 1
+        fields = ROLLUP_FIELDS if args.rollup else READING_FIELDS
+
+        WRITERS[args.format](iter_rows(store, devices, start, end, args.rollup), fields, out)
+    finally:
+        store.close()
+
+    return 0
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Rolling statistics of readings to detect real changes of dose rate."""
+
+import math
+import threading
+from radiation_monitor.sample import Sample
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class RollingStatistics(object):
+    """ Rolling mean/std, EWMA and one-sided CUSUM of the last size values.
+
+        Values are kept in a ring buffer of NumPy array. The mean and std are
+        calculated from the running sum and sum of squares, so update() is
+        O(1) regardless of size. The running sums are recalculated from the
+        buffer by vectorized sum once per size updates to cancel the error
+        of floating point.
+
+        CUSUM accumulates the standardized deviation of each value from the
+        rolling mean of the values before it, minus drift. It alarms when the
+        sum gets over threshold and starts again from 0. The std is never
+        smaller than sqrt(mean) since the counts follow Poisson distribution.
+
+    Args:
+        size: Number of values in the rolling window.
+        alpha: Smoothing factor of EWMA.
+        drift: Allowance of CUSUM in std. Slower changes than this are ignored.
+        threshold: Alarm level of CUSUM in std.
+        warmup: Number of values needed before alarming. size / 10 if None.
+    Returns:
+        Instance object
+    Raises:
+        ImportError if numpy is not installed.
+    """
+
+    def __init__(self, size, alpha=0.1, drift=1.0, threshold=8.0, warmup=None):
+        if numpy is None:
+            raise ImportError("numpy is required for {}".format(type(self).__name__))
+
+        self.size_ = size
+        self.alpha_ = alpha
+        self.drift_ = drift
+        self.threshold_ = threshold
+        self.warmup_ = max(2, size // 10) if warmup is None else warmup
+
+        self.buf_ = numpy.zeros(size, dtype=numpy.float64)
+        self.pos_ = 0
+        self.count_ = 0
+        self.sum_ = 0.0
+        self.sumsq_ = 0.0
+        self.ewma_ = None
+        self.cusum_ = 0.0
+
+    def __len__(self):
+        return self.count_
+
+    @property
+    def mean(self):
+        """ Rolling mean. """
+        return self.sum_ / self.count_ if self.count_ else 0.0
+
+    @property
+    def std(self):
+        """ Rolling sample standard deviation. """
+        if self.count_ < 2:
+            return 0.0
+
+        var = (self.sumsq_ - self.sum_ * self.sum_ / self.count_) / (self.count_ - 1)
+        return math.sqrt(var) if var > 0.0 else 0.0
+
+    @property
+    def ewma(self):
+        """ Exponentially weighted moving average. """
+        return self.ewma_ if self.ewma_ is not None else 0.0
+
+    @property
+    def cusum(self):
+        """ Current CUSUM in std. """
+        return self.cusum_
+
+    def update(self, value):
+        """ Add the value and return True if CUSUM alarms.
+
+        Args:
+            value: New value like cpm.
+        Returns:
+            True if the value makes CUSUM alarm.
+        """
+        is_alarm = False
+
+        if self.count_ >= self.warmup_:
+            mean = self.mean
+            std = max(self.std, math.sqrt(mean), 1.0)
+            self.cusum_ = max(0.0, self.cusum_ + (value - mean) / std - self.drift_)
+
+            if self.cusum_ > self.threshold_:
+                is_alarm = True
+                self.cusum_ = 0.0
+
+        self.ewma_ = value if self.ewma_ is None else \
+            self.ewma_ + self.alpha_ * (value - self.ewma_)
+
+        old = self.buf_[self.pos_]
+        if self.count_ >= self.size_:
+            self.sum_ -= old
+            self.sumsq_ -= old * old
+        else:
+            self.count_ += 1
+
+        self.buf_[self.pos_] = value
+        self.sum_ += value
+        self.sumsq_ += value * value
+        self.pos_ += 1
+
+        if self.pos_ >= self.size_:
+            self.pos_ = 0
+            self.resync()
+
+        return is_alarm
+
+    def resync(self):
+        """ Recalculate the running sums from the buffer. """
+        values = self.buf_[:self.count_]
+        self.sum_ = float(values.sum())
+        self.sumsq_ = float(numpy.dot(values, values))
+
+    def values(self):
+        """ Return the values in the window from the oldest as NumPy array. """
+        if self.count_ < self.size_:
+            return self.buf_[:self.count_].copy()
+        return numpy.concatenate((self.buf_[self.pos_:], self.buf_[:self.pos_]))
+
+
+class AnomalyAlert(Sample):
+    """ Sample which made the rolling statistics alarm. The statistics are
+        the ones just before the sample.
+
+    Args:
+        device, monotonic, epoch, cpm, usv: same as sample.Sample.
+        kind: Name of the detector like "cusum".
+        mean: Rolling mean of cpm.
+        std: Rolling std of cpm.
+        ewma: EWMA of cpm.
+    Returns:
+        Instance object
+    """
+
+    __slots__ = ("kind", "mean", "std", "ewma")
+
+    def __init__(self, device, monotonic, epoch, cpm, usv, kind="cusum", mean=0.0, std=0.0, ewma=0.0):
+        Sample.__init__(self, device, monotonic, epoch, cpm, usv)
+        self.kind = kind
+        self.mean = mean
+        self.std = std
+        self.ewma = ewma
+
+    def __eq__(self, other):
+        return Sample.__eq__(self, other) and isinstance(other, AnomalyAlert) and all(
+            getattr(self, name) == getattr(other, name) for name in AnomalyAlert.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}(device={!r}, epoch={!r}, cpm={!r}, kind={!r}, mean={!r}, std={!r})".format(
+            type(self).__name__, self.device, self.epoch, self.cpm, self.kind, self.mean, self.std)
+
+
+class AnomalyDetector(object):
+    """ Keep RollingStatistics of cpm for each device and call the callback
+        with AnomalyAlert when it alarms.
+
+    Args:
+        callback: function called with AnomalyAlert.
+        size: Number of samples in the rolling window.
+        kwargs: passed to RollingStatistics.
+    Returns:
+        Instance object
+    Raises:
+        ImportError if numpy is not installed.
+    """
+
+    def __init__(self, callback, size, **kwargs):
+        if numpy is None:
+            raise ImportError("numpy is required for {}".format(type(self).__name__))
+
+        self.callback_ = callback
+        self.size_ = size
+        self.kwargs_ = kwargs
+        self.lock_ = threading.Lock()
+        self.statistics_ = {}
+
+    def statistics(self, device):
+        """ Return RollingStatistics of the device or None. """
+        return self.statistics_.get(device)
+
+    def put(self, sample):
+        """ Update the statistics with the sample.
+
+        Args:
+            sample: sample.Sample object.
+        Returns:
+            None
+        """
+        with self.lock_:
+            stats = self.statistics_.get(sample.device)
+            if stats is None:
+                stats = self.statistics_[sample.device] = RollingStatistics(self.size_, **self.kwargs_)
+
+            mean, std, ewma = stats.mean, stats.std, stats.ewma
+            is_alarm = stats.update(sample.cpm)
+
+        if is_alarm:
+            self.callback_(AnomalyAlert(
+                sample.device, sample.monotonic, sample.epoch, sample.cpm, sample.usv,
+                kind="cusum", mean=mean, std=std, ewma=ewma))
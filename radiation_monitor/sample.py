@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Compact record of one measurement passed through the event pipeline."""
+
+from collections import OrderedDict
+from datetime import datetime
+
+CPM_LABEL = "Count Per Minute"
+USV_LABEL = "Micro Sievert Per Hour"
+
+
+class Sample(object):
+    """ One measurement of geiger counter. This is passed to event triggers
+        and handlers instead of nested dicts.
+
+        For the event handlers written for the old dict shape like
+        {"source": ..., "data": {label: {"value": ..., "unit": ...}}, "at": ...},
+        sample["source"], sample["data"] and sample["at"] are also available.
+        They are built only when accessed.
+
+    Args:
+        device: Name of the geiger counter device.
+        monotonic: time.monotonic() when the sample is got.
+        epoch: time.time() when the sample is got.
+        cpm: Count per minute.
+        usv: Micro sievert per hour.
+    Returns:
+        Instance object
+    """
+
+    __slots__ = ("device", "monotonic", "epoch", "cpm", "usv")
+
+    def __init__(self, device, monotonic, epoch, cpm, usv):
+        self.device = device
+        self.monotonic = monotonic
+        self.epoch = epoch
+        self.cpm = cpm
+        self.usv = usv
+
+    @property
+    def at(self):
+        """ UTC datetime when the sample is got. """
+        return datetime.utcfromtimestamp(self.epoch)
+
+    def __getitem__(self, key):
+        if key == "source":
+            return self.device
+        if key == "at":
+            return self.at
+        if key == "data":
+            return OrderedDict([
+                (CPM_LABEL, OrderedDict([("value", self.cpm), ("unit", "cpm")])),
+                (USV_LABEL, OrderedDict([("value", self.usv), ("unit", "usv")])),
+            ])
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in ("source", "data", "at")
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return ["source", "data", "at"]
+
+    def as_dict(self):
+        """ Return the sample as the old dict shape. """
+        return dict((key, self[key]) for key in self.keys())
+
+    @classmethod
+    def from_dict(cls, data, monotonic=0.0):
+        """ Create the sample from the old dict shape.
+
+        Args:
+            data: dict with "source", "data" and "at" (naive UTC datetime).
+            monotonic: time.monotonic() when the data is got.
+        Returns:
+            Sample object.
+        """
+        at = data["at"]
+        epoch = (at - datetime(1970, 1, 1)).total_seconds()
+
+        return cls(
+            data.get("source"),
+            monotonic,
+            epoch,
+            data["data"][CPM_LABEL]["value"],
+            data["data"][USV_LABEL]["value"])
+
+    def __eq__(self, other):
+        return isinstance(other, Sample) and all(
+            getattr(self, name) == getattr(other, name) for name in Sample.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}(device={!r}, monotonic={!r}, epoch={!r}, cpm={!r}, usv={!r})".format(
+            type(self).__name__, self.device, self.monotonic, self.epoch, self.cpm, self.usv)
+
+
+class Gap(Sample):
+    """ Marker put into the data stream when the geiger counter is connected
+        again after it was lost. cpm and usv are None since nothing was
+        measured in the gap.
+
+    Args:
+        device: Name of the geiger counter device.
+        monotonic: time.monotonic() when it is connected again.
+        epoch: time.time() when it is connected again.
+        since: time.time() when it was lost.
+        seconds: Seconds of the gap.
+    Returns:
+        Instance object
+    """
+
+    __slots__ = ("since", "seconds")
+
+    def __init__(self, device, monotonic, epoch, since, seconds):
+        Sample.__init__(self, device, monotonic, epoch, None, None)
+        self.since = since
+        self.seconds = seconds
+
+    def __eq__(self, other):
+        return Sample.__eq__(self, other) and isinstance(other, Gap) and all(
+            getattr(self, name) == getattr(other, name) for name in Gap.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}(device={!r}, epoch={!r}, since={!r}, seconds={!r})".format(
+            type(self).__name__, self.device, self.epoch, self.since, self.seconds)
@@ -15,90 +15,719 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import heapq
+import itertools
+import math
+import os
+import random
+import re
+import selectors
+import socket
 import threading
-from collections import OrderedDict
-from datetime import datetime
+import time
+import tty
 from radiation_monitor import logger
+from radiation_monitor import metrics
+from radiation_monitor.sample import Gap
+from radiation_monitor.sample import Sample
 from serial import Serial
 from serial import SerialException
+from serial.tools import list_ports
 
+try:
+    from urllib.parse import parse_qs, urlsplit
+except ImportError:
+    from urlparse import parse_qs, urlsplit
 
-class GeigerMeter(threading.Thread):
-    """ Geiger counter class to measure the space radiation.
+LINES = metrics.counter(
+    "radiation_monitor_lines_total", "Lines read from geiger counter", ("device",))
+PARSE_ERRORS = metrics.counter(
+    "radiation_monitor_parse_errors_total", "Lines which are invalid or discarded as noise", ("device",))
+DISCONNECTS = metrics.counter(
+    "radiation_monitor_source_disconnects_total", "Times geiger counter was lost", ("device",))
+DOWNTIME = metrics.counter(
+    "radiation_monitor_source_downtime_seconds_total", "Seconds geiger counter was lost", ("device",))
 
-    Arguments:
-        name: Name string like geiger meter device.
+
+def find_port(serial_number):
+    """ Return the device path of the USB serial port with the serial number.
+
+    Args:
+        serial_number: USB serial number string.
+    Returns:
+        Device path like "/dev/ttyUSB1", or None if not connected.
+    """
+    for port in list_ports.comports():
+        if port.serial_number == serial_number:
+            return port.device
+    return None
+
+
+def serial_number_of(uart_dev):
+    """ Return the USB serial number of the device path.
+
+    Args:
+        uart_dev: Device path like "/dev/ttyUSB0" or its symbolic link.
+    Returns:
+        USB serial number string, or None if unknown.
+    """
+    path = os.path.realpath(uart_dev)
+
+    try:
+        for port in list_ports.comports():
+            if os.path.realpath(port.device) == path:
+                return port.serial_number
+    except Exception as e:
+        logger.error("{} raised at listing serial ports".format(type(e).__name__))
+
+    return None
+
+
+class _Outage(object):
+    """ Backoff and downtime of one lost geiger counter. """
+
+    def __init__(self, device, backoff, backoff_max):
+        self.device_ = device
+        self.delay_ = backoff
+        self.backoff_max_ = backoff_max
+        self.lost_monotonic_ = self.counted_ = time.monotonic()
+        self.lost_epoch_ = time.time()
+        DISCONNECTS.labels(device).inc()
+
+    def next_delay(self):
+        """ Return seconds to wait before the next try, doubled every time. """
+        delay = self.delay_
+        self.delay_ = min(self.delay_ * 2, self.backoff_max_)
+        return delay
+
+    def count(self):
+        """ Add the downtime since the last count to the metric. """
+        now = time.monotonic()
+        DOWNTIME.labels(self.device_).inc(now - self.counted_)
+        self.counted_ = now
+        return now
+
+    def gap(self):
+        """ Return Gap of this outage which ends now. """
+        now = self.count()
+        return Gap(self.device_, now, time.time(), self.lost_epoch_, now - self.lost_monotonic_)
+
+
+class CpmLineParser(object):
+    """ Parser to get cpm values from bytes read in bulk from geiger counter.
+        The bytes are kept in one reusable buffer and each complete line like
+        b"20 [cpm]\\n" is matched in place without copying. Partial line is
+        kept until the rest comes. Line which doesn't start with number is
+        counted as error and skipped, and too long line is discarded until
+        the next newline to resync after noise.
+
+    Args:
+        max_line: Max length of one line.
+        device: Name of geiger counter to count lines and errors in metrics.
+            Not counted if None.
+        capture: capture.CaptureWriter to record each raw line of the device.
+    Returns:
+        Instance object
+    """
+
+    _CPM = re.compile(br"[ \t]*([0-9]+)(?=[ \t\r]|$)")
+
+    def __init__(self, max_line=256, device=None, capture=None):
+        self.max_line_ = max_line
+        self.device_ = device
+        self.capture_ = capture
+        self.buf_ = bytearray()
+        self.is_discarding_ = False
+        self.lines_ = 0
+        self.errors_ = 0
+        self.lines_metric_ = LINES.labels(device) if device is not None else None
+        self.errors_metric_ = PARSE_ERRORS.labels(device) if device is not None else None
+
+    def feed(self, data):
+        """ Feed bytes and return the cpm values of the completed lines.
+
+        Args:
+            data: bytes read from geiger counter.
+        Returns:
+            list of cpm as int.
+        """
+        buf = self.buf_
+        buf += data
+        values = []
+        start = 0
+        lines = self.lines_
+        errors = self.errors_
+
+        while True:
+            end = buf.find(b"\n", start)
+            if end < 0:
+                break
+
+            if self.capture_ is not None:
+                self.capture_.write(self.device_, buf[start:end])
+
+            if self.is_discarding_:
+                self.is_discarding_ = False
+            else:
+                matched = self._CPM.match(buf, start, end)
+                self.lines_ += 1
+
+                if matched:
+                    values.append(int(matched.group(1)))
+                elif end > start:
+                    self.errors_ += 1
+
+            start = end + 1
+
+        if start:
+            del buf[:start]
+
+        if len(buf) > self.max_line_:
+            del buf[:]
+            self.is_discarding_ = True
+            self.errors_ += 1
+
+        if self.lines_metric_ is not None:
+            if self.lines_ != lines:
+                self.lines_metric_.inc(self.lines_ - lines)
+            if self.errors_ != errors:
+                self.errors_metric_.inc(self.errors_ - errors)
+
+        return values
+
+    @property
+    def lines(self):
+        """ Number of lines parsed. """
+        return self.lines_
+
+    @property
+    def errors(self):
+        """ Number of lines which are invalid or discarded as noise. """
+        return self.errors_
+
+
+class SourceError(IOError):
+    """Exception if the source is disconnected."""
+    pass
+
+
+class ISource(object):
+    """ Interface of byte stream from one geiger counter. A source is either
+        readable one which has fileno() to be watched by selectors, or timed
+        one which has next_at() to be read at the time.
+
+    Args:
+        name: Name of the geiger counter.
+    Returns:
+        Instance object
+    """
+
+    def __init__(self, name):
+        self.name_ = name
+
+    @property
+    def name(self):
+        """ Name of the geiger counter. """
+        return self.name_
+
+    def open(self):
+        """ Open the source. """
+        pass
+
+    def fileno(self):
+        """ Return the file descriptor to wait for data, or None if timed source. """
+        return None
+
+    def next_at(self):
+        """ Return time.monotonic() to read timed source next. """
+        return None
+
+    def read(self):
+        """ Return the bytes available now without blocking.
+
+        Returns:
+            bytes, which may be empty.
+        Raises:
+            SourceError if the source is disconnected.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """ Close the source. """
+        pass
+
+
+class SerialSource(ISource):
+    """ Source of geiger counter connected to serial port.
+
+    Args:
+        name: Name of the geiger counter.
         uart_dev: Path to the device file like "/dev/tty.usb-serial".
         uart_baud: UART baudrate like 9600.
-        callback: Callback function object. This object needs to have 3 argument
-            to input data. First one is name of the geiger meter device, second
-            is radiation value, third is the date and time when the radiation
-            value is got. The unit of radiation value is uSv/h if usv_per_cpm
-            is set, otherwise cpm.
+        serial_number: USB serial number to find the device again if it is
+            enumerated at another path. Got from uart_dev if None.
+    Returns:
+        Instance object
+    """
+
+    def __init__(self, name, uart_dev, uart_baud, serial_number=None):
+        ISource.__init__(self, name)
+        self.uart_dev_ = uart_dev
+        self.uart_baud_ = uart_baud
+        self.serial_number_ = serial_number
+        self.uart_ = None
+
+    def open(self):
+        if self.serial_number_ is not None:
+            self.uart_dev_ = find_port(self.serial_number_) or self.uart_dev_
+        elif self.uart_ is None:
+            self.serial_number_ = serial_number_of(self.uart_dev_)
+
+        self.uart_ = Serial(self.uart_dev_, self.uart_baud_, timeout=0)
+
+    def fileno(self):
+        return self.uart_.fileno()
+
+    def read(self):
+        try:
+            return self.uart_.read(self.uart_.in_waiting or 1)
+        except (SerialException, OSError) as e:
+            # in_waiting raises EIO by ioctl after unplugged or hung up.
+            raise SourceError(str(e))
+
+    def close(self):
+        if self.uart_ is not None:
+            self.uart_.close()
+
+
+class TcpSource(ISource):
+    """ Source of remote geiger counter served over TCP like ser2net.
+
+    Args:
+        name: Name of the geiger counter.
+        host: Host name or address.
+        port: TCP port.
+        timeout: Seconds to wait for connecting.
+    Returns:
+        Instance object
+    """
+
+    def __init__(self, name, host, port, timeout=5.0):
+        ISource.__init__(self, name)
+        self.address_ = (host, port)
+        self.timeout_ = timeout
+        self.sock_ = None
+
+    def open(self):
+        self.sock_ = socket.create_connection(self.address_, self.timeout_)
+        self.sock_.setblocking(False)
+
+    def fileno(self):
+        return self.sock_.fileno()
+
+    def read(self):
+        try:
+            data = self.sock_.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return b""
+        except (IOError, OSError) as e:
+            raise SourceError(str(e))
+
+        if not data:
+            raise SourceError("{}:{} is closed".format(*self.address_))
+        return data
+
+    def close(self):
+        if self.sock_ is not None:
+            self.sock_.close()
+
+
+class PtySource(ISource):
+    """ Source of pseudo terminal. If path is None, new pty is created and
+        the simulator or socat writes lines to slave_path.
+
+    Args:
+        name: Name of the geiger counter.
+        path: Path of pty to read like "/dev/pts/3". New pty if None.
+    Returns:
+        Instance object
+    """
+
+    def __init__(self, name, path=None):
+        ISource.__init__(self, name)
+        self.path_ = path
+        self.fd_ = None
+        self.slave_ = None
+
+    @property
+    def slave_path(self):
+        """ Path of the slave side to write lines if the pty is created. """
+        return os.ttyname(self.slave_) if self.slave_ is not None else self.path_
+
+    def open(self):
+        if self.path_ is None:
+            self.fd_, self.slave_ = os.openpty()
+            tty.setraw(self.slave_)
+            logger.info("%s: pty is opened at %s", self.name_, self.slave_path)
+        else:
+            self.fd_ = os.open(self.path_, os.O_RDONLY | os.O_NOCTTY)
+            tty.setraw(self.fd_)
+
+        os.set_blocking(self.fd_, False)
+
+    def fileno(self):
+        return self.fd_
+
+    def read(self):
+        try:
+            return os.read(self.fd_, 4096)
+        except (BlockingIOError, InterruptedError):
+            return b""
+        except (IOError, OSError) as e:
+            raise SourceError(str(e))
+
+    def close(self):
+        for fd in (self.fd_, self.slave_):
+            if fd is not None:
+                os.close(fd)
+        self.fd_ = self.slave_ = None
+
+
+class PoissonSource(ISource):
+    """ Synthetic geiger counter to report cpm every interval seconds. The
+        counts in each interval follow Poisson distribution of the rate.
+        Thousands of them can be read on one thread since they have no file
+        descriptor.
+
+    Args:
+        name: Name of the geiger counter.
+        cpm: Mean count per minute.
+        interval: Seconds between reports.
+        seed: Seed of random numbers. Random if None.
+    Returns:
+        Instance object
+    """
+
+    def __init__(self, name, cpm=20.0, interval=1.0, seed=None):
+        ISource.__init__(self, name)
+        self.lam_ = cpm * interval / 60.0
+        self.interval_ = interval
+        self.random_ = random.Random(seed)
+        self.next_at_ = None
+
+    def open(self):
+        # spread the first reports not to read all of them at once.
+        self.next_at_ = time.monotonic() + self.interval_ * self.random_.random()
+
+    def next_at(self):
+        return self.next_at_
+
+    def counts(self):
+        """ Return random counts in one interval. """
+        lam = self.lam_
+
+        if lam >= 30.0:
+            return max(0, int(round(self.random_.gauss(lam, math.sqrt(lam)))))
+
+        # Knuth's algorithm is fast enough for small rate.
+        limit, k, p = math.exp(-lam), 0, self.random_.random()
+        while p > limit:
+            k += 1
+            p *= self.random_.random()
+        return k
+
+    def read(self):
+        lines = []
+        now = time.monotonic()
+
+        while self.next_at_ <= now:
+            lines.append(b"%d [cpm]\n" % int(round(self.counts() * 60.0 / self.interval_)))
+            self.next_at_ += self.interval_
+
+        return b"".join(lines)
+
+
+def create_sources(name, spec, uart_baud=9600):
+    """ Create sources from the device spec string.
+
+        /dev/ttyUSB0                 serial port
+        tcp://host:port              TCP like ser2net
+        pty://                       new pty (the slave path is logged)
+        pty:///dev/pts/3             existing pty
+        poisson://20?interval=1&count=1000&seed=0
+                                     synthetic counters of 20 cpm
+
+    Args:
+        name: Name of the geiger counter. Synthetic counters are named
+            with suffix like "name-0" if count is more than 1.
+        spec: Device spec string.
+        uart_baud: UART baudrate for serial port.
+    Returns:
+        list of ISource objects which are not opened yet.
+    Raises:
+        ValueError if the spec is invalid.
+    """
+    url = urlsplit(spec)
+
+    if url.scheme == "tcp":
+        if not url.hostname or not url.port:
+            raise ValueError("{} needs host and port".format(spec))
+        return [TcpSource(name, url.hostname, url.port)]
+
+    if url.scheme == "pty":
+        return [PtySource(name, url.path or None)]
+
+    if url.scheme == "poisson":
+        query = dict((key, values[-1]) for key, values in parse_qs(url.query).items())
+        count = int(query.get("count", 1))
+        seed = query.get("seed")
+        cpm = float(url.netloc or url.path.strip("/") or 20.0)
+
+        return [
+            PoissonSource(
+                name if count == 1 else "{}-{}".format(name, i),
+                cpm=cpm,
+                interval=float(query.get("interval", 1.0)),
+                seed=None if seed is None else int(seed) + i)
+            for i in range(count)]
+
+    return [SerialSource(name, spec, uart_baud)]
+
+
+def read_once(source, timeout=5.0, usv_per_cpm=0.00812, max_line=256):
+    """ Open the source, read one cpm line and close it.
+
+    Args:
+        source: ISource object which is not opened yet.
+        timeout: Seconds to wait for one complete line.
+        usv_per_cpm: Coefficient to convert cpm to usv.
+        max_line: Max length of one line.
+    Returns:
+        Sample object, or None if no line is read in timeout.
+    Raises:
+        IOError or OSError if the source can't be opened or is lost.
+    """
+    deadline = time.monotonic() + timeout
+    parser = CpmLineParser(max_line)
+    source.open()
+
+    try:
+        with selectors.DefaultSelector() as selector:
+            if source.fileno() is not None:
+                selector.register(source.fileno(), selectors.EVENT_READ)
+                # the first line may be read from its middle.
+                parser.is_discarding_ = True
+
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    return None
+
+                if source.fileno() is not None:
+                    selector.select(deadline - now)
+                else:
+                    time.sleep(max(0.0, min(deadline, source.next_at()) - now))
+
+                values = parser.feed(source.read())
+                if values:
+                    return Sample(source.name, time.monotonic(), time.time(), values[-1], values[-1] * usv_per_cpm)
+    finally:
+        source.close()
+
+
+class GeigerMeterGroup(threading.Thread):
+    """ Geiger counters class to read many sources on one thread. Readable
+        sources are multiplexed with selectors and timed sources are read by
+        the heap of next times, so that this scales to thousands of devices
+        without one thread per device.
+
+    Arguments:
+        devices: list of ISource objects or (name, uart_dev, uart_baud)
+            tuples of serial ports.
+        callback_to_get_val: Callback function object. This object needs to
+            have 1 argument to input sample.Sample object which has name of
+            the geiger meter device, the time when the radiation value is got,
+            cpm and uSv/h, or sample.Gap object after reconnection.
         usv_per_cpm: Rate of uSv/h.
+        max_line: Max length of one line. The longer one is discarded as noise.
+        capture: capture.CaptureWriter to record raw lines. Not recorded if None.
+        reconnect: Open the lost source again with exponential backoff. If
+            False, this thread ends when all sources are lost.
+        backoff: Seconds to wait before the first reconnection.
+        backoff_max: Max seconds to wait before reconnection.
     """
 
-    def __init__(self, name, uart_dev, uart_baud, callback_to_get_val, usv_per_cpm=0.00812):
-        self.name_ = name
-        self.uart_ = Serial(uart_dev, uart_baud)
+    def __init__(self, devices, callback_to_get_val, usv_per_cpm=0.00812, max_line=256, capture=None,
+                 reconnect=True, backoff=1.0, backoff_max=60.0):
         self.callback_ = callback_to_get_val
         self.usv_per_cpm_ = usv_per_cpm
+        self.max_line_ = max_line
+        self.capture_ = capture
+        self.reconnect_ = reconnect
+        self.backoff_ = backoff
+        self.backoff_max_ = backoff_max
         self.stop_event_ = threading.Event()
+        self.selector_ = selectors.DefaultSelector()
+        self.sources_ = []
+        self.timed_ = []
+        self.retries_ = []
+        self.seq_ = itertools.count()
+
+        # socket pair to wake up the selector at stopping.
+        self.wakeup_r_, self.wakeup_w_ = socket.socketpair()
+        self.selector_.register(self.wakeup_r_, selectors.EVENT_READ, None)
+
+        for device in devices:
+            source = device if isinstance(device, ISource) else SerialSource(*device)
+            source.open()
+            self.sources_.append(source)
+            self._add(source)
 
         threading.Thread.__init__(self, name=type(self).__name__)
 
+    def _add(self, source):
+        parser = CpmLineParser(self.max_line_, device=source.name, capture=self.capture_)
+
+        if source.fileno() is not None:
+            self.selector_.register(source.fileno(), selectors.EVENT_READ, (source, parser))
+        else:
+            heapq.heappush(self.timed_, (source.next_at(), next(self.seq_), source, parser))
+
     def stop(self):
         """ Stop this thread. """
         self.stop_event_.set()
 
         try:
-            self.uart_.close()
+            self.wakeup_w_.send(b"\0")
+        except (IOError, OSError):
+            pass
+
+    def _read(self, source, parser):
+        try:
+            values = parser.feed(source.read())
         except Exception as e:
-            logger.error("{} at closing serial port in {}".format(
-                type(e).__name__, type(self).__name__))
+            # any error of one source must not stop the others.
+            logger.error("{} raised at reading {} in {}".format(
+                type(e).__name__, source.name, type(self).__name__))
+            if source.fileno() is not None:
+                self.selector_.unregister(source.fileno())
+            self._lost(source)
+            return False
 
-    def run(self):
-        """ Target function of this thread. """
+        if not values:
+            return True
 
-        def wait_for_radiation():
-            return int(self.uart_.readline().decode("ascii").split()[0])
+        monotonic, epoch = time.monotonic(), time.time()
 
-        while True:
-            if "cpm" in locals():
-                del cpm
+        for cpm in values:
+            self.callback_(Sample(source.name, monotonic, epoch, cpm, cpm * self.usv_per_cpm_))
+
+        return True
+
+    def _lost(self, source):
+        try:
+            source.close()
+        except Exception as e:
+            logger.error("{} at closing {} in {}".format(type(e).__name__, source.name, type(self).__name__))
+
+        if self.reconnect_:
+            outage = _Outage(source.name, self.backoff_, self.backoff_max_)
+            heapq.heappush(self.retries_, (time.monotonic() + outage.next_delay(), next(self.seq_), source, outage))
+
+    def _retry(self):
+        """ Open the lost sources which are due. """
+        now = time.monotonic()
+
+        while self.retries_ and self.retries_[0][0] <= now:
+            retry_at, seq, source, outage = heapq.heappop(self.retries_)
+            outage.count()
 
             try:
-                cpm = wait_for_radiation()
-
-                self.callback_(
-                    self.name_,
-                    OrderedDict({
-                        "Count Per Minute": OrderedDict({
-                            "value": cpm,
-                            "unit": "cpm"
-                        }),
-                        "Micro Sievert Per Hour": OrderedDict({
-                            "value": cpm * self.usv_per_cpm_,
-                            "unit": "usv"
-                        }),
-                    }),
-                    datetime.utcnow())
-            except (SerialException, KeyboardInterrupt):
-                if self.stop_event_.is_set():
-                    logger.info(
-                        "SerialException to stop raised in {}".format(
-                            type(self).__name__))
-                    break
-                logger.error("SerialException raised in {}".format(
-                    type(self).__name__))
-                raise
-            except Exception as e:
-                logger.error("{} raised in {}.".format(
-                    type(e).__name__, type(self).__name__))
-                raise
+                source.open()
+            except (IOError, OSError, ValueError) as e:
+                logger.warning("%s: reconnecting failed by %s", source.name, type(e).__name__)
+                heapq.heappush(self.retries_, (now + outage.next_delay(), seq, source, outage))
+                continue
+
+            self._add(source)
+            gap = outage.gap()
+            logger.info("%s: reconnected after %.1f seconds", source.name, gap.seconds)
+            self.callback_(gap)
+
+    def _is_reading(self):
+        # the wakeup socket is always registered.
+        return len(self.selector_.get_map()) > 1 or bool(self.timed_) or bool(self.retries_)
+
+    def _read_timed(self):
+        now = time.monotonic()
 
+        while self.timed_ and self.timed_[0][0] <= now:
+            next_at, seq, source, parser = self.timed_[0]
+
+            if self._read(source, parser):
+                heapq.heapreplace(self.timed_, (source.next_at(), seq, source, parser))
+            else:
+                heapq.heappop(self.timed_)
+
+    def run(self):
+        """ Target function of this thread. """
         try:
-            self.uart_.close()
+            while not self.stop_event_.is_set():
+                if not self.reconnect_ and not self._is_reading():
+                    logger.info("All sources are lost in %s", type(self).__name__)
+                    break
+
+                deadlines = [heap[0][0] for heap in (self.timed_, self.retries_) if heap]
+                timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+
+                for key, events in self.selector_.select(timeout):
+                    if key.data is not None:
+                        self._read(*key.data)
+
+                self._read_timed()
+                self._retry()
         except Exception as e:
-            logger.error("{} at closing serial port in {}".format(
-                type(e).__name__, type(self).__name__))
+            logger.error("{} raised in {}.".format(type(e).__name__, type(self).__name__))
+            raise
+        finally:
+            for source in self.sources_:
+                try:
+                    source.close()
+                except Exception as e:
+                    logger.error("{} at closing {} in {}".format(
+                        type(e).__name__, source.name, type(self).__name__))
+
+            self.selector_.close()
+
+
+class GeigerMeter(GeigerMeterGroup):
+    """ Geiger counter class to measure the space radiation with one serial
+        port. This is GeigerMeterGroup of one SerialSource.
+
+    Arguments:
+        name: Name string like geiger meter device.
+        uart_dev: Path to the device file like "/dev/tty.usb-serial".
+        uart_baud: UART baudrate like 9600.
+        callback_to_get_val: Callback function object. See GeigerMeterGroup.
+        usv_per_cpm: Rate of uSv/h.
+        capture: capture.CaptureWriter to record raw lines. Not recorded if None.
+        reconnect: Connect again if the serial port is lost. The thread
+            ends if False.
+        backoff: Seconds to wait before the first reconnection. The wait is
+            doubled every time up to backoff_max.
+        backoff_max: Max seconds to wait before reconnection.
+        serial_number: USB serial number to find the device again if it is
+            enumerated at another path. Got from uart_dev if None.
+    """
+
+    def __init__(self, name, uart_dev, uart_baud, callback_to_get_val, usv_per_cpm=0.00812, capture=None,
+                 reconnect=True, backoff=1.0, backoff_max=60.0, serial_number=None):
+        GeigerMeterGroup.__init__(
+            self,
+            [SerialSource(name, uart_dev, uart_baud, serial_number)],
+            callback_to_get_val,
+            usv_per_cpm=usv_per_cpm,
+            capture=capture,
+            reconnect=reconnect,
+            backoff=backoff,
+            backoff_max=backoff_max)
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Append-only on-disk spool to keep data while event handlers are down."""
+
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+
+_HEADER = struct.Struct("<II")
+_SEGMENT_SUFFIX = ".seg"
+_CURSOR_FILE = "cursor"
+
+
+class Spool(object):
+    """ Durable FIFO queue stored as rotated segment files in a directory.
+
+    Each record is written as (length, crc32, pickled data). Records are
+    fsync'ed in batches of sync_every records or sync_interval seconds. The
+    read position is kept in the cursor file and is also saved in batches
+    or by compact() after sync_interval seconds, so some records may be
+    read again after a crash (at least once). Segment files are rotated
+    only when they get larger than segment_bytes not to wear SD cards.
+
+    Args:
+        path: Directory path to store segment files.
+        segment_bytes: Segment file is rotated if it gets larger than this.
+        max_bytes: Max total size of segment files. The oldest segments are
+            deleted even if not read yet when this is exceeded.
+        sync_every: fsync after this number of records.
+        sync_interval: fsync if this seconds passed since the last fsync.
+    Returns:
+        Instance object
+    """
+
+    def __init__(self, path, segment_bytes=1024 * 1024, max_bytes=64 * 1024 * 1024,
+                 sync_every=16, sync_interval=1.0):
+        self.path_ = path
+        self.segment_bytes_ = segment_bytes
+        self.max_bytes_ = max_bytes
+        self.sync_every_ = sync_every
+        self.sync_interval_ = sync_interval
+        self.lock_ = threading.Lock()
+
+        self.unsynced_ = 0
+        self.synced_at_ = time.monotonic()
+        self.uncommitted_ = 0
+        self.cursor_saved_at_ = time.monotonic()
+        self.dropped_bytes_ = 0
+        self.reader_ = None
+        self.peeked_size_ = 0
+        self.peeked_count_ = 0
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        segments = self._segments()
+        self.read_seq_, self.read_offset_ = self._load_cursor(segments)
+
+        if segments:
+            self.write_seq_ = segments[-1]
+            self._truncate_torn_tail(self.write_seq_)
+        else:
+            self.write_seq_ = self.read_seq_
+
+        self.writer_ = open(self._segment_path(self.write_seq_), "ab")
+        self.compact()
+
+    def _segment_path(self, seq):
+        return os.path.join(self.path_, "{:020d}{}".format(seq, _SEGMENT_SUFFIX))
+
+    def _segments(self):
+        return sorted(
+            int(name[:-len(_SEGMENT_SUFFIX)])
+            for name in os.listdir(self.path_) if name.endswith(_SEGMENT_SUFFIX))
+
+    def _load_cursor(self, segments):
+        try:
+            with open(os.path.join(self.path_, _CURSOR_FILE), "r") as f:
+                seq, offset = (int(val) for val in f.read().split())
+        except (IOError, OSError, ValueError):
+            seq, offset = (segments[0] if segments else 0), 0
+
+        if segments and seq < segments[0]:
+            seq, offset = segments[0], 0
+
+        return seq, offset
+
+    def _save_cursor(self):
+        path = os.path.join(self.path_, _CURSOR_FILE)
+
+        with open(path + ".tmp", "w") as f:
+            f.write("{} {}".format(self.read_seq_, self.read_offset_))
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.rename(path + ".tmp", path)
+        self.uncommitted_ = 0
+        self.cursor_saved_at_ = time.monotonic()
+
+    @staticmethod
+    def _read_record(f):
+        """ Return (data, size) of the record at the current position, or
+            (None, 0) if there is no complete record.
+        """
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return None, 0
+
+        length, crc = _HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) & 0xffffffff != crc:
+            return None, 0
+
+        return pickle.loads(payload), _HEADER.size + length
+
+    def _truncate_torn_tail(self, seq):
+        """ Cut the half-written record left by crash at the end of segment. """
+        path = self._segment_path(seq)
+        good = 0
+
+        with open(path, "rb") as f:
+            while True:
+                data, size = self._read_record(f)
+                if not size:
+                    break
+                good += size
+
+        if good < os.path.getsize(path):
+            with open(path, "r+b") as f:
+                f.truncate(good)
+
+    def _sync(self):
+        self.writer_.flush()
+        os.fsync(self.writer_.fileno())
+        self.unsynced_ = 0
+        self.synced_at_ = time.monotonic()
+
+    def _rotate(self):
+        self._sync()
+        self.writer_.close()
+        self.write_seq_ += 1
+        self.writer_ = open(self._segment_path(self.write_seq_), "ab")
+        self._enforce_max_bytes()
+
+    def _enforce_max_bytes(self):
+        segments = self._segments()
+        total = sum(os.path.getsize(self._segment_path(seq)) for seq in segments)
+
+        for seq in segments[:-1]:
+            if total <= self.max_bytes_:
+                break
+
+            size = os.path.getsize(self._segment_path(seq))
+            if seq >= self.read_seq_:
+                # unread data is lost to bound the disk usage.
+                self.dropped_bytes_ += size - (self.read_offset_ if seq == self.read_seq_ else 0)
+                self._close_reader()
+                self.read_seq_, self.read_offset_ = seq + 1, 0
+                self.peeked_size_ = self.peeked_count_ = 0
+                self._save_cursor()
+
+            os.remove(self._segment_path(seq))
+            total -= size
+
+    def _close_reader(self):
+        if self.reader_ is not None:
+            self.reader_.close()
+            self.reader_ = None
+
+    def append(self, data):
+        """ Append data to the end of spool.
+
+        Args:
+            data: picklable object.
+        Returns:
+            None
+        """
+        payload = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+        with self.lock_:
+            self.writer_.write(_HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff))
+            self.writer_.write(payload)
+            self.writer_.flush()
+            self.unsynced_ += 1
+
+            if self.writer_.tell() >= self.segment_bytes_:
+                self._rotate()
+            elif self.unsynced_ >= self.sync_every_ or \
+                    time.monotonic() - self.synced_at_ >= self.sync_interval_:
+                self._sync()
+
+    def peek(self):
+        """ Return the oldest data not committed yet.
+
+        Returns:
+            data object or None if the spool is empty.
+        """
+        batch = self.peek_batch(1)
+        return batch[0] if batch else None
+
+    def peek_batch(self, count):
+        """ Return the oldest data not committed yet. commit() removes all of
+            them. The data is read from one segment at once.
+
+        Args:
+            count: max number of data to return.
+        Returns:
+            list of data objects, which is empty if the spool is empty.
+        """
+        with self.lock_:
+            while True:
+                if self.reader_ is None:
+                    self.reader_ = open(self._segment_path(self.read_seq_), "rb")
+
+                self.reader_.seek(self.read_offset_)
+                batch = []
+                self.peeked_size_ = self.peeked_count_ = 0
+
+                while len(batch) < count:
+                    data, size = self._read_record(self.reader_)
+                    if not size:
+                        break
+                    batch.append(data)
+                    self.peeked_size_ += size
+                    self.peeked_count_ += 1
+
+                if batch or self.read_seq_ >= self.write_seq_:
+                    return batch
+
+                # no more complete record in the old segment. go to the next one.
+                self._close_reader()
+                self.read_seq_, self.read_offset_ = self.read_seq_ + 1, 0
+
+    def commit(self):
+        """ Remove the data returned by peek() or peek_batch() from the spool.
+
+        Returns:
+            None
+        """
+        with self.lock_:
+            self.read_offset_ += self.peeked_size_
+            self.uncommitted_ += self.peeked_count_
+            self.peeked_size_ = self.peeked_count_ = 0
+
+            if self.uncommitted_ >= self.sync_every_:
+                self._save_cursor()
+
+    def compact(self):
+        """ Delete the segment files which are already read, and save the
+            cursor if it is not saved for sync_interval seconds. Call this
+            periodically while idle.
+
+        Returns:
+            None
+        """
+        with self.lock_:
+            read_segments = [seq for seq in self._segments() if seq < self.read_seq_]
+
+            if read_segments or (self.uncommitted_ and
+                                 time.monotonic() - self.cursor_saved_at_ >= self.sync_interval_):
+                self._save_cursor()
+
+            for seq in read_segments:
+                os.remove(self._segment_path(seq))
+
+    def stats(self):
+        """ Return the statistics of this spool.
+
+        Returns:
+            dict with bytes (total size of segment files), segments and
+            dropped_bytes (unread size deleted to bound the disk usage).
+        """
+        with self.lock_:
+            segments = self._segments()
+            return {
+                "bytes": sum(os.path.getsize(self._segment_path(seq)) for seq in segments),
+                "segments": len(segments),
+                "dropped_bytes": self.dropped_bytes_,
+            }
+
+    def close(self):
+        """ Sync all data and the cursor to the disk and close files. """
+        with self.lock_:
+            self._sync()
+            self.writer_.close()
+            self._close_reader()
+            self._save_cursor()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Local time-series store of samples with downsampled rollups."""
+
+import sqlite3
+import threading
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+# (name, seconds) of rollup resolutions.
+RESOLUTIONS = (("1m", 60), ("1h", 3600), ("1d", 86400))
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS reading ("
+    " device TEXT NOT NULL,"
+    " epoch REAL NOT NULL,"
+    " cpm INTEGER NOT NULL,"
+    " usv REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS reading_device_epoch ON reading (device, epoch)",
+    "CREATE TABLE IF NOT EXISTS rollup ("
+    " device TEXT NOT NULL,"
+    " resolution INTEGER NOT NULL,"
+    " bucket INTEGER NOT NULL,"
+    " count INTEGER NOT NULL,"
+    " cpm_min INTEGER NOT NULL,"
+    " cpm_max INTEGER NOT NULL,"
+    " cpm_sum INTEGER NOT NULL,"
+    " usv_min REAL NOT NULL,"
+    " usv_max REAL NOT NULL,"
+    " usv_sum REAL NOT NULL,"
+    " PRIMARY KEY (device, resolution, bucket))",
+)
+
+
+class SQLiteStore(object):
+    """ Store of samples on SQLite. Raw samples are kept in reading table
+        and 1 minute, 1 hour and 1 day rollups of them are updated in rollup
+        table at each write, so that long range query never scans raw rows.
+
+    Args:
+        path: File path of SQLite database.
+        is_readonly: Open the existing database only to read. The database
+            is never created nor changed.
+    Returns:
+        Instance object
+    Raises:
+        sqlite3.OperationalError: If is_readonly and the database can't be
+            opened like it doesn't exist.
+    """
+
+    def __init__(self, path, is_readonly=False):
+        self.lock_ = threading.Lock()
+
+        if is_readonly:
+            self.db_ = sqlite3.connect(
+                "file:{}?mode=ro".format(quote(path)), uri=True, check_same_thread=False)
+            return
+
+        self.db_ = sqlite3.connect(path, check_same_thread=False)
+        self.db_.execute("PRAGMA journal_mode=WAL")
+        self.db_.execute("PRAGMA synchronous=NORMAL")
+
+        with self.db_:
+            for sql in _SCHEMA:
+                self.db_.execute(sql)
+
+    def write(self, samples):
+        """ Write samples and update rollups in one transaction.
+
+        Args:
+            samples: list of sample.Sample objects.
+        Returns:
+            None
+        """
+        rollups = {}
+
+        for sample in samples:
+            for name, sec in RESOLUTIONS:
+                key = (sample.device, sec, int(sample.epoch // sec) * sec)
+                rollup = rollups.get(key)
+
+                if rollup is None:
+                    rollups[key] = [1, sample.cpm, sample.cpm, sample.cpm, sample.usv, sample.usv, sample.usv]
+                    continue
+
+                rollup[0] += 1
+                rollup[1] = min(rollup[1], sample.cpm)
+                rollup[2] = max(rollup[2], sample.cpm)
+                rollup[3] += sample.cpm
+                rollup[4] = min(rollup[4], sample.usv)
+                rollup[5] = max(rollup[5], sample.usv)
+                rollup[6] += sample.usv
+
+        with self.lock_, self.db_:
+            self.db_.executemany(
+                "INSERT INTO reading (device, epoch, cpm, usv) VALUES (?, ?, ?, ?)",
+                [(sample.device, sample.epoch, sample.cpm, sample.usv) for sample in samples])
+
+            # merge into existing rollups. INSERT OR IGNORE + UPDATE works on old SQLite without UPSERT.
+            self.db_.executemany(
+                "INSERT OR IGNORE INTO rollup VALUES (?, ?, ?, 0, ?, ?, 0, ?, ?, 0.0)",
+                [key + (val[1], val[2], val[4], val[5]) for key, val in rollups.items()])
+            self.db_.executemany(
+                "UPDATE rollup SET"
+                " count = count + ?,"
+                " cpm_min = MIN(cpm_min, ?), cpm_max = MAX(cpm_max, ?), cpm_sum = cpm_sum + ?,"
+                " usv_min = MIN(usv_min, ?), usv_max = MAX(usv_max, ?), usv_sum = usv_sum + ?"
+                " WHERE device = ? AND resolution = ? AND bucket = ?",
+                [tuple(val) + key for key, val in rollups.items()])
+
+    def devices(self):
+        """ Return the names of devices which have readings.
+
+        Returns:
+            list of device name.
+        """
+        with self.lock_:
+            return [row[0] for row in self.db_.execute(
+                "SELECT DISTINCT device FROM rollup WHERE resolution = ? ORDER BY device",
+                (RESOLUTIONS[-1][1],))]
+
+    def readings(self, device, start, end):
+        """ Return the generator of raw readings of the device in the range.
+            This scans the (device, epoch) index and yields rows one by one,
+            so that memory usage doesn't depend on the range.
+
+        Args:
+            device: Name of the device.
+            start: Start epoch seconds (inclusive).
+            end: End epoch seconds (exclusive).
+        Returns:
+            generator of (device, epoch, cpm, usv) tuples ordered by epoch.
+        """
+        cursor = self.db_.execute(
+            "SELECT device, epoch, cpm, usv FROM reading"
+            " WHERE device = ? AND epoch >= ? AND epoch < ? ORDER BY epoch",
+            (device, start, end))
+
+        try:
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+
+    def rollups(self, device, resolution, start, end):
+        """ Return the generator of rollups of the device in the range.
+
+        Args:
+            device: Name of the device.
+            resolution: Seconds of rollup like 3600. See RESOLUTIONS.
+            start: Start epoch seconds (inclusive).
+            end: End epoch seconds (exclusive).
+        Returns:
+            generator of (device, bucket, count, cpm_min, cpm_max, cpm_mean,
+            usv_min, usv_max, usv_mean) tuples ordered by bucket.
+        """
+        cursor = self.db_.execute(
+            "SELECT device, bucket, count, cpm_min, cpm_max, CAST(cpm_sum AS REAL) / count,"
+            " usv_min, usv_max, usv_sum / count FROM rollup"
+            " WHERE device = ? AND resolution = ? AND bucket >= ? AND bucket < ? ORDER BY bucket",
+            (device, resolution, start, end))
+
+        try:
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+
+    def close(self):
+        """ Close the database. """
+        with self.lock_:
+            self.db_.close()
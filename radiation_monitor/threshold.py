@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Threshold alert of dose rate with hysteresis and rate limiting."""
+
+import threading
+from radiation_monitor import logger
+from radiation_monitor.sample import Sample
+
+
+class ThresholdAlert(Sample):
+    """ Sample which made the dose rate go over the threshold.
+
+    Args:
+        device, monotonic, epoch, cpm, usv: same as sample.Sample.
+        threshold: Threshold of usv which is exceeded.
+    Returns:
+        Instance object
+    """
+
+    __slots__ = ("threshold",)
+
+    def __init__(self, device, monotonic, epoch, cpm, usv, threshold=0.0):
+        Sample.__init__(self, device, monotonic, epoch, cpm, usv)
+        self.threshold = threshold
+
+    def __eq__(self, other):
+        return Sample.__eq__(self, other) and isinstance(other, ThresholdAlert) and \
+            self.threshold == other.threshold
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}(device={!r}, epoch={!r}, cpm={!r}, usv={!r}, threshold={!r})".format(
+            type(self).__name__, self.device, self.epoch, self.cpm, self.usv, self.threshold)
+
+
+class _State(object):
+    __slots__ = ("is_high", "is_pending", "alerted_at")
+
+    def __init__(self):
+        self.is_high = False
+        self.is_pending = False
+        self.alerted_at = None
+
+
+class ThresholdDetector(object):
+    """ Call the callback with ThresholdAlert when usv of a device goes over
+        high. The device is not alerted again until usv goes below low
+        (hysteresis), and never within interval seconds after the last alert
+        even if it goes up and down in the meantime. If it goes over high
+        again within interval, the alert is pending and sent when interval
+        passes while usv is still over high. put() is just a few comparisons
+        unless the state changes.
+
+    Args:
+        callback: function called with ThresholdAlert.
+        high: usv to alert.
+        low: usv to re-arm the alert. 80% of high if None.
+        interval: min seconds between alerts of the same device.
+    Returns:
+        Instance object
+    """
+
+    def __init__(self, callback, high, low=None, interval=3600.0):
+        self.callback_ = callback
+        self.high_ = high
+        self.low_ = high * 0.8 if low is None else low
+        self.interval_ = interval
+        self.lock_ = threading.Lock()
+        self.states_ = {}
+
+    def is_high(self, device):
+        """ Return True if the device is over the threshold now. """
+        state = self.states_.get(device)
+        return state is not None and state.is_high
+
+    def put(self, sample):
+        """ Update the state of the device with the sample.
+
+        Args:
+            sample: sample.Sample object.
+        Returns:
+            None
+        """
+        usv = sample.usv
+
+        with self.lock_:
+            state = self.states_.get(sample.device)
+            if state is None:
+                state = self.states_[sample.device] = _State()
+
+            if not state.is_high:
+                if usv < self.high_:
+                    return
+
+                state.is_high = True
+                if state.alerted_at is not None and \
+                        sample.monotonic - state.alerted_at < self.interval_:
+                    state.is_pending = True
+                    logger.info("%s: %s[usv] is over %s again within %s sec",
+                                sample.device, usv, self.high_, self.interval_)
+                    return
+
+            elif usv < self.low_:
+                state.is_high = state.is_pending = False
+                logger.info("%s: %s[usv] is back under %s", sample.device, usv, self.low_)
+                return
+
+            elif not state.is_pending or usv < self.high_ or \
+                    sample.monotonic - state.alerted_at < self.interval_:
+                return
+
+            state.is_pending = False
+            state.alerted_at = sample.monotonic
+
+        self.callback_(ThresholdAlert(
+            sample.device, sample.monotonic, sample.epoch, sample.cpm, usv, threshold=self.high_))
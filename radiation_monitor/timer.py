@@ -17,11 +17,17 @@
 
 """TS-MPPT-60 timer library module."""
 
+import heapq
+import itertools
 import threading
 import time
 
 from radiation_monitor import logger
-from datetime import datetime
+from radiation_monitor import metrics
+
+JITTER_SECONDS = metrics.histogram(
+    "radiation_monitor_timer_jitter_seconds", "Delay of timer jobs from their deadlines",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0))
 
 
 class NotStartedYetError(Exception):
@@ -34,86 +40,184 @@ class AlreadyRunningError(Exception):
     pass
 
 
-class RecursiveTimer(object):
-    """Class of timer for recursively running function.
+class Job(object):
+    """Periodic job registered to Scheduler.
 
     Keyword arguments:
         interval: interval time as second
-        target_func: callable object to run by timer event.
-                     this function should have keyword arguments but NOT arguments.
-        debug: enable debug mode if True
-        kwargs: object to be passed to the specified target_func
+        target_func: callable object to run.
+        target_kwargs: keyword arguments passed to target_func
 
     Returns:
-        timer object
+        job object
     """
 
-    def __init__(self, interval, target_func, **target_kwargs):
+    def __init__(self, interval, target_func, target_kwargs):
         self.interval = interval
         self.target_func = target_func
         self.target_kwargs = target_kwargs
+        self.is_cancelled = False
+        self.runs = 0
+        self.jitter_last = 0.0
+        self.jitter_max = 0.0
 
-        self.event_stop_timer = threading.Event()
-        self.thread_timer = threading.Thread(
-            target=self._tick,
-            args=(), kwargs={})
 
-    def _tick(self, *args, **kwargs):
-        """Tick the time with the specified interval and call the target function.
+class Scheduler(object):
+    """Class to run many periodic jobs on one thread.
 
-        Keyword arguments:
-            None
-        Returns:
-            None
-        """
-        event_tick = threading.Event()
-        thread_mainloop = threading.Thread(
-            target=self._main_loop,
-            args=(event_tick,), kwargs={})
+    Jobs are kept in a heap ordered by the next deadline on the monotonic
+    clock, and the thread sleeps exactly until the nearest one. The next
+    deadline is the previous deadline plus interval, so the delay of each
+    run doesn't accumulate. If the thread is late for more than one
+    interval, the missed runs are skipped.
 
-        thread_mainloop.start()
-        start_time = datetime.now()
+    Keyword arguments:
+        clock: function returning the monotonic time as second.
 
-        while True:
-            time.sleep(0.5)
+    Returns:
+        scheduler object
+    """
 
-            if self.event_stop_timer.isSet():
-                break
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.heap = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.is_stopped = False
+        self.wakeups = 0
+        self.thread = threading.Thread(target=self._loop, args=(), kwargs={})
+        self.thread.daemon = True
+
+    def every(self, interval, target_func, **target_kwargs):
+        """Register the function to run every interval.
 
-            if 'now_time' in locals():
-                del now_time
-            now_time = datetime.now()
+        Keyword arguments:
+            interval: interval time as second
+            target_func: callable object to run.
+            target_kwargs: keyword arguments passed to target_func
+
+        Returns:
+            Job object to cancel it.
+        """
+        job = Job(interval, target_func, target_kwargs)
 
-            if (now_time - start_time).seconds >= self.interval:
-                if 'start_time' in locals():
-                    del start_time
-                start_time = now_time
-                event_tick.set()
+        with self.cond:
+            heapq.heappush(self.heap, (self.clock() + interval, next(self.seq), job))
+            self.cond.notify()
 
-        event_tick.set()
-        thread_mainloop.join()
+        return job
 
-    def _main_loop(self, event_tick, *args, **kwargs):
-        """Loop with the specified function.
+    def cancel(self, job):
+        """Cancel the job. It never runs after this returns unless running now.
 
         Keyword arguments:
-            event_tick: event to be set at the timing of calling target_func
+            job: Job object returned by every()
 
         Returns:
             None
         """
-        while True:
-            event_tick.wait()
-            event_tick.clear()
+        with self.cond:
+            job.is_cancelled = True
+            self.heap = [entry for entry in self.heap if entry[2] is not job]
+            heapq.heapify(self.heap)
+            self.cond.notify()
+
+    def _next_job(self):
+        """Wait for the nearest deadline and return the job to run or None if stopped."""
+        with self.cond:
+            while not self.is_stopped:
+                if not self.heap:
+                    self.cond.wait()
+                    self.wakeups += 1
+                    continue
+
+                deadline, seq, job = self.heap[0]
+                now = self.clock()
+
+                if deadline > now:
+                    self.cond.wait(deadline - now)
+                    self.wakeups += 1
+                    continue
+
+                next_deadline = deadline + job.interval
+                if next_deadline <= now:
+                    next_deadline += ((now - next_deadline) // job.interval + 1) * job.interval
+
+                heapq.heapreplace(self.heap, (next_deadline, seq, job))
+                job.jitter_last = now - deadline
+                job.jitter_max = max(job.jitter_max, job.jitter_last)
+                job.runs += 1
+                return job
+
+        return None
+
+    def _loop(self):
+        jitter = JITTER_SECONDS.labels()
 
-            if self.event_stop_timer.isSet():
+        while True:
+            job = self._next_job()
+            if job is None:
                 break
 
+            jitter.observe(job.jitter_last)
+
             try:
-                self.target_func(**self.target_kwargs)
+                job.target_func(**job.target_kwargs)
             except Exception as e:
                 logger.debug(str(e) + ' error!!!')
 
+    def start(self):
+        """Start the scheduler thread.
+
+        Raises:
+            timer.AlreadyRunningError if the scheduler already started.
+        """
+        if self.thread.is_alive():
+            raise AlreadyRunningError("scheduler thread is already run")
+        self.thread.start()
+
+    def stop(self):
+        """Stop the scheduler thread immediately and wait for it to finish.
+
+        Raises:
+            timer.NotStartedYetError if the scheduler is not running.
+        """
+        if not self.thread.is_alive():
+            raise NotStartedYetError("scheduler is not running")
+
+        with self.cond:
+            self.is_stopped = True
+            self.cond.notify()
+
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def is_alive(self):
+        """Test if the scheduler thread is alive."""
+        return self.thread.is_alive()
+
+
+class RecursiveTimer(object):
+    """Class of timer for recursively running function.
+
+    Keyword arguments:
+        interval: interval time as second
+        target_func: callable object to run by timer event.
+                     this function should have keyword arguments but NOT arguments.
+        debug: enable debug mode if True
+        kwargs: object to be passed to the specified target_func
+
+    Returns:
+        timer object
+    """
+
+    def __init__(self, interval, target_func, **target_kwargs):
+        self.interval = interval
+        self.target_func = target_func
+        self.target_kwargs = target_kwargs
+        self.scheduler = Scheduler()
+        self.job = None
+
     def start(self):
         """Start the timer thread.
 
@@ -124,12 +228,16 @@ class RecursiveTimer(object):
         Raises:
             timer.AlreadyRunningError if timer already started.
         """
-        if not self.thread_timer.isAlive():
-            self.event_stop_timer.clear()
-            self.thread_timer.start()
-        else:
+        if self.scheduler.is_alive():
             raise AlreadyRunningError("timer thread is already run")
 
+        # a thread can be started only once.
+        if self.job is not None:
+            self.scheduler = Scheduler()
+
+        self.job = self.scheduler.every(self.interval, self.target_func, **self.target_kwargs)
+        self.scheduler.start()
+
     def cancel(self):
         """Stop the timer thread if alive.
 
@@ -140,11 +248,9 @@ class RecursiveTimer(object):
         Raises:
             timer.NotStartedYetError if timer is canceled even though it's not started yet.
         """
-        if self.thread_timer.isAlive():
-            self.event_stop_timer.set()
-            self.thread_timer.join()
-        else:
+        if not self.scheduler.is_alive():
             raise NotStartedYetError("timer is not running")
+        self.scheduler.stop()
 
     def is_alive(self):
         """Test if the timer thread is alive.
@@ -160,8 +266,9 @@ class RecursiveTimer(object):
         >>> rt.is_alive()
         False
         """
-        return self.thread_timer.isAlive()
+        return self.scheduler.is_alive()
 
 if __name__ == '__main__':
     import doctest
+    from datetime import datetime
     doctest.testmod(extraglobs={'rt': RecursiveTimer(3, lambda: print(datetime.now()))})
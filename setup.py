@@ -31,7 +31,7 @@ setup(
     author='Takashi Ando',
     url='https://github.com/dodo5522/radiation_monitor.git',
     install_requires=requires(),
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'test']),
     entry_points={
         'console_scripts': [
             'radiation_monitor = radiation_monitor.__main__:main_routine'
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import pickle
+import time
+import unittest
+try:
+    from unittest.mock import MagicMock
+except ImportError:
+    from mock import MagicMock
+from radiation_monitor.aggregate import AggregatedSample
+from radiation_monitor.aggregate import WindowAggregator
+from radiation_monitor.aggregate import poisson_interval
+from radiation_monitor.sample import Sample
+from radiation_monitor.timer import Scheduler
+
+
+class TestPoissonInterval(unittest.TestCase):
+    def test_interval(self):
+        # exact 95% interval is (4.795, 18.390) for 10 counts.
+        low, high = poisson_interval(10)
+        self.assertAlmostEqual(4.795, low, delta=0.02)
+        self.assertAlmostEqual(18.390, high, delta=0.02)
+
+    def test_zero_count(self):
+        low, high = poisson_interval(0)
+        self.assertEqual(0.0, low)
+        self.assertAlmostEqual(3.689, high, delta=0.03)
+
+
+class TestWindowAggregator(unittest.TestCase):
+    def setUp(self):
+        self.callback = MagicMock()
+        self.scheduler = MagicMock()
+        self.aggregator = WindowAggregator(60, self.callback, self.scheduler)
+
+    def test_emit_one_sample_per_device(self):
+        for i, cpm in enumerate([10, 20, 30]):
+            self.aggregator.put(Sample("a", 100.0 + i, 1000.0 + i, cpm, cpm * 0.01))
+        self.aggregator.put(Sample("b", 101.0, 1001.0, 0, 0.0))
+
+        self.aggregator.emit()
+
+        results = dict((c[0][0].device, c[0][0]) for c in self.callback.call_args_list)
+        self.assertEqual(2, len(results))
+
+        a = results["a"]
+        self.assertIsInstance(a, AggregatedSample)
+        self.assertEqual(1000.0, a.epoch)
+        self.assertEqual(100.0, a.monotonic)
+        self.assertEqual(3, a.samples)
+        self.assertAlmostEqual(20.0, a.cpm)
+        self.assertAlmostEqual(0.2, a.usv)
+        self.assertAlmostEqual(20.0, a.counts)
+        self.assertLess(a.cpm_low, a.cpm)
+        self.assertGreater(a.cpm_high, a.cpm)
+        self.assertAlmostEqual(a.cpm_high * 0.01, a.usv_high)
+
+        self.assertEqual(0.0, results["b"].cpm)
+        self.assertGreater(results["b"].cpm_high, 0.0)
+
+        # window is reset after emit.
+        self.callback.reset_mock()
+        self.aggregator.emit()
+        self.callback.assert_not_called()
+
+    def test_stop_emits_partial_window(self):
+        self.aggregator.start()
+        self.aggregator.put(Sample("a", 100.0, 1000.0, 10, 0.1))
+        self.aggregator.stop()
+
+        self.scheduler.cancel.assert_called_once_with(self.scheduler.every.return_value)
+        self.assertEqual(1, self.callback.call_count)
+
+    def test_run_with_scheduler(self):
+        scheduler = Scheduler()
+        aggregator = WindowAggregator(0.05, self.callback, scheduler)
+        aggregator.start()
+        scheduler.start()
+
+        for i in range(10):
+            aggregator.put(Sample("a", time.monotonic(), time.time(), 12, 0.1))
+            time.sleep(0.01)
+
+        scheduler.stop()
+        aggregator.stop()
+
+        self.assertEqual(10, sum(c[0][0].samples for c in self.callback.call_args_list))
+        self.assertLess(self.callback.call_count, 10)
+
+    def test_pickle(self):
+        sample = AggregatedSample("a", 1.0, 2.0, 3.0, 4.0, window=60, samples=5, counts=3.0,
+                                  cpm_low=1.0, cpm_high=6.0, usv_low=0.1, usv_high=0.6)
+        self.assertEqual(sample, pickle.loads(pickle.dumps(sample)))
+        self.assertEqual(3.0, sample["data"]["Count Per Minute"]["value"])
+
+
+if __name__ == "__main__":
+    unittest.main()
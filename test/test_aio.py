@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import asyncio
+import os
+import threading
+import tty
+import unittest
+try:
+    from unittest.mock import MagicMock
+except ImportError:
+    from mock import MagicMock
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from radiation_monitor.aio import AsyncEngine
+from radiation_monitor.aio import AsyncHttpClient
+from radiation_monitor.event import CircuitBreakerEventHandler
+from radiation_monitor.event import SafeCastFixedLocationEventHandler
+from radiation_monitor.source import ISource
+from radiation_monitor.source import SourceError
+
+
+class StubServer(HTTPServer):
+    def __init__(self):
+        self.requests = []
+        self.connections = set()
+        self.status = 201
+        HTTPServer.__init__(self, ("127.0.0.1", 0), StubRequestHandler)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.server_port)
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests.append((self.path, body))
+        self.server.connections.add(self.client_address)
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+class BrokenSource(ISource):
+    """ Source which is readable but fails like unplugged serial port, and
+        works after it is opened again.
+    """
+
+    opened_ = 0
+
+    def open(self):
+        self.fds_ = os.pipe()
+        self.opened_ += 1
+        os.write(self.fds_[1], b"x" if self.opened_ == 1 else b"10 [cpm]\n")
+
+    def fileno(self):
+        if self.fds_ is None:
+            raise ValueError("closed")
+        return self.fds_[0]
+
+    def read(self):
+        if self.opened_ == 1:
+            raise SourceError("broken")
+        return os.read(self.fds_[0], 4096)
+
+    def close(self):
+        for fd in self.fds_:
+            os.close(fd)
+        self.fds_ = None
+
+
+class TestAsyncHttpClient(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_post_form_with_keep_alive(self):
+        client = AsyncHttpClient()
+        loop = asyncio.new_event_loop()
+
+        try:
+            for i in range(3):
+                status = loop.run_until_complete(
+                    client.post_form(self.server.url + "/measurements?api_key=hoge", {"value": i}))
+                self.assertEqual(201, status)
+            loop.run_until_complete(client.close())
+        finally:
+            loop.close()
+
+        self.assertEqual(
+            [("/measurements?api_key=hoge", "value={}".format(i).encode("ascii")) for i in range(3)],
+            self.server.requests)
+        self.assertEqual(1, len(self.server.connections))
+
+
+class TestAsyncEngine(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def test_dispatch_lines_to_handlers(self):
+        received = threading.Event()
+
+        def mocked_run(data):
+            if data.cpm == 30:
+                received.set()
+
+        blocking_handler = MagicMock()
+        blocking_handler._run = MagicMock(side_effect=mocked_run)
+
+        safecast = SafeCastFixedLocationEventHandler("hogekey", 123, 35.0, 139.0)
+        safecast.API_URL = self.server.url + "/measurements"
+
+        engine = AsyncEngine([("safecast", safecast), ("blocking", blocking_handler)])
+        engine.add_serial("hoge", os.ttyname(self.slave), 9600)
+
+        thread = threading.Thread(target=engine.run)
+        thread.start()
+
+        os.write(self.master, b"20 [cpm]\nnoise\n3")
+        os.write(self.master, b"0 [cpm]\n")
+
+        self.assertTrue(received.wait(5))
+        engine.stop()
+        thread.join()
+
+        self.assertEqual(2, blocking_handler._run.call_count)
+        blocking_handler.close.assert_called_once_with()
+        self.assertEqual(2, len(self.server.requests))
+        self.assertEqual(2, safecast.latency()["count"])
+
+    def test_broken_source(self):
+        received = {}
+        is_all_received = threading.Event()
+
+        def mocked_run(data):
+            received[(data.device, type(data).__name__)] = data
+            if len(received) == 3:
+                is_all_received.set()
+
+        handler = MagicMock()
+        handler._run = MagicMock(side_effect=mocked_run)
+
+        engine = AsyncEngine([("blocking", handler)], backoff=0.05)
+        engine.add_source(BrokenSource("broken"))
+        engine.add_serial("hoge", os.ttyname(self.slave), 9600)
+
+        thread = threading.Thread(target=engine.run)
+        thread.start()
+
+        os.write(self.master, b"20 [cpm]\n")
+
+        # the other source keeps working, the broken one is opened again with
+        # Gap, and stop() closes the handlers.
+        self.assertTrue(is_all_received.wait(5))
+        engine.stop()
+        thread.join()
+
+        self.assertEqual(
+            {("hoge", "Sample"), ("broken", "Gap"), ("broken", "Sample")}, set(received))
+        self.assertEqual(10, received[("broken", "Sample")].cpm)
+        self.assertGreaterEqual(received[("broken", "Gap")].seconds, 0.05)
+        self.assertEqual(
+            ["broken", "hoge"], sorted(source.name for source, usv_per_cpm, parser in engine.sources_))
+        handler.close.assert_called_once_with()
+
+    def test_breaker_opens_on_server_error(self):
+        self.server.status = 500
+        received = threading.Event()
+
+        def mocked_run(data):
+            if data.cpm == 40:
+                received.set()
+
+        blocking_handler = MagicMock()
+        blocking_handler._run = MagicMock(side_effect=mocked_run)
+
+        safecast = SafeCastFixedLocationEventHandler("hogekey", 123, 35.0, 139.0, retries=0)
+        safecast.API_URL = self.server.url + "/measurements"
+        breaker = CircuitBreakerEventHandler(safecast, "safecast", failures=2, reset_timeout=60.0)
+
+        engine = AsyncEngine([("safecast", breaker), ("blocking", blocking_handler)])
+        engine.add_serial("hoge", os.ttyname(self.slave), 9600)
+
+        thread = threading.Thread(target=engine.run)
+        thread.start()
+
+        os.write(self.master, b"10 [cpm]\n20 [cpm]\n30 [cpm]\n40 [cpm]\n")
+
+        self.assertTrue(received.wait(5))
+        engine.stop()
+        thread.join()
+
+        self.assertEqual(2, len(self.server.requests))
+        health = breaker.health()
+        self.assertEqual("open", health["state"])
+        self.assertEqual(2, health["shed"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -15,6 +15,9 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import os
+import shutil
+import tempfile
 import unittest
 from radiation_monitor import argparser
 
@@ -50,6 +53,56 @@ class TestArgParser(unittest.TestCase):
         self.assertEqual(None, parsed.log_file)
         self.assertEqual(False, parsed.just_get_status)
         self.assertEqual(False, parsed.debug)
+        self.assertEqual(None, parsed.device_name)
+
+    def test_many_devices(self):
+        parsed = argparser.init([
+            "/dev/ttyUSB0", "/dev/ttyUSB1", "/dev/ttyUSB2", "9600", "-n", "roof", "garden"])
+
+        self.assertEqual(["/dev/ttyUSB0", "/dev/ttyUSB1", "/dev/ttyUSB2"], parsed.serial_device_path)
+        self.assertEqual(9600, parsed.serial_baudrate[0])
+        self.assertEqual(["roof", "garden"], parsed.device_name)
+
+    def test_config_file(self):
+        path = tempfile.mkdtemp()
+        config_file = os.path.join(path, "radiation_monitor.ini")
+
+        with open(config_file, "w") as f:
+            f.write(
+                "[radiation_monitor]\n"
+                "serial_device_path = /dev/ttyUSB0 tcp://localhost:2000\n"
+                "serial_baudrate = 9600\n"
+                "window = 60\n"
+                "debug = yes\n"
+                "[safecast]\n"
+                "api_key = key\n"
+                "latitude = 35.0\n"
+                "window = 300\n")
+
+        try:
+            parsed = argparser.init(["-c", config_file, "--window", "120"])
+            self.assertEqual(["/dev/ttyUSB0", "tcp://localhost:2000"], parsed.serial_device_path)
+            self.assertEqual([9600], parsed.serial_baudrate)
+            self.assertEqual(120, parsed.window)
+            self.assertEqual(True, parsed.debug)
+            self.assertEqual("key", parsed.safecast_api_key)
+            self.assertEqual("35.0", parsed.latitude)
+            self.assertEqual(300, parsed.safecast_window)
+
+            with open(config_file, "a") as f:
+                f.write("unknown = 1\n")
+            self.assertRaises(SystemExit, argparser.init, ["-c", config_file])
+        finally:
+            shutil.rmtree(path)
+
+    def test_asyncio_engine(self):
+        parsed = argparser.init(["/dev/ttyUSB0", "9600", "--engine", "asyncio", "--breaker-failures", "3"])
+        self.assertEqual("asyncio", parsed.engine)
+
+        for option in (["--window", "60"], ["--alert-usv", "0.5"], ["--spool-dir", "/tmp"],
+                       ["--control-socket", "/tmp/sock"], ["-tck", "key"]):
+            self.assertRaises(
+                SystemExit, argparser.init, ["/dev/ttyUSB0", "9600", "--engine", "asyncio"] + option)
 
 #    def test_charge_curent_high(self):
 #        parsed = argparser.init(["-ch", ])
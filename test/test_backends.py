@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import subprocess
+import sys
+import unittest
+try:
+    from unittest.mock import MagicMock, patch
+except ImportError:
+    from mock import MagicMock, patch
+from radiation_monitor import backends
+from radiation_monitor.event import SafeCastFixedLocationEventHandler
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code, *options):
+    """ Run code with a fresh interpreter and return (stdout, stderr). """
+    proc = subprocess.run(
+        [sys.executable] + list(options) + ["-c", code],
+        cwd=_ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    return proc.stdout, proc.stderr
+
+
+class TestBackends(unittest.TestCase):
+    def tearDown(self):
+        backends._specs.pop("test", None)
+        backends._registered.discard("test")
+        backends._loaded.pop("test", None)
+
+    def test_load_builtin(self):
+        self.assertIs(SafeCastFixedLocationEventHandler, backends.load("safecast"))
+        self.assertIn("twitter", backends.names())
+
+    def test_register(self):
+        backends.register("test", "radiation_monitor.event:SafeCastFixedLocationEventHandler")
+        self.assertIs(SafeCastFixedLocationEventHandler, backends.load("test"))
+
+        handler = MagicMock()
+        backends.register("test", handler)
+        self.assertIs(handler, backends.load("test"))
+
+    def test_unknown(self):
+        with self.assertRaises(KeyError):
+            backends.load("unknown")
+
+    def test_entry_point_overrides_builtin(self):
+        point = MagicMock(value="radiation_monitor.event:SafeCastFixedLocationEventHandler")
+        point.name = "test"
+
+        with patch.object(backends, "entry_points", return_value={backends.ENTRY_POINT_GROUP: [point]}), \
+                patch.object(backends, "_is_entry_points_read", False), \
+                patch.dict(backends._specs, {"test": "no.such.module:Handler"}):
+            self.assertIs(SafeCastFixedLocationEventHandler, backends.load("test"))
+
+
+class TestStartup(unittest.TestCase):
+    def test_backends_are_not_imported(self):
+        _, stderr = run_python("import radiation_monitor.config", "-X", "importtime")
+
+        # "import time: self [us] | cumulative | imported package"
+        imported = set(
+            line.split("|")[-1].strip() for line in stderr.splitlines()
+            if line.startswith("import time:"))
+
+        self.assertIn("radiation_monitor.backends", imported)
+        for name in ("requests", "numpy", "radiation_monitor.event", "event_listener.handler"):
+            self.assertNotIn(name, imported)
+
+    @unittest.skipUnless(os.path.exists("/proc/self/status"), "needs procfs")
+    def test_rss(self):
+        # ru_maxrss is inherited from the parent over fork and exec.
+        code = "import re, {}; print(re.search(r'VmRSS:\\s+(\\d+)', open('/proc/self/status').read()).group(1))"
+
+        lazy, _ = run_python(code.format("radiation_monitor.config"))
+        eager, _ = run_python(code.format(
+            "radiation_monitor.config, radiation_monitor.event, radiation_monitor.rolling"))
+
+        self.assertLess(int(lazy), int(eager))
+
+
+if __name__ == "__main__":
+    unittest.main()
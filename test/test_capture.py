@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from radiation_monitor import argparser
+from radiation_monitor import config
+from radiation_monitor.capture import CaptureWriter
+from radiation_monitor.capture import ReplaySource
+from radiation_monitor.capture import read_capture
+from radiation_monitor.source import CpmLineParser
+from radiation_monitor.storage import SQLiteStore
+
+
+class TestCapture(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_capture(self, name, lines):
+        path = os.path.join(self.path, name)
+        capture = CaptureWriter(path)
+        start = capture.monotonic_
+
+        for offset, device, line in lines:
+            capture.write(device, line, monotonic=start + offset)
+
+        capture.close()
+        return path
+
+    def test_round_trip(self):
+        for name in ("capture.jsonl", "capture.jsonl.gz"):
+            lines = [(0.0, "a", b"20 [cpm]\r"), (0.5, "b", b"\xff\x00noise"), (1.25, "a", b"")]
+            path = self.write_capture(name, lines)
+
+            header, records = read_capture(path)
+
+            self.assertEqual(1, header["version"])
+            self.assertEqual(lines, list(records))
+
+    def test_not_capture_file(self):
+        path = os.path.join(self.path, "foo.txt")
+        with open(path, "w") as f:
+            f.write("20\n")
+
+        self.assertRaises(ValueError, read_capture, path)
+
+    def test_parser_captures_raw_lines(self):
+        path = os.path.join(self.path, "capture.jsonl")
+        capture = CaptureWriter(path)
+        parser = CpmLineParser(device="a", capture=capture)
+
+        parser.feed(b"20\nno")
+        parser.feed(b"ise\n30\n")
+        capture.close()
+
+        header, records = read_capture(path)
+        self.assertEqual([b"20", b"noise", b"30"], [raw for offset, device, raw in records])
+
+    def test_replay_as_fast_as_possible(self):
+        path = self.write_capture("capture.jsonl", [
+            (0.0, "a", b"20"), (60.0, "a", b"noise"), (120.0, "b", b"30"), (3600.0, "a", b"40")])
+        header, records = read_capture(path)
+        list(records)
+
+        results = []
+        for i in range(2):
+            samples = []
+            source = ReplaySource(path, samples.append, speed=0)
+
+            started = time.monotonic()
+            source.start()
+            source.join(5)
+
+            self.assertLess(time.monotonic() - started, 1.0)
+            self.assertEqual(3, source.count)
+            results.append([(s.device, s.epoch, s.cpm) for s in samples])
+
+        # same samples from the same file.
+        self.assertEqual(results[0], results[1])
+        self.assertEqual([
+            ("a", header["epoch"], 20),
+            ("b", header["epoch"] + 120.0, 30),
+            ("a", header["epoch"] + 3600.0, 40),
+        ], results[0])
+
+    def test_replay_at_speed(self):
+        path = self.write_capture("capture.jsonl", [(0.0, "a", b"20"), (1.0, "a", b"30")])
+        source = ReplaySource(path, lambda sample: None, speed=10.0)
+
+        started = time.monotonic()
+        source.start()
+        source.join(5)
+
+        self.assertAlmostEqual(0.1, time.monotonic() - started, delta=0.08)
+
+    def test_stop(self):
+        path = self.write_capture("capture.jsonl", [(0.0, "a", b"20"), (3600.0, "a", b"30")])
+        source = ReplaySource(path, lambda sample: None)
+
+        source.start()
+        source.stop()
+        source.join(1)
+
+        self.assertFalse(source.is_alive())
+
+    def test_replay_through_triggers(self):
+        path = self.write_capture("capture.jsonl", [(i * 1.0, "a", b"20") for i in range(100)])
+        database = os.path.join(self.path, "radiation_monitor.db")
+        args = argparser.init(["/dev/null", "9600", "-db", database, "--database-batch-max", "10"])
+
+        triggers = config.init_triggers(**dict(args._get_kwargs()))
+        triggers.start()
+        source = ReplaySource(path, triggers.put, speed=0)
+        source.start()
+        source.join(5)
+        self.assertTrue(triggers.flush(timeout=5))
+
+        store = SQLiteStore(database)
+        deadline = time.monotonic() + 5
+
+        while len(list(store.readings("a", 0, float("inf")))) < 100 and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        self.assertEqual(100, len(list(store.readings("a", 0, float("inf")))))
+        store.close()
+        triggers.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -15,9 +15,20 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import threading
+import time
 import unittest
+try:
+    from unittest.mock import MagicMock, patch
+except ImportError:
+    from mock import MagicMock, patch
 from radiation_monitor import argparser
 from radiation_monitor import config
+from radiation_monitor import metrics
+from radiation_monitor import rolling
+from radiation_monitor.sample import Gap
+from radiation_monitor.sample import Sample
+from radiation_monitor.threshold import ThresholdDetector
 
 
 class TestConfig(unittest.TestCase):
@@ -41,6 +52,366 @@ class TestConfig(unittest.TestCase):
 
         triggers = config.init_triggers(**kwargs)
 
+        self.assertEqual(0, len(triggers))
+
+    def test_one_trigger_per_handler(self):
+        args = argparser.init([
+            "/dev/tty.usbserial", "19200",
+            "-sk", "key", "-sd", "1", "-lat", "35.0", "-lon", "139.0"])
+        kwargs = dict(args._get_kwargs())
+
+        triggers = config.init_triggers(**kwargs)
+
+        self.assertEqual(1, len(triggers))
+        self.assertEqual("safecast", triggers.name_of(triggers[0]))
+
+    def test_circuit_breaker(self):
+        args = argparser.init([
+            "/dev/tty.usbserial", "19200",
+            "-sk", "key", "-sd", "1", "-lat", "35.0", "-lon", "139.0",
+            "-db", ":memory:", "--breaker-failures", "3"])
+        kwargs = dict(args._get_kwargs())
+
+        triggers = config.init_triggers(**kwargs)
+
+        health = triggers.health()
+        self.assertEqual(1, len(health))
+        self.assertEqual("safecast", health[0]["name"])
+        self.assertEqual("closed", health[0]["state"])
+        self.assertEqual(3, triggers.breakers_[id(triggers[1])].failures_max_)
+        self.assertIn(
+            ("radiation_monitor_circuit_state", "gauge",
+             "Circuit breaker state of event handler. 0: closed, 1: half-open, 2: open",
+             [({"handler": "safecast"}, 0)]),
+            triggers.collect_metrics())
+
+    def test_window_per_handler(self):
+        args = argparser.init([
+            "/dev/tty.usbserial", "19200",
+            "-sk", "key", "-sd", "1", "-lat", "35.0", "-lon", "139.0",
+            "-db", ":memory:", "--window", "60", "--safecast-window", "300"])
+        kwargs = dict(args._get_kwargs())
+
+        triggers = config.init_triggers(**kwargs)
+
+        windows = dict((triggers.name_of(t), triggers.window_of(t)) for t in triggers)
+        self.assertEqual({"database": None, "safecast": 300}, windows)
+
+    @unittest.skipUnless(rolling.numpy, "numpy is not installed")
+    def test_anomaly_detector(self):
+        args = argparser.init([
+            "/dev/tty.usbserial", "19200",
+            "-sk", "key", "-sd", "1", "-lat", "35.0", "-lon", "139.0",
+            "--anomaly-window", "3600"])
+        kwargs = dict(args._get_kwargs())
+
+        triggers = config.init_triggers(**kwargs)
+
+        self.assertEqual(1, len(triggers.detectors_))
+        self.assertIsInstance(triggers.detectors_[0], rolling.AnomalyDetector)
+        self.assertFalse(triggers.is_alert(triggers[0]))
+
+    def test_twitter_gets_threshold_alerts(self):
+        args = argparser.init([
+            "/dev/tty.usbserial", "19200",
+            "-tck", "ck", "-tcs", "cs", "-tk", "k", "-ts", "s", "--alert-usv", "0.5"])
+        kwargs = dict(args._get_kwargs())
+
+        handler = MagicMock()
+        with patch.dict("radiation_monitor.backends._loaded", {"twitter": handler}):
+            triggers = config.init_triggers(**kwargs)
+
+        self.assertEqual(("ck", "cs", "k", "s"), handler.call_args[0])
+        self.assertEqual("Micro Sievert Per Hour", handler.call_args[1]["value_label"])
+        self.assertTrue(triggers.is_alert(triggers[0]))
+        self.assertIsInstance(triggers.detectors_[0], ThresholdDetector)
+
+    def test_reload_changed_handler(self):
+        args = [
+            "/dev/tty.usbserial", "19200",
+            "-sk", "key", "-sd", "1", "-lat", "35.0", "-lon", "139.0", "-db", ":memory:"]
+        kwargs = dict(argparser.init(args)._get_kwargs())
+        triggers = config.init_triggers(**kwargs)
+        triggers.start()
+        database, safecast = triggers
+
+        new_kwargs = dict(argparser.init(args + ["--safecast-window", "300", "--alert-usv", "0.5"])._get_kwargs())
+        changed = config.reload_triggers(triggers, kwargs, new_kwargs)
+
+        self.assertEqual(["safecast", "detectors"], changed)
+        self.assertIs(database, triggers[0])
+        self.assertIsNot(safecast, triggers[1])
+        self.assertEqual(300, triggers.window_of(triggers[1]))
+        self.assertIsInstance(triggers.detectors_[0], ThresholdDetector)
+
+        # the handler is removed if its settings are removed.
+        changed = config.reload_triggers(triggers, new_kwargs, dict(new_kwargs, safecast_api_key=None))
+        self.assertEqual(["safecast"], changed)
+        self.assertEqual(["database"], [triggers.name_of(t) for t in triggers])
+
+        triggers.stop()
+
+    def test_reload_invalid_handler(self):
+        args = [
+            "/dev/tty.usbserial", "19200",
+            "-sk", "key", "-sd", "1", "-lat", "35.0", "-lon", "139.0", "-db", ":memory:", "--window", "60"]
+        kwargs = dict(argparser.init(args)._get_kwargs())
+        triggers = config.init_triggers(**kwargs)
+        triggers.start()
+        database, safecast = triggers
+
+        new_kwargs = dict(kwargs, spool_dir="/proc/nonexistent/spool")
+        self.assertRaises((IOError, OSError), config.reload_triggers, triggers, kwargs, new_kwargs)
+
+        # the handler is rebuilt with the old settings and not paused.
+        self.assertEqual(["database", "safecast"], [triggers.name_of(t) for t in triggers])
+        self.assertIsNot(safecast, triggers[1])
+        self.assertEqual(60, triggers.window_of(triggers[1]))
+        self.assertIn(id(triggers[1]), triggers.aggregators_)
+        self.assertEqual(1, len(triggers.aggregators_))
+        self.assertFalse(triggers.stats()[1]["paused"])
+
+        # the next reload finds it by name.
+        changed = config.reload_triggers(triggers, kwargs, dict(kwargs, safecast_window=300))
+        self.assertEqual(["safecast"], changed)
+        self.assertEqual(["database", "safecast"], [triggers.name_of(t) for t in triggers])
+        self.assertEqual(300, triggers.window_of(triggers[1]))
+
+        triggers.stop()
+
+
+class TestListTrigger(unittest.TestCase):
+    def setUp(self):
+        self.unlock_put = threading.Event()
+        self.put_entered = threading.Event()
+
+        def mocked_put_q(data):
+            self.put_entered.set()
+            self.unlock_put.wait()
+
+        self.slow_trigger = MagicMock()
+        self.slow_trigger.put_q = MagicMock(side_effect=mocked_put_q)
+        self.fast_trigger = MagicMock()
+
+    def tearDown(self):
+        self.unlock_put.set()
+
+    def test_pause_resume_and_flush_now(self):
+        batch_handler = MagicMock(spec=["flush"])
+        handler = MagicMock(spec=["handler_"])
+        handler.handler_ = batch_handler
+
+        triggers = config.ListTrigger()
+        triggers.append(self.fast_trigger, "fast", window=3600, handler=handler)
+        triggers.start()
+
+        triggers.pause("fast")
+        triggers.put(Sample("a", 0.0, 0.0, 10, 0.1))
+        self.assertTrue(triggers.flush_now(timeout=5))
+
+        stats = triggers.stats()[0]
+        self.assertTrue(stats["paused"])
+        self.assertEqual(1, stats["depth"])
+        self.fast_trigger.put_q.assert_not_called()
+        batch_handler.flush.assert_not_called()
+
+        triggers.resume("fast")
+        self.assertTrue(triggers.flush_now(timeout=5))
+        self.assertEqual(10, self.fast_trigger.put_q.call_args[0][0].cpm)
+        self.assertFalse(triggers.stats()[0]["paused"])
+        batch_handler.flush.assert_called_once_with()
+
+        self.assertRaises(KeyError, triggers.pause, "unknown")
+
+        # the data kept by pause() is put at stopping.
+        triggers.pause("fast")
+        triggers.put(Sample("a", 0.0, 0.0, 20, 0.2))
+        triggers.stop()
+        self.assertEqual(20, self.fast_trigger.put_q.call_args[0][0].cpm)
+
+    def test_pause_does_not_wait_for_slow_trigger(self):
+        triggers = config.ListTrigger()
+        triggers.append(self.slow_trigger, "slow")
+        triggers.start()
+
+        triggers.put(1)
+        triggers.put(2)
+        self.assertFalse(triggers.flush(timeout=0.1))
+
+        # the data being passed to the blocked trigger doesn't stop pause().
+        start = time.monotonic()
+        triggers.pause("slow")
+        self.assertLess(time.monotonic() - start, 0.1)
+
+        with triggers.replace_lock_:
+            self.assertRaises(RuntimeError, triggers.pause, "slow")
+            self.assertRaises(RuntimeError, triggers.resume, "slow")
+
+        stats = triggers.stats()[0]
+        self.assertTrue(stats["paused"])
+        self.assertEqual(2, stats["depth"])
+        self.assertEqual(1, self.slow_trigger.put_q.call_count)
+
+        self.unlock_put.set()
+        triggers.resume("slow")
+        self.assertTrue(triggers.flush(timeout=5))
+        self.assertEqual(2, self.slow_trigger.put_q.call_count)
+        triggers.stop()
+
+    def test_put_does_not_wait_for_slow_trigger(self):
+        triggers = config.ListTrigger()
+        triggers.append(self.slow_trigger, "slow")
+        triggers.append(self.fast_trigger, "fast")
+        triggers.start()
+
+        for i in range(3):
+            triggers.put(i)
+
+        self.assertFalse(triggers.flush(timeout=0.1))
+        self.assertEqual(3, self.fast_trigger.put_q.call_count)
+
+        stats = dict((s["name"], s) for s in triggers.stats())
+        self.assertEqual(3, stats["slow"]["put"])
+        self.assertEqual(3, stats["slow"]["depth"])
+        self.assertEqual(0, stats["fast"]["depth"])
+
+        self.unlock_put.set()
+        self.assertTrue(triggers.flush(timeout=5))
+        self.assertEqual(3, self.slow_trigger.put_q.call_count)
+        self.assertGreater(triggers.stats()[0]["blocked_sec"], 0.0)
+
+        triggers.stop()
+        self.slow_trigger.stop.assert_called_once_with()
+        self.fast_trigger.join.assert_called_once_with()
+
+    def test_put_drops_oldest_if_full(self):
+        triggers = config.ListTrigger(q_max=2)
+        triggers.append(self.slow_trigger, "slow")
+        triggers.start()
+
+        triggers.put(0)
+        self.put_entered.wait()
+        for i in range(1, 5):
+            triggers.put(i)
+
+        self.unlock_put.set()
+        self.assertTrue(triggers.flush(timeout=5))
+        self.assertEqual(2, triggers.stats()[0]["dropped"])
+        triggers.stop()
+
+    def test_put_with_window(self):
+        triggers = config.ListTrigger()
+        triggers.append(self.fast_trigger, "fast")
+        triggers.append(self.slow_trigger, "windowed", window=3600)
+        self.unlock_put.set()
+        triggers.start()
+
+        for i in range(5):
+            triggers.put(Sample("a", float(i), float(i), 10 * i, 0.1 * i))
+
+        self.assertTrue(triggers.flush(timeout=5))
+        self.assertEqual(5, self.fast_trigger.put_q.call_count)
+        self.slow_trigger.put_q.assert_not_called()
+
+        # the partial window is put at stop.
+        triggers.stop()
+        self.assertEqual(1, self.slow_trigger.put_q.call_count)
+        aggregated = self.slow_trigger.put_q.call_args[0][0]
+        self.assertEqual(5, aggregated.samples)
+        self.assertAlmostEqual(20.0, aggregated.cpm)
+
+    def test_put_gap(self):
+        detector = MagicMock()
+        triggers = config.ListTrigger()
+        triggers.append(self.fast_trigger, "fast")
+        triggers.add_detector(detector)
+        self.unlock_put.set()
+        triggers.start()
+
+        triggers.put(Gap("a", 10.0, 1451606410.0, 1451606400.0, 10.0))
+
+        self.assertTrue(triggers.flush(timeout=5))
+        detector.put.assert_not_called()
+        self.fast_trigger.put_q.assert_not_called()
+        triggers.stop()
+
+    def test_put_alert(self):
+        detector = MagicMock()
+        triggers = config.ListTrigger()
+        triggers.append(self.fast_trigger, "fast")
+        triggers.append(self.slow_trigger, "alert", is_alert=True)
+        triggers.add_detector(detector)
+        self.unlock_put.set()
+        triggers.start()
+
+        triggers.put("data")
+        triggers.put_alert("alert")
+
+        self.assertTrue(triggers.flush(timeout=5))
+        detector.put.assert_called_once_with("data")
+        self.fast_trigger.put_q.assert_called_once_with("data")
+        self.slow_trigger.put_q.assert_called_once_with("alert")
+        triggers.stop()
+
+    def test_replace_keeps_queued_data(self):
+        new_trigger = MagicMock()
+        triggers = config.ListTrigger()
+        triggers.append(self.fast_trigger, "fast")
+        triggers.append(self.slow_trigger, "slow")
+        self.unlock_put.set()
+        triggers.start()
+
+        def create():
+            # the data put while replacing waits for the new trigger.
+            triggers.put("during")
+            return new_trigger, None, False, None, None
+
+        triggers.put("before")
+        self.assertTrue(triggers.flush(timeout=5))
+        triggers.replace("slow", create)
+        triggers.put("after")
+
+        self.assertTrue(triggers.flush(timeout=5))
+        self.slow_trigger.stop.assert_called_once_with()
+        new_trigger.start.assert_called_once_with()
+        self.assertEqual(
+            ["during", "after"], [c[0][0] for c in new_trigger.put_q.call_args_list])
+        self.assertEqual(3, self.fast_trigger.put_q.call_count)
+        self.assertIs(new_trigger, triggers[1])
+        self.assertEqual("slow", triggers.name_of(new_trigger))
+
+        triggers.replace("slow", lambda: None)
+        triggers.replace("added", lambda: (self.slow_trigger, 3600, False, None, None))
+        self.assertEqual(["fast", "added"], [triggers.name_of(t) for t in triggers])
+        self.assertEqual(3600, triggers.window_of(self.slow_trigger))
+
+        triggers.put(Sample("a", 0.0, 0.0, 10, 0.1))
+        triggers.stop()
+        self.assertEqual(10, self.slow_trigger.put_q.call_args[0][0].cpm)
+
+    def test_queue_metrics(self):
+        triggers = config.ListTrigger()
+        triggers.append(self.fast_trigger, "fast")
+        triggers.start()
+        triggers.put("data")
+        self.assertTrue(triggers.flush(timeout=5))
+
+        self.assertIn('radiation_monitor_queue_depth{handler="fast"} 0', metrics.REGISTRY.render())
+
+        triggers.stop()
+        self.assertNotIn('handler="fast"', metrics.REGISTRY.render())
+
+    def test_put_with_blocking_mode(self):
+        triggers = config.ListTrigger(is_blocking=True)
+        triggers.append(self.fast_trigger)
+        triggers.start()
+        triggers.put("data")
+
+        self.fast_trigger.put_q.assert_called_once_with("data")
+        self.fast_trigger.join_q.assert_called_once_with()
+        self.assertEqual([], triggers.stats())
+        triggers.stop()
+
 
 if __name__ == "__main__":
     unittest.main()
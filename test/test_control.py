@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+try:
+    from unittest.mock import MagicMock
+except ImportError:
+    from mock import MagicMock
+from radiation_monitor import config
+from radiation_monitor.control import ControlError
+from radiation_monitor.control import ControlServer
+from radiation_monitor.control import query
+from radiation_monitor.sample import Sample
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestControlServer(unittest.TestCase):
+    def setUp(self):
+        self.dir_ = tempfile.mkdtemp()
+        self.path_ = os.path.join(self.dir_, "control.sock")
+        self.server_ = ControlServer(self.path_)
+        self.server_.start()
+
+    def tearDown(self):
+        self.server_.stop()
+        self.server_.join()
+        shutil.rmtree(self.dir_)
+
+    def test_last(self):
+        self.assertEqual([], query(self.path_, "last"))
+
+        self.server_.update(Sample("b", time.monotonic() - 2.0, 1451606400.0, 20, 0.16))
+        self.server_.update(Sample("a", time.monotonic(), 1451606401.0, 10, 0.08))
+        self.server_.update(Sample("a", time.monotonic(), 1451606402.0, 12, 0.09))
+
+        last = query(self.path_, "last")
+        self.assertEqual(["a", "b"], [reading["device"] for reading in last])
+        self.assertEqual(12, last[0]["cpm"])
+        self.assertEqual("2016-01-01T00:00:02Z", last[0]["at"])
+        self.assertGreaterEqual(last[1]["age"], 2.0)
+
+        self.assertEqual([20], [reading["cpm"] for reading in query(self.path_, "last", device="b")])
+
+    def test_devices(self):
+        self.server_.update(Sample("devices-test", time.monotonic(), 1451606400.0, 20, 0.16))
+        self.server_.update(Sample("devices-test", time.monotonic(), 1451606401.0, 22, 0.18))
+
+        device, = query(self.path_, "devices")
+        self.assertEqual("devices-test", device["device"])
+        self.assertEqual(2, device["samples"])
+        self.assertEqual(0, device["disconnects"])
+        self.assertEqual(22, device["last"]["cpm"])
+
+    def test_triggers(self):
+        trigger = MagicMock()
+        batch_handler = MagicMock(spec=["flush"])
+        triggers = config.ListTrigger()
+        triggers.append(trigger, "safecast", handler=batch_handler)
+        triggers.start()
+        self.server_.add_triggers(triggers)
+
+        try:
+            self.assertIn("pause", query(self.path_, "commands"))
+            self.assertIsNone(query(self.path_, "pause", name="safecast"))
+            triggers.put(Sample("a", 0.0, 0.0, 10, 0.1))
+
+            handler, = query(self.path_, "handlers")
+            self.assertEqual(("safecast", True, 1, None),
+                             (handler["name"], handler["paused"], handler["depth"], handler["circuit"]))
+            self.assertRaises(ControlError, query, self.path_, "pause", name="unknown")
+
+            query(self.path_, "resume", name="safecast")
+            self.assertTrue(query(self.path_, "flush"))
+            self.assertEqual(10, trigger.put_q.call_args[0][0].cpm)
+            batch_handler.flush.assert_called_once_with()
+        finally:
+            triggers.stop()
+
+    def test_blocking_command(self):
+        unlock = threading.Event()
+        self.server_.add_command("wait", lambda: unlock.wait(5), is_blocking=True)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path_)
+        sock.sendall(b'{"command": "wait"}\n{"command": "commands"}\n')
+
+        # the other clients are served while the command is blocked.
+        self.assertEqual([], query(self.path_, "last"))
+        unlock.set()
+
+        with sock.makefile("rb") as f:
+            responses = [json.loads(f.readline().decode("utf-8")) for i in range(2)]
+        sock.close()
+
+        self.assertEqual(True, responses[0]["result"])
+        self.assertIn("wait", responses[1]["result"])
+
+    def test_errors(self):
+        self.assertRaises(ControlError, query, self.path_, "unknown")
+        self.assertRaises(ControlError, query, self.path_, "last", wrong=1)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path_)
+        sock.sendall(b"[]\n" + b"x" * 5000)
+
+        with sock.makefile("rb") as f:
+            responses = [json.loads(line.decode("utf-8")) for line in f]
+        sock.close()
+
+        self.assertEqual(["invalid request: request must be an object", "request is too long"],
+                         [response["error"] for response in responses])
+
+    def test_many_requests_in_one_connection(self):
+        self.server_.add_command("echo", lambda value: value)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path_)
+        sock.sendall(b"".join(b'{"command": "echo", "value": %d}\n' % i for i in range(100)))
+
+        with sock.makefile("rb") as f:
+            results = [json.loads(f.readline().decode("utf-8"))["result"] for i in range(100)]
+        sock.close()
+
+        self.assertEqual(list(range(100)), results)
+
+    def test_stale_socket(self):
+        self.assertRaises(OSError, ControlServer, self.path_)
+
+        self.server_.stop()
+        self.server_.join()
+        self.assertFalse(os.path.exists(self.path_))
+
+        # socket file left by the daemon killed.
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path_)
+        sock.close()
+
+        self.server_ = ControlServer(self.path_)
+        self.server_.start()
+        self.assertEqual([], query(self.path_, "last"))
+
+
+class TestJustGetStatus(unittest.TestCase):
+    def run_status(self, *args):
+        proc = subprocess.run(
+            [sys.executable, "-m", "radiation_monitor", "poisson://60?interval=0.05&seed=1", "9600",
+             "--just-get-status", "--status-timeout", "1"] + list(args),
+            cwd=_ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        return proc.returncode, json.loads(proc.stdout)
+
+    def test_from_device(self):
+        code, readings = self.run_status("--control-socket", os.path.join(tempfile.gettempdir(), "no-daemon.sock"))
+
+        self.assertEqual(0, code)
+        self.assertEqual(["Sparkfun SEN-11345"], [reading["device"] for reading in readings])
+
+    def test_from_daemon(self):
+        path = os.path.join(tempfile.mkdtemp(), "control.sock")
+        server = ControlServer(path)
+        server.update(Sample("daemon", time.monotonic(), 1451606400.0, 20, 0.16))
+        server.start()
+
+        try:
+            code, readings = self.run_status("--control-socket", path)
+        finally:
+            server.stop()
+            server.join()
+            os.rmdir(os.path.dirname(path))
+
+        self.assertEqual(0, code)
+        self.assertEqual([("daemon", 20)], [(reading["device"], reading["cpm"]) for reading in readings])
+
+
+class TestControlCommand(unittest.TestCase):
+    def test_control(self):
+        path = os.path.join(tempfile.mkdtemp(), "control.sock")
+        server = ControlServer(path)
+        server.update(Sample("a", time.monotonic(), 1451606400.0, 20, 0.16))
+        server.start()
+
+        def control(*args):
+            proc = subprocess.run(
+                [sys.executable, "-m", "radiation_monitor", "control", path] + list(args),
+                cwd=_ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            return proc.returncode, proc.stdout, proc.stderr
+
+        try:
+            code, stdout, stderr = control("last", "a")
+            self.assertEqual(0, code)
+            self.assertEqual([20], [reading["cpm"] for reading in json.loads(stdout)])
+
+            code, stdout, stderr = control("pause", "safecast")
+            self.assertEqual(1, code)
+            self.assertIn("unknown command", stderr)
+        finally:
+            server.stop()
+            server.join()
+            os.rmdir(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
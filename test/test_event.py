@@ -17,13 +17,30 @@
 
 from collections import OrderedDict
 from datetime import datetime
+import json
+import os
+import requests
+import shutil
+import tempfile
+import threading
 import unittest
 try:
-    from unittest.mock import patch
+    from http.server import BaseHTTPRequestHandler, HTTPServer
 except ImportError:
-    from mock import patch
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+try:
+    from unittest.mock import MagicMock, patch
+except ImportError:
+    from mock import MagicMock, patch
+from radiation_monitor.event import CircuitBreakerEventHandler
+from radiation_monitor.event import CircuitOpenError
+from radiation_monitor.event import LocalStorageEventHandler
+from radiation_monitor.event import SafeCastBatchEventHandler
+from radiation_monitor.sample import Sample
+from radiation_monitor.storage import SQLiteStore
 from radiation_monitor.event import SafeCastEventHandler
 from radiation_monitor.event import SafeCastFixedLocationEventHandler
+from radiation_monitor.event import SpooledEventHandler
 
 
 class TestSafeCastEventHandler(unittest.TestCase):
@@ -31,8 +48,9 @@ class TestSafeCastEventHandler(unittest.TestCase):
     def setUpClass(cls):
         pass
 
-    @patch("radiation_monitor.event.requests.post", autospec=True)
-    def test_run_with_normal(self, patched_post):
+    @patch("radiation_monitor.event.requests.Session", autospec=True)
+    def test_run_with_normal(self, patched_session):
+        patched_session.return_value.post.return_value = MagicMock(status_code=201)
         data = {}
         data["at"] = datetime(2016, 1, 1, 10, 00)
         data["data"] = {
@@ -61,7 +79,52 @@ class TestSafeCastEventHandler(unittest.TestCase):
         safecast.stop()
         safecast.join()
 
-        patched_post.assert_called_once_with("https://api.safecast.org/en-US/measurements?api_key=hogekey", data=expected_data)
+        patched_session.return_value.post.assert_called_once_with(
+            "https://api.safecast.org/en-US/measurements?api_key=hogekey",
+            data=expected_data, timeout=(3.05, 10))
+        patched_session.return_value.close.assert_called_once_with()
+
+
+class TestSafeCastEventHandlerPost(unittest.TestCase):
+    @patch("radiation_monitor.event.time.sleep", autospec=True)
+    @patch("radiation_monitor.event.requests.Session", autospec=True)
+    def test_post_retries_with_backoff(self, patched_session, patched_sleep):
+        response = MagicMock(status_code=200)
+        session = patched_session.return_value
+        session.post.side_effect = [requests.ConnectionError(), requests.Timeout(), response]
+
+        safecast = SafeCastEventHandler(api_key="hogekey", device_id=123, retries=3, backoff=0.5)
+
+        self.assertIs(response, safecast.post("http://localhost/", data={}))
+        self.assertEqual(3, session.post.call_count)
+        self.assertEqual([((0.5,),), ((1.0,),)], patched_sleep.call_args_list)
+        self.assertEqual(1, safecast.latency()["count"])
+
+    @patch("radiation_monitor.event.time.sleep", autospec=True)
+    @patch("radiation_monitor.event.requests.Session", autospec=True)
+    def test_post_gives_up_after_retries(self, patched_session, patched_sleep):
+        session = patched_session.return_value
+        session.post.side_effect = requests.Timeout()
+
+        safecast = SafeCastEventHandler(api_key="hogekey", device_id=123, retries=2)
+
+        self.assertRaises(requests.Timeout, safecast.post, "http://localhost/", data={})
+        self.assertEqual(3, session.post.call_count)
+        self.assertEqual(0, safecast.latency()["count"])
+
+    @patch("radiation_monitor.event.time.sleep", autospec=True)
+    @patch("radiation_monitor.event.requests.Session", autospec=True)
+    def test_post_retries_server_error(self, patched_session, patched_sleep):
+        session = patched_session.return_value
+        session.post.side_effect = [MagicMock(status_code=503), MagicMock(status_code=201)]
+
+        safecast = SafeCastEventHandler(api_key="hogekey", device_id=123)
+
+        self.assertEqual(201, safecast.post("http://localhost/", data={}).status_code)
+
+        latency = safecast.latency()
+        self.assertEqual(2, latency["count"])
+        self.assertGreaterEqual(latency["max"], latency["mean"])
 
 
 class TestSafeCastFixedLocationEventHandler(unittest.TestCase):
@@ -79,8 +142,9 @@ class TestSafeCastFixedLocationEventHandler(unittest.TestCase):
     def tearDown(self):
         pass
 
-    @patch("radiation_monitor.event.requests.post", autospec=True)
-    def test_run_with_normal(self, patched_post):
+    @patch("radiation_monitor.event.requests.Session", autospec=True)
+    def test_run_with_normal(self, patched_session):
+        patched_session.return_value.post.return_value = MagicMock(status_code=201)
         data = {}
         data["at"] = datetime(2016, 1, 1, 10, 00)
         data["data"] = {
@@ -107,7 +171,345 @@ class TestSafeCastFixedLocationEventHandler(unittest.TestCase):
         safecast.stop()
         safecast.join()
 
-        patched_post.assert_called_once_with("https://api.safecast.org/en-US/measurements?api_key=hogekey", data=expected_data)
+        patched_session.return_value.post.assert_called_once_with(
+            "https://api.safecast.org/en-US/measurements?api_key=hogekey",
+            data=expected_data, timeout=(3.05, 10))
+        patched_session.return_value.close.assert_called_once_with()
+
+    @patch("radiation_monitor.event.requests.Session", autospec=True)
+    def test_run_with_sample(self, patched_session):
+        patched_session.return_value.post.return_value = MagicMock(status_code=201)
+        sample = Sample("hoge", 100.0, 1451642400.0, 20, 0.1624)
+        expected_data = OrderedDict()
+        expected_data["utf8"] = "✓"
+        expected_data["measurement[value]"] = 0.1624
+        expected_data["measurement[unit]"] = "usv"
+        expected_data["measurement[captured_at]"] = "01 January 2016, 10:00:00"
+        expected_data["measurement[latitude]"] = 123.0
+        expected_data["measurement[longitude]"] = 456.0
+        expected_data["measurement[device_id]"] = "123"
+        expected_data["measurement[height]"] = "1m"
+        expected_data["measurement[surface]"] = "Soil"
+        expected_data["measurement[radiation]"] = "Air"
+
+        safecast = SafeCastFixedLocationEventHandler(api_key="hogekey", device_id=123, latitude=123.0, longitude=456.0)
+        safecast._run(sample)
+
+        patched_session.return_value.post.assert_called_once_with(
+            "https://api.safecast.org/en-US/measurements?api_key=hogekey",
+            data=expected_data, timeout=(3.05, 10))
+
+
+class StubSafeCastServer(HTTPServer):
+    """ Local HTTP server to record requests instead of SafeCast. """
+
+    def __init__(self, is_bulk_accepted=True, status=201):
+        self.is_bulk_accepted = is_bulk_accepted
+        self.status = status
+        self.requests = []
+        self.received = threading.Event()
+        HTTPServer.__init__(self, ("127.0.0.1", 0), StubSafeCastRequestHandler)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.server_port)
+
+
+class StubSafeCastRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests.append((self.path, body))
+        self.server.received.set()
+
+        is_bulk = self.path.startswith("/measurements.json")
+        self.send_response(404 if is_bulk and not self.server.is_bulk_accepted else self.server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSafeCastBatchEventHandler(unittest.TestCase):
+    def start_server(self, is_bulk_accepted=True, status=201):
+        server = StubSafeCastServer(is_bulk_accepted, status)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def run_handler(self, server, count, **kwargs):
+        safecast = SafeCastBatchEventHandler(
+            api_key="hogekey", device_id=123, latitude=123.0, longitude=456.0, **kwargs)
+        safecast.API_URL = server.url + "/measurements"
+        safecast.BULK_URL = server.url + "/measurements.json"
+        safecast.start()
+
+        for i in range(count):
+            safecast.put_q({"at": datetime(2016, 1, 1, 10, i), "data": {"value": i, "unit": "cpm"}})
+            safecast.join_q()
+
+        return safecast
+
+    def test_send_in_bulk(self):
+        server = self.start_server()
+        safecast = self.run_handler(server, 3, batch_max=3)
+        safecast.stop()
+        safecast.join()
+
+        self.assertEqual(1, len(server.requests))
+        path, body = server.requests[0]
+        self.assertEqual("/measurements.json?api_key=hogekey", path)
+        measurements = json.loads(body.decode("utf-8"))["measurements"]
+        self.assertEqual([0, 1, 2], [m["value"] for m in measurements])
+        self.assertEqual("123", measurements[0]["device_id"])
+
+    def test_fall_back_to_each_post_if_rejected(self):
+        server = self.start_server(is_bulk_accepted=False)
+        safecast = self.run_handler(server, 2, batch_max=2)
+        safecast.stop()
+        safecast.join()
+
+        self.assertEqual(
+            ["/measurements.json?api_key=hogekey",
+             "/measurements?api_key=hogekey",
+             "/measurements?api_key=hogekey"],
+            [path for path, body in server.requests])
+
+    def test_send_by_age(self):
+        server = self.start_server()
+        safecast = self.run_handler(server, 1, batch_max=10, batch_age=0.1)
+
+        self.assertTrue(server.received.wait(5))
+        self.assertEqual(1, len(server.requests))
+
+        safecast.stop()
+        safecast.join()
+        self.assertEqual(1, len(server.requests))
+
+
+    def test_raise_while_failing(self):
+        server = self.start_server(status=503)
+        safecast = SafeCastBatchEventHandler(
+            api_key="hogekey", device_id=123, latitude=123.0, longitude=456.0, batch_max=2, retries=0)
+        safecast.API_URL = server.url + "/measurements"
+        safecast.BULK_URL = server.url + "/measurements.json"
+        at = datetime(2016, 1, 1, 10, 0)
+
+        # the full batch fails and is kept.
+        safecast.send(0.1, "usv", at, "123", 1.0, 2.0)
+        safecast.send(0.2, "usv", at, "123", 1.0, 2.0)
+        self.assertRaises(requests.HTTPError, safecast.send, 0.3, "usv", at, "123", 1.0, 2.0)
+        self.assertEqual(2, len(safecast.batch_))
+
+        server.status = 201
+        server.requests = []
+        safecast.send(0.3, "usv", at, "123", 1.0, 2.0)
+        safecast.flush()
+        safecast.session_.close()
+
+        values = [json.loads(body.decode("utf-8"))["measurements"] for path, body in server.requests]
+        self.assertEqual([[0.1, 0.2], [0.3]], [[m["value"] for m in bulk] for bulk in values])
+
+    def test_breaker_opens_on_server_error(self):
+        server = self.start_server(status=503)
+        safecast = SafeCastFixedLocationEventHandler(
+            api_key="hogekey", device_id=123, latitude=123.0, longitude=456.0, retries=0)
+        safecast.API_URL = server.url + "/measurements"
+        breaker = CircuitBreakerEventHandler(safecast, "safecast", failures=3)
+
+        for i in range(5):
+            breaker._run(Sample("a", 0.0, 1451642400.0, 20, 0.16))
+        safecast.session_.close()
+
+        self.assertEqual("open", breaker.health()["state"])
+        self.assertEqual(3, len(server.requests))
+        self.assertTrue(breaker.health()["last_error"].startswith("HTTPError"))
+
+
+class TestSpooledEventHandler(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_replay_after_failure(self):
+        received = []
+        all_received = threading.Event()
+
+        def mocked_run(data):
+            if data == 0 and not received:
+                received.append(None)
+                raise requests.ConnectionError()
+            received.append(data)
+            if len(received) == 4:
+                all_received.set()
+
+        handler = MagicMock()
+        handler._run = MagicMock(side_effect=mocked_run)
+
+        spooled = SpooledEventHandler(handler, self.path, replay_rate=100.0)
+        spooled.retry_max_ = 0.01
+        spooled.start()
+
+        for i in range(3):
+            spooled.put_q(i)
+        spooled.join_q()
+
+        self.assertTrue(all_received.wait(5))
+        spooled.stop()
+        spooled.join()
+
+        self.assertEqual([None, 0, 1, 2], received)
+
+    def test_commit_after_flush(self):
+        received = []
+        flushed = threading.Event()
+        is_failing = [True]
+
+        class BatchHandler(object):
+            def _run(self, data):
+                received.append(data)
+
+            def flush(self):
+                if is_failing[0]:
+                    is_failing[0] = False
+                    raise requests.HTTPError("503")
+                flushed.set()
+
+        spooled = SpooledEventHandler(BatchHandler(), self.path, replay_rate=100.0)
+        spooled.retry_max_ = 0.01
+        spooled.start()
+
+        for i in range(3):
+            spooled.put_q(i)
+        spooled.join_q()
+
+        self.assertTrue(flushed.wait(5))
+        spooled.stop()
+        spooled.join()
+
+        # flush is retried without passing the data again.
+        self.assertEqual([0, 1, 2], sorted(received))
+        self.assertEqual(3, len(received))
+
+        spooled = SpooledEventHandler(BatchHandler(), self.path)
+        self.assertIsNone(spooled.spool_.peek())
+        spooled.spool_.close()
+
+    def test_keep_data_over_restart(self):
+        handler = MagicMock()
+        handler._run = MagicMock(side_effect=requests.ConnectionError())
+
+        spooled = SpooledEventHandler(handler, self.path)
+        spooled.start()
+        spooled.put_q("kept")
+        spooled.join_q()
+        spooled.stop()
+        spooled.join()
+
+        received = threading.Event()
+        handler = MagicMock()
+        handler._run = MagicMock(side_effect=lambda data: received.set())
+
+        spooled = SpooledEventHandler(handler, self.path)
+        spooled.start()
+
+        self.assertTrue(received.wait(5))
+        spooled.stop()
+        spooled.join()
+        handler._run.assert_called_once_with("kept")
+
+
+class TestCircuitBreakerEventHandler(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.handler = MagicMock()
+        self.handler._run = MagicMock(side_effect=requests.ConnectionError())
+        self.breaker = CircuitBreakerEventHandler(
+            self.handler, "dead", failures=3, reset_timeout=10.0, clock=lambda: self.now)
+
+    def test_open_and_shed(self):
+        for i in range(5):
+            self.breaker._run(i)
+
+        # only the failures to open the circuit reach the handler.
+        self.assertEqual(3, self.handler._run.call_count)
+        health = self.breaker.health()
+        self.assertEqual("open", health["state"])
+        self.assertEqual(2, health["shed"])
+        self.assertEqual(1, health["opens"])
+        self.assertEqual(10.0, health["retry_in"])
+        self.assertTrue(health["last_error"].startswith("ConnectionError"))
+
+    def test_half_open_probe(self):
+        for i in range(3):
+            self.breaker._run(i)
+
+        # the failed probe opens the circuit for the doubled time.
+        self.now = 10.0
+        self.breaker._run("probe")
+        self.assertEqual(4, self.handler._run.call_count)
+        self.assertEqual("open", self.breaker.health()["state"])
+        self.assertEqual(20.0, self.breaker.health()["retry_in"])
+
+        self.handler._run.side_effect = None
+        self.now = 30.0
+        self.breaker._run("probe")
+        self.assertEqual("closed", self.breaker.health()["state"])
+        self.assertEqual(0, self.breaker.health()["failures"])
+
+        self.breaker._run("data")
+        self.handler._run.assert_called_with("data")
+
+    def test_flush_through_circuit(self):
+        self.handler.flush = MagicMock(side_effect=requests.HTTPError())
+
+        for i in range(3):
+            self.assertRaises(requests.HTTPError, self.breaker.flush)
+        self.assertRaises(CircuitOpenError, self.breaker.flush)
+        self.assertEqual(3, self.handler.flush.call_count)
+
+    def test_raise_without_shedding(self):
+        self.breaker.is_shedding_ = False
+
+        for i in range(3):
+            self.assertRaises(requests.ConnectionError, self.breaker._run, i)
+        self.assertRaises(CircuitOpenError, self.breaker._run, 3)
+
+
+class TestLocalStorageEventHandler(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def count_readings(self, database):
+        store = SQLiteStore(database)
+        try:
+            return store.db_.execute("SELECT COUNT(*) FROM reading").fetchone()[0]
+        finally:
+            store.close()
+
+    def test_write_in_batch(self):
+        database = os.path.join(self.path, "radiation.db")
+        handler = LocalStorageEventHandler(database, batch_max=2, batch_age=60.0)
+        handler.start()
+
+        for i in range(3):
+            handler.put_q(Sample("hoge", 0.0, 1451606400.0 + i, 20, 0.1624))
+        handler.join_q()
+
+        self.assertEqual(2, self.count_readings(database))
+
+        handler.stop()
+        handler.join()
+
+        self.assertEqual(3, self.count_readings(database))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from radiation_monitor import logger
+
+
+class TestLogger(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.path, "radiation_monitor.log")
+
+    def tearDown(self):
+        logger.shutdown()
+        shutil.rmtree(self.path)
+
+    def read_log(self):
+        with open(self.log_file, "r") as f:
+            return f.read()
+
+    def test_levels(self):
+        logger.configure(path_file=self.log_file, log_format="%(levelname)s %(message)s")
+
+        logger.debug("debug %s", 1)
+        logger.info("info %s", 2)
+        logger.warning("warning")
+        logger.error("error")
+        logger.critical("critical 100%")
+        logger.shutdown()
+
+        self.assertEqual(
+            "INFO info 2\nWARNING warning\nERROR error\nCRITICAL critical 100%\n", self.read_log())
+
+    def test_debug(self):
+        logger.configure(path_file=self.log_file, log_format="%(message)s", is_debug=True)
+
+        logger.debug("debug %s", 1)
+        logger.shutdown()
+
+        self.assertEqual("debug 1\n", self.read_log())
+
+    def test_lazy_format(self):
+        formatted = []
+
+        class Arg(object):
+            def __str__(self):
+                formatted.append(threading.current_thread())
+                return "arg"
+
+        logger.configure(path_file=self.log_file, log_format="%(message)s")
+        # not to be formatted by the handlers of root logger like pytest's one.
+        logger._LOGGER.propagate = False
+        self.addCleanup(setattr, logger._LOGGER, "propagate", True)
+
+        logger.debug("suppressed %s", Arg())
+        logger.info("printed %s", Arg())
+        logger.shutdown()
+
+        self.assertEqual("printed arg\n", self.read_log())
+        # formatted only by the stream and file handlers on the writer thread.
+        self.assertEqual(2, len(formatted))
+        self.assertNotIn(threading.current_thread(), formatted)
+
+    def test_rotate(self):
+        logger.configure(path_file=self.log_file, log_format="%(message)s", max_bytes=1000, backup_count=2)
+
+        for i in range(100):
+            logger.info("%03d %s", i, "x" * 40)
+        logger.shutdown()
+
+        files = sorted(os.listdir(self.path))
+        self.assertEqual(["radiation_monitor.log", "radiation_monitor.log.1", "radiation_monitor.log.2"], files)
+        self.assertTrue(self.read_log().endswith("099 " + "x" * 40 + "\n"))
+        for name in files:
+            self.assertLessEqual(os.path.getsize(os.path.join(self.path, name)), 1000)
+
+    def test_slow_handler_does_not_block(self):
+        unlock = threading.Event()
+
+        class SlowHandler(logging.Handler):
+            def emit(self, record):
+                unlock.wait()
+
+        logger.configure(path_file=self.log_file, log_format="%(message)s", q_max=10)
+        logger._WRITER.handlers_.append(SlowHandler())
+        logger._WRITER.handlers_[-1].flush_batch = lambda: None
+
+        started = time.monotonic()
+        for i in range(100):
+            logger.info("%d", i)
+        elapsed = time.monotonic() - started
+
+        self.assertLess(elapsed, 0.5)
+        self.assertGreater(logger.dropped(), 0)
+
+        unlock.set()
+        logger.shutdown()
+        self.assertTrue(self.read_log().startswith("0\n"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,128 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
 
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestDaemon(unittest.TestCase):
+    def start(self, *args, **kwargs):
+        """ Start the daemon reading the synthetic source and wait for the
+            first reading logged, so that the signal handlers are installed.
+            The source is read from the config file if config_file is given.
+        """
+        config_file = kwargs.get("config_file")
+        device = ["-c", config_file] if config_file else ["poisson://60?interval=0.05&seed=1", "9600"]
+
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "radiation_monitor"] + device + ["--debug"] + list(args),
+            cwd=_ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        self.addCleanup(proc.stdout.close)
+        self.addCleanup(lambda: proc.poll() is None and proc.kill())
+
+        for line in proc.stdout:
+            if "[cpm]" in line:
+                break
+
+        return proc
+
+    def read_until(self, proc, text):
+        for line in proc.stdout:
+            if text in line:
+                return True
+        return False
+
+    def test_sighup_without_config_file(self):
+        proc = self.start()
+        proc.send_signal(signal.SIGHUP)
+
+        self.assertTrue(self.read_until(proc, "SIGHUP is ignored"))
+        self.assertIsNone(proc.poll())
+
+        proc.send_signal(signal.SIGINT)
+        proc.communicate(timeout=10)
+
+    def test_sigterm_flushes_handlers(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        database = os.path.join(path, "radiation.db")
+
+        # readings are written only by the flush at stopping.
+        proc = self.start(
+            "--database-path", database, "--database-batch-max", "100000", "--database-batch-age", "3600")
+        proc.send_signal(signal.SIGTERM)
+        proc.communicate(timeout=10)
+
+        self.assertEqual(0, proc.returncode)
+        connection = sqlite3.connect(database)
+        try:
+            self.assertLess(0, connection.execute("SELECT COUNT(*) FROM reading").fetchone()[0])
+        finally:
+            connection.close()
+
+    def test_sighup_with_invalid_handler(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        config_file = os.path.join(path, "radiation_monitor.ini")
+        database = os.path.join(path, "radiation.db")
+
+        def write_config(database_path):
+            with open(config_file, "w") as f:
+                f.write(
+                    "[radiation_monitor]\n"
+                    "serial_device_path = poisson://60?interval=0.05&seed=1\n"
+                    "serial_baudrate = 9600\n"
+                    "[database]\n"
+                    "path = {}\n"
+                    "batch_max = 1\n".format(database_path))
+
+        def count():
+            connection = sqlite3.connect(database)
+            try:
+                return connection.execute("SELECT COUNT(*) FROM reading").fetchone()[0]
+            finally:
+                connection.close()
+
+        write_config(database)
+        proc = self.start(config_file=config_file)
+
+        write_config("/proc/nonexistent/radiation.db")
+        proc.send_signal(signal.SIGHUP)
+        self.assertTrue(self.read_until(proc, "at reloading config file"))
+
+        # the daemon and the database with the old path keep working.
+        written = count()
+        self.assertTrue(self.read_until(proc, "[cpm]"))
+        self.assertTrue(self.read_until(proc, "[cpm]"))
+        self.assertIsNone(proc.poll())
+
+        proc.send_signal(signal.SIGTERM)
+        proc.communicate(timeout=10)
+        self.assertEqual(0, proc.returncode)
+        self.assertLess(written, count())
+
+
 if __name__ == "__main__":
-    pass
+    unittest.main()
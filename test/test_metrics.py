@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import threading
+import unittest
+from radiation_monitor import metrics
+from radiation_monitor.source import CpmLineParser
+from radiation_monitor.source import LINES, PARSE_ERRORS
+
+try:
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import urlopen, HTTPError
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter_merges_threads(self):
+        counter = self.registry.register(metrics.Counter("test_total", "test", ("device",)))
+        child = counter.labels("a")
+
+        def inc():
+            for i in range(1000):
+                child.inc()
+
+        threads = [threading.Thread(target=inc) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.labels("b").inc(5)
+
+        self.assertEqual(4000, child.value())
+        # the shards of the ended threads are folded.
+        self.assertEqual([], child.shards_)
+        self.assertIn('test_total{device="a"} 4000', self.registry.render())
+        self.assertIn('test_total{device="b"} 5', self.registry.render())
+        self.assertIs(child, counter.labels("a"))
+
+    def test_histogram_folds_ended_threads(self):
+        histogram = self.registry.register(metrics.Histogram("test_seconds", "test", buckets=(0.1, 1.0)))
+        child = histogram.labels()
+        child.observe(0.5)
+
+        # one thread per batch like threading.Timer of the event handlers.
+        for i in range(100):
+            timer = threading.Timer(0, child.observe, args=(0.0625,))
+            timer.start()
+            timer.join()
+
+        self.assertEqual(1, len(child.shards_))
+        self.assertEqual(([100, 101, 101], 6.75), child.value())
+
+    def test_labels_mismatch(self):
+        counter = metrics.Counter("test_total", "test", ("device",))
+        self.assertRaises(ValueError, counter.labels)
+        self.assertRaises(ValueError, counter.inc)
+
+    def test_histogram(self):
+        histogram = self.registry.register(metrics.Histogram("test_seconds", "test", buckets=(0.1, 1.0)))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+
+        lines = self.registry.render().splitlines()
+
+        self.assertIn("# TYPE test_seconds histogram", lines)
+        self.assertIn('test_seconds_bucket{le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{le="1.0"} 3', lines)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn("test_seconds_sum 3.65", lines)
+        self.assertIn("test_seconds_count 4", lines)
+
+    def test_register_returns_existing(self):
+        first = self.registry.register(metrics.Counter("test_total", "test"))
+        self.assertIs(first, self.registry.register(metrics.Counter("test_total", "test")))
+
+    def test_collector(self):
+        def collect():
+            return [("test_depth", "gauge", "test", [({"handler": 'a"b'}, 3)])]
+
+        self.registry.add_collector(collect)
+        self.assertIn('test_depth{handler="a\\"b"} 3', self.registry.render())
+
+        self.registry.remove_collector(collect)
+        self.assertNotIn("test_depth", self.registry.render())
+
+    def test_parser_metrics(self):
+        parser = CpmLineParser(device="test_parser_metrics")
+        parser.feed(b"10\nnoise\n20\n")
+
+        self.assertEqual(3, LINES.labels("test_parser_metrics").value())
+        self.assertEqual(1, PARSE_ERRORS.labels("test_parser_metrics").value())
+
+
+class TestMetricsServer(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.registry.register(metrics.Counter("test_total", "test")).inc(2)
+        self.server = metrics.MetricsServer(0, registry=self.registry)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_scrape(self):
+        response = urlopen("http://127.0.0.1:{}/metrics".format(self.server.port), timeout=5)
+
+        self.assertEqual(200, response.status)
+        self.assertIn("text/plain", response.headers["Content-Type"])
+        self.assertIn("test_total 2\n", response.read().decode("utf-8"))
+
+    def test_not_found(self):
+        with self.assertRaises(HTTPError) as cm:
+            urlopen("http://127.0.0.1:{}/foo".format(self.server.port), timeout=5)
+        self.assertEqual(404, cm.exception.code)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+try:
+    from io import StringIO
+except ImportError:
+    from StringIO import StringIO
+from radiation_monitor import argparser
+from radiation_monitor import query
+from radiation_monitor.sample import Sample
+from radiation_monitor.storage import SQLiteStore
+
+
+class TestQuery(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.database = os.path.join(self.path, "radiation.db")
+
+        store = SQLiteStore(self.database)
+        store.write([Sample("hoge", 0.0, 1451606400.0 + 60 * i, 20 + i, 0.01 * i) for i in range(120)])
+        store.write([Sample("fuga", 0.0, 1451606400.0, 5, 0.04)])
+        store.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def run_query(self, *argv):
+        out = StringIO()
+        self.assertEqual(0, query.run(argparser.init_query([self.database] + list(argv)), out))
+        return out.getvalue()
+
+    def test_parse_time(self):
+        self.assertEqual(1451606400.0, query.parse_time("1451606400"))
+        self.assertEqual(1451606400.0, query.parse_time("2016-01-01"))
+        self.assertEqual(1451642400.0, query.parse_time("2016-01-01T10:00"))
+        self.assertEqual(1451642405.0, query.parse_time("2016-01-01T10:00:05"))
+        self.assertRaises(ValueError, query.parse_time, "yesterday")
+
+    def test_readings_as_csv(self):
+        lines = self.run_query(
+            "-d", "hoge", "-s", "2016-01-01T00:01", "-e", "2016-01-01T00:03").splitlines()
+
+        self.assertEqual(
+            ["device,at,epoch,cpm,usv",
+             "hoge,2016-01-01T00:01:00Z,1451606460.0,21,0.01",
+             "hoge,2016-01-01T00:02:00Z,1451606520.0,22,0.02"],
+            lines)
+
+    def test_rollups_as_json(self):
+        rows = json.loads(self.run_query("-r", "1h", "-f", "json", "-s", "2016-01-01T00:30"))
+
+        self.assertEqual(
+            [("fuga", 1451606400, 1), ("hoge", 1451606400, 60), ("hoge", 1451610000, 60)],
+            [(row["device"], row["epoch"], row["count"]) for row in rows])
+        self.assertEqual(49.5, rows[1]["cpm_mean"])
+        self.assertEqual("2016-01-01T01:00:00Z", rows[2]["at"])
+
+    def test_missing_database(self):
+        database = os.path.join(self.path, "radiaton.db")
+
+        with patch("sys.stderr", new_callable=StringIO) as err:
+            self.assertEqual(1, query.run(argparser.init_query([database]), StringIO()))
+
+        self.assertIn("{} doesn't exist".format(database), err.getvalue())
+        self.assertFalse(os.path.exists(database))
+
+    def test_database_is_opened_readonly(self):
+        store = SQLiteStore(self.database, is_readonly=True)
+        try:
+            self.assertEqual(["fuga", "hoge"], store.devices())
+            self.assertRaises(sqlite3.OperationalError, store.write, [Sample("hoge", 0.0, 0.0, 1, 0.01)])
+        finally:
+            store.close()
+
+    def test_range_scan_uses_index(self):
+        store = SQLiteStore(self.database)
+        try:
+            plans = [
+                " ".join(str(col) for row in store.db_.execute("EXPLAIN QUERY PLAN " + sql, params) for col in row)
+                for sql, params in (
+                    ("SELECT * FROM reading WHERE device = ? AND epoch >= ? AND epoch < ? ORDER BY epoch",
+                     ("hoge", 0, 1)),
+                    ("SELECT * FROM rollup WHERE device = ? AND resolution = ? AND bucket >= ? AND bucket < ?",
+                     ("hoge", 60, 0, 1)))]
+        finally:
+            store.close()
+
+        self.assertIn("USING INDEX reading_device_epoch", plans[0])
+        self.assertIn("USING INDEX sqlite_autoindex_rollup_1", plans[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
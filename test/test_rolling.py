@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import random
+import unittest
+try:
+    from unittest.mock import MagicMock
+except ImportError:
+    from mock import MagicMock
+from radiation_monitor import rolling
+from radiation_monitor.sample import Sample
+
+
+@unittest.skipUnless(rolling.numpy, "numpy is not installed")
+class TestRollingStatistics(unittest.TestCase):
+    def test_rolling_mean_std(self):
+        numpy = rolling.numpy
+        stats = rolling.RollingStatistics(50)
+        values = [random.gauss(100, 10) for i in range(237)]
+
+        for value in values:
+            stats.update(value)
+
+        self.assertEqual(50, len(stats))
+        numpy.testing.assert_allclose(values[-50:], stats.values())
+        self.assertAlmostEqual(numpy.mean(values[-50:]), stats.mean, places=6)
+        self.assertAlmostEqual(numpy.std(values[-50:], ddof=1), stats.std, places=6)
+
+    def test_partial_window(self):
+        stats = rolling.RollingStatistics(10)
+        for value in [1.0, 2.0, 3.0]:
+            stats.update(value)
+
+        self.assertEqual(3, len(stats))
+        self.assertEqual([1.0, 2.0, 3.0], list(stats.values()))
+        self.assertAlmostEqual(2.0, stats.mean)
+        self.assertAlmostEqual(1.0, stats.std)
+
+    def test_ewma(self):
+        stats = rolling.RollingStatistics(10, alpha=0.5)
+        for value in [10.0, 20.0, 20.0]:
+            stats.update(value)
+
+        self.assertAlmostEqual(17.5, stats.ewma)
+
+    def test_cusum_ignores_poisson_noise(self):
+        numpy = rolling.numpy
+        numpy.random.seed(1)
+        stats = rolling.RollingStatistics(600)
+
+        alarms = sum(stats.update(value) for value in numpy.random.poisson(20, 3600))
+
+        self.assertEqual(0, alarms)
+
+    def test_cusum_alarms_on_step(self):
+        numpy = rolling.numpy
+        numpy.random.seed(2)
+        stats = rolling.RollingStatistics(600)
+
+        for value in numpy.random.poisson(20, 600):
+            self.assertFalse(stats.update(value))
+
+        alarms = [stats.update(value) for value in numpy.random.poisson(40, 10)]
+        self.assertTrue(any(alarms))
+
+
+@unittest.skipUnless(rolling.numpy, "numpy is not installed")
+class TestAnomalyDetector(unittest.TestCase):
+    def test_alert(self):
+        callback = MagicMock()
+        detector = rolling.AnomalyDetector(callback, 100, warmup=10)
+
+        for i in range(100):
+            detector.put(Sample("a", float(i), float(i), 20 + (i % 3), 0.2))
+        callback.assert_not_called()
+
+        detector.put(Sample("b", 100.0, 100.0, 200, 2.0))
+        detector.put(Sample("a", 100.0, 100.0, 200, 2.0))
+
+        self.assertEqual(1, callback.call_count)
+        alert = callback.call_args[0][0]
+        self.assertIsInstance(alert, rolling.AnomalyAlert)
+        self.assertEqual("a", alert.device)
+        self.assertEqual(200, alert.cpm)
+        self.assertAlmostEqual(21.0, alert.mean, places=1)
+        self.assertEqual(100, len(detector.statistics("a")))
+        self.assertEqual(1, len(detector.statistics("b")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import pickle
+import unittest
+from collections import OrderedDict
+from datetime import datetime
+from radiation_monitor.sample import Gap
+from radiation_monitor.sample import Sample
+
+
+class TestSample(unittest.TestCase):
+    def setUp(self):
+        self.sample = Sample("hoge", 100.0, 1451606400.0, 20, 0.1624)
+
+    def test_legacy_dict_shape(self):
+        self.assertEqual("hoge", self.sample["source"])
+        self.assertEqual(datetime(2016, 1, 1), self.sample["at"])
+        self.assertEqual(
+            OrderedDict([
+                ("Count Per Minute", OrderedDict([("value", 20), ("unit", "cpm")])),
+                ("Micro Sievert Per Hour", OrderedDict([("value", 0.1624), ("unit", "usv")])),
+            ]),
+            self.sample["data"])
+        self.assertIn("data", self.sample)
+        self.assertIsNone(self.sample.get("latitude"))
+        self.assertRaises(KeyError, lambda: self.sample["latitude"])
+
+    def test_from_dict(self):
+        self.assertEqual(self.sample, Sample.from_dict(self.sample.as_dict(), monotonic=100.0))
+
+    def test_no_instance_dict(self):
+        self.assertFalse(hasattr(self.sample, "__dict__"))
+        self.assertEqual(self.sample, pickle.loads(pickle.dumps(self.sample, pickle.HIGHEST_PROTOCOL)))
+
+    def test_gap(self):
+        gap = Gap("hoge", 110.0, 1451606410.0, 1451606400.0, 10.0)
+        self.assertIsNone(gap.cpm)
+        self.assertEqual(gap, Gap("hoge", 110.0, 1451606410.0, 1451606400.0, 10.0))
+        self.assertNotEqual(gap, Gap("hoge", 110.0, 1451606410.0, 1451606400.0, 5.0))
+        self.assertNotEqual(gap, Sample("hoge", 110.0, 1451606410.0, None, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -17,14 +17,30 @@
 
 import unittest
 try:
-    from unittest.mock import MagicMock, patch
+    from unittest.mock import MagicMock, PropertyMock, patch
 except:
-    from mock import MagicMock, patch
-from collections import OrderedDict
+    from mock import MagicMock, PropertyMock, patch
 from datetime import datetime
+from radiation_monitor import metrics
+from radiation_monitor.sample import Gap
+from radiation_monitor.sample import Sample
+from radiation_monitor.source import CpmLineParser
 from radiation_monitor.source import GeigerMeter
+from radiation_monitor.source import GeigerMeterGroup
+from radiation_monitor.source import PoissonSource
+from radiation_monitor.source import PtySource
+from radiation_monitor.source import SerialSource
+from radiation_monitor.source import SourceError
+from radiation_monitor.source import TcpSource
+from radiation_monitor.source import create_sources
+from radiation_monitor.source import find_port
+from radiation_monitor.source import read_once
 from serial import SerialException
+import os
+import socket
 import threading
+import time
+import tty
 
 
 class TestSource(unittest.TestCase):
@@ -42,68 +58,404 @@ class TestSource(unittest.TestCase):
     def tearDown(self):
         pass
 
-    @patch("radiation_monitor.source.datetime", autospec=True)
-    @patch("radiation_monitor.source.Serial", autospec=True)
-    def test_geiger_meter_sequence(self, patched_serial, pached_datetime):
-        expected_cpm = 20
+    def open_pty(self):
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        self.addCleanup(os.close, slave)
+        return master, os.ttyname(slave)
 
-        unlock_readline = threading.Event()
-        raise_serial_exception = threading.Event()
+    def test_geiger_meter_sequence(self):
+        master, path = self.open_pty()
+        self.addCleanup(os.close, master)
 
-        def mocked_serial_close():
-            unlock_readline.set()
-            raise_serial_exception.set()
+        callback_called = threading.Event()
+        callback = MagicMock(side_effect=lambda sample: callback_called.set())
 
-        def mocked_serial_readline():
-            unlock_readline.wait()
-            unlock_readline.clear()
+        g = GeigerMeter("hoge", path, 15200, callback)
+        g.start()
+        self.addCleanup(g.join)
+        self.addCleanup(g.stop)
 
-            if raise_serial_exception.is_set():
-                raise SerialException
+        self.assertTrue(g.is_alive())
+        callback.assert_not_called()
 
-            return "{} [cpm]\n".format(expected_cpm).encode("ascii")
+        os.write(master, b"20 [cpm]\n")
 
-        uart_port = MagicMock()
-        uart_port.close = MagicMock(side_effect=mocked_serial_close)
-        uart_port.readline = MagicMock(side_effect=mocked_serial_readline)
-        patched_serial.return_value = uart_port
-        pached_datetime.utcnow = MagicMock(return_value=datetime(2016, 1, 1))
+        self.assertTrue(callback_called.wait(5))
+        sample = callback.call_args[0][0]
+        self.assertEqual(("hoge", 20, 20 * 0.00812), (sample.device, sample.cpm, sample.usv))
 
-        callback_called = threading.Event()
+        g.stop()
+        g.join()
 
-        def mocked_callback(name, data, now):
-            callback_called.set()
+        self.assertFalse(g.is_alive())
+
+    @patch("radiation_monitor.source.list_ports", autospec=True)
+    def test_geiger_meter_reconnect(self, patched_list_ports):
+        lost, lost_path = self.open_pty()
+        reconnected, reconnected_path = self.open_pty()
+        self.addCleanup(os.close, reconnected)
+        patched_list_ports.comports.return_value = []
 
-        callback = MagicMock(side_effect=mocked_callback)
+        received = []
+        is_reconnected = threading.Event()
+        is_received = threading.Event()
 
-        g = GeigerMeter("hoge", "/dev/test", 15200, callback)
+        def mocked_callback(sample):
+            received.append(sample)
+            (is_reconnected if isinstance(sample, Gap) else is_received).set()
+
+        g = GeigerMeter("reconnect", lost_path, 9600, mocked_callback, backoff=0.01, serial_number="A1")
         g.start()
+        self.addCleanup(g.join)
+        self.addCleanup(g.stop)
 
-        self.assertTrue(g.is_alive())
-        callback.assert_not_called()
+        # hung up, then found at another path by the serial number.
+        patched_list_ports.comports.return_value = [MagicMock(device=reconnected_path, serial_number="A1")]
+        os.close(lost)
 
-        unlock_readline.set()
+        self.assertTrue(is_reconnected.wait(5))
+        os.write(reconnected, b"20 [cpm]\n")
+        self.assertTrue(is_received.wait(5))
 
-        self.assertTrue(g.is_alive())
-        callback_called.wait()
-        callback.assert_called_once_with(
-            "hoge",
-            OrderedDict({
-                "Count Per Minute": OrderedDict({
-                    "value": expected_cpm,
-                    "unit": "cpm"
-                }),
-                "Micro Sievert Per Hour": OrderedDict({
-                    "value": expected_cpm * 0.00812,
-                    "unit": "usv"
-                }),
-            }),
-            datetime(2016, 1, 1))
+        self.assertIsInstance(received[0], Gap)
+        self.assertGreater(received[0].seconds, 0.0)
+        self.assertEqual(20, received[-1].cpm)
+
+        rendered = metrics.REGISTRY.render()
+        self.assertIn('radiation_monitor_source_disconnects_total{device="reconnect"} 1', rendered)
+        self.assertIn('radiation_monitor_source_downtime_seconds_total{device="reconnect"}', rendered)
+
+    def test_geiger_meter_hangup(self):
+        master, path = self.open_pty()
+        self.addCleanup(os.close, master)
+
+        received = []
+        is_reconnected = threading.Event()
+        is_received = threading.Event()
+
+        def mocked_callback(sample):
+            received.append(sample)
+            (is_reconnected if isinstance(sample, Gap) else is_received).set()
+
+        hangups = [OSError(5, "Input/output error")]
+
+        def mocked_in_waiting():
+            # ioctl of the unplugged or hung up port raises EIO once.
+            if hangups:
+                raise hangups.pop()
+            return 0
+
+        g = GeigerMeter("hangup", path, 9600, mocked_callback, backoff=0.01)
+
+        with patch.object(type(g.sources_[0].uart_), "in_waiting", new_callable=PropertyMock) as in_waiting:
+            in_waiting.side_effect = mocked_in_waiting
+            g.start()
+            self.addCleanup(g.join)
+            self.addCleanup(g.stop)
+
+            os.write(master, b"10 [cpm]\n")
+            self.assertTrue(is_reconnected.wait(5))
+            self.assertTrue(g.is_alive())
+
+            os.write(master, b"20 [cpm]\n")
+            self.assertTrue(is_received.wait(5))
+
+        self.assertEqual(20, received[-1].cpm)
+
+    def test_geiger_meter_without_reconnect(self):
+        master, path = self.open_pty()
+
+        g = GeigerMeter("hoge", path, 9600, MagicMock(), reconnect=False)
+        g.start()
+        os.close(master)
 
+        # the thread ends when the only serial port is lost.
+        g.join(5)
+        self.assertFalse(g.is_alive())
+
+    @patch("radiation_monitor.source.list_ports", autospec=True)
+    def test_find_port(self, patched_list_ports):
+        patched_list_ports.comports.return_value = [
+            MagicMock(device="/dev/ttyUSB0", serial_number="A0"),
+            MagicMock(device="/dev/ttyUSB1", serial_number="A1")]
+
+        self.assertEqual("/dev/ttyUSB1", find_port("A1"))
+        self.assertIsNone(find_port("A2"))
+
+
+class TestCpmLineParser(unittest.TestCase):
+    def test_lines_in_chunks(self):
+        parser = CpmLineParser()
+
+        self.assertEqual([20, 21], parser.feed(b"20 [cpm]\r\n21 [cpm]\n2"))
+        self.assertEqual([], parser.feed(b"2 [c"))
+        self.assertEqual([22, 23], parser.feed(b"pm]\n23\n"))
+        self.assertEqual(4, parser.lines)
+        self.assertEqual(0, parser.errors)
+
+    def test_skip_garbage(self):
+        parser = CpmLineParser()
+
+        self.assertEqual([30], parser.feed(b"\xff\xfe20 [cpm]\n20x\n\n30 [cpm]\n"))
+        self.assertEqual(2, parser.errors)
+
+    def test_resync_after_noise(self):
+        parser = CpmLineParser(max_line=16)
+
+        self.assertEqual([], parser.feed(b"1" * 20))
+        self.assertEqual([], parser.feed(b"234 [cpm]\n"))
+        self.assertEqual([40], parser.feed(b"40 [cpm]\n"))
+        self.assertEqual(1, parser.errors)
+
+
+class TestGeigerMeterGroup(unittest.TestCase):
+    def setUp(self):
+        self.ptys = []
+        for i in range(3):
+            master, slave = os.openpty()
+            tty.setraw(slave)
+            self.ptys.append((master, slave))
+
+    def tearDown(self):
+        for master, slave in self.ptys:
+            os.close(master)
+            os.close(slave)
+
+    def test_read_many_devices(self):
+        received = []
+        all_received = threading.Event()
+
+        def mocked_callback(sample):
+            received.append((sample.device, sample.cpm))
+            if len(received) == 4:
+                all_received.set()
+
+        g = GeigerMeterGroup(
+            [("dev{}".format(i), os.ttyname(slave), 9600) for i, (master, slave) in enumerate(self.ptys)],
+            mocked_callback)
+        g.start()
+
+        os.write(self.ptys[0][0], b"10 [cpm]\n")
+        os.write(self.ptys[1][0], b"garbage\n2")
+        os.write(self.ptys[1][0], b"0 [cpm]\n")
+        os.write(self.ptys[2][0], b"30 [cpm]\n31 [cpm]\n")
+
+        self.assertTrue(all_received.wait(5))
         g.stop()
         g.join()
 
         self.assertFalse(g.is_alive())
+        self.assertEqual(
+            [("dev0", 10), ("dev1", 20), ("dev2", 30), ("dev2", 31)],
+            sorted(received))
+
+    def test_read_mixed_sources(self):
+        received = []
+        is_received = threading.Event()
+
+        def mocked_callback(sample):
+            received.append(sample.device)
+            if "pty" in received and received.count("poisson") >= 3:
+                is_received.set()
+
+        pty = PtySource("pty")
+        g = GeigerMeterGroup([pty, PoissonSource("poisson", cpm=600, interval=0.01, seed=0)], mocked_callback)
+        g.start()
+
+        fd = os.open(pty.slave_path, os.O_WRONLY | os.O_NOCTTY)
+        os.write(fd, b"10 [cpm]\n")
+        os.close(fd)
+
+        self.assertTrue(is_received.wait(5))
+        g.stop()
+        g.join()
+        self.assertFalse(g.is_alive())
+
+    def test_unexpected_error_of_one_source(self):
+        received = []
+        is_received = threading.Event()
+
+        class BrokenSource(PoissonSource):
+            def read(self):
+                if not received:
+                    raise OSError(5, "Input/output error")
+                return PoissonSource.read(self)
+
+        def mocked_callback(sample):
+            received.append(sample)
+            devices = [(type(s), s.device) for s in received]
+            if (Gap, "broken") in devices and (Sample, "ok") in devices:
+                is_received.set()
+
+        g = GeigerMeterGroup(
+            [BrokenSource("broken", interval=0.01, seed=0), PoissonSource("ok", interval=0.01, seed=0)],
+            mocked_callback, backoff=0.01)
+        g.start()
+
+        self.assertTrue(is_received.wait(5))
+        self.assertTrue(g.is_alive())
+        g.stop()
+        g.join()
+
+        # the broken source is reconnected instead of stopping the group.
+        self.assertEqual(["broken"], [sample.device for sample in received if isinstance(sample, Gap)])
+        self.assertIn("ok", [sample.device for sample in received])
+
+    def test_reconnect_lost_source(self):
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(2)
+
+        received = []
+        is_received = threading.Event()
+
+        def mocked_callback(sample):
+            received.append(sample)
+            if len(received) == 3:
+                is_received.set()
+
+        g = GeigerMeterGroup(
+            [TcpSource("tcp", "127.0.0.1", server.getsockname()[1])], mocked_callback, backoff=0.01)
+        g.start()
+
+        conn, address = server.accept()
+        conn.sendall(b"10 [cpm]\n")
+        time.sleep(0.1)
+        conn.close()
+
+        conn, address = server.accept()
+        conn.sendall(b"20 [cpm]\n")
+
+        self.assertTrue(is_received.wait(5))
+        g.stop()
+        g.join()
+        conn.close()
+        server.close()
+
+        self.assertEqual(10, received[0].cpm)
+        self.assertIsInstance(received[1], Gap)
+        self.assertEqual("tcp", received[1].device)
+        self.assertEqual(20, received[2].cpm)
+
+
+class TestSources(unittest.TestCase):
+    def test_tcp(self):
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+
+        source = TcpSource("tcp", "127.0.0.1", server.getsockname()[1])
+        source.open()
+        conn, address = server.accept()
+
+        self.assertEqual(b"", source.read())
+        conn.sendall(b"10 [cpm]\n")
+        time.sleep(0.1)
+        self.assertEqual(b"10 [cpm]\n", source.read())
+
+        conn.close()
+        time.sleep(0.1)
+        self.assertRaises(SourceError, source.read)
+
+        source.close()
+        server.close()
+
+    def test_serial_hangup(self):
+        source = SerialSource("serial", "/dev/ttyUSB0", 9600)
+        source.uart_ = MagicMock()
+        type(source.uart_).in_waiting = property(MagicMock(side_effect=OSError(5, "Input/output error")))
+
+        self.assertRaises(SourceError, source.read)
+
+    def test_pty(self):
+        source = PtySource("pty")
+        source.open()
+
+        fd = os.open(source.slave_path, os.O_WRONLY | os.O_NOCTTY)
+        self.assertEqual(b"", source.read())
+        os.write(fd, b"10 [cpm]\n")
+        time.sleep(0.1)
+        self.assertEqual(b"10 [cpm]\n", source.read())
+
+        os.close(fd)
+        source.close()
+
+    def test_poisson_rate(self):
+        source = PoissonSource("poisson", cpm=20, interval=60, seed=1)
+        counts = [source.counts() for i in range(10000)]
+        self.assertAlmostEqual(20.0, sum(counts) / len(counts), delta=0.2)
+
+        source = PoissonSource("poisson", cpm=3000, interval=60, seed=1)
+        counts = [source.counts() for i in range(10000)]
+        self.assertAlmostEqual(3000.0, sum(counts) / len(counts), delta=3.0)
+
+        self.assertEqual(
+            [PoissonSource("a", seed=5).counts() for i in range(3)],
+            [PoissonSource("b", seed=5).counts() for i in range(3)])
+
+    def test_poisson_read(self):
+        source = PoissonSource("poisson", cpm=20, interval=0.01, seed=1)
+        source.open()
+        self.assertGreaterEqual(source.next_at(), time.monotonic() - 0.01)
+
+        time.sleep(0.1)
+        read_at = time.monotonic()
+        lines = source.read().splitlines()
+        self.assertGreaterEqual(len(lines), 9)
+        self.assertTrue(all(line.endswith(b" [cpm]") for line in lines))
+        # all lines due at reading are read.
+        self.assertGreater(source.next_at(), read_at)
+
+    def test_create_sources(self):
+        source, = create_sources("dev", "/dev/ttyUSB0", 9600)
+        self.assertIsInstance(source, SerialSource)
+
+        source, = create_sources("dev", "tcp://localhost:2000")
+        self.assertIsInstance(source, TcpSource)
+        self.assertEqual(("localhost", 2000), source.address_)
+
+        source, = create_sources("dev", "pty://")
+        self.assertIsNone(source.path_)
+        source, = create_sources("dev", "pty:///dev/pts/3")
+        self.assertEqual("/dev/pts/3", source.path_)
+
+        sources = create_sources("dev", "poisson://30?interval=2&count=3&seed=0")
+        self.assertEqual(["dev-0", "dev-1", "dev-2"], [source.name for source in sources])
+        self.assertEqual(1.0, sources[0].lam_)
+        self.assertEqual(2.0, sources[0].interval_)
+
+        self.assertRaises(ValueError, create_sources, "dev", "tcp://localhost")
+
+    def test_read_once(self):
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+
+        def serve(lines):
+            conn, address = server.accept()
+            conn.sendall(lines)
+            time.sleep(0.5)
+            conn.close()
+
+        # the first line may be partial.
+        thread = threading.Thread(target=serve, args=(b"0 [cpm]\n15 [cpm]\n",))
+        thread.start()
+        sample = read_once(TcpSource("tcp", "127.0.0.1", server.getsockname()[1]), timeout=1.0, usv_per_cpm=0.01)
+        thread.join()
+
+        self.assertEqual("tcp", sample.device)
+        self.assertEqual(15, sample.cpm)
+        self.assertAlmostEqual(0.15, sample.usv)
+
+        thread = threading.Thread(target=serve, args=(b"",))
+        thread.start()
+        self.assertIsNone(read_once(TcpSource("tcp", "127.0.0.1", server.getsockname()[1]), timeout=0.2))
+        thread.join()
+        server.close()
+
+        sample = read_once(PoissonSource("poisson", interval=0.01, seed=1), timeout=1.0)
+        self.assertEqual("poisson", sample.device)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+from datetime import datetime
+from radiation_monitor.spool import Spool
+
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def read_all(self, spool):
+        result = []
+        while True:
+            data = spool.peek()
+            if data is None:
+                return result
+            result.append(data)
+            spool.commit()
+
+    def test_fifo(self):
+        spool = Spool(self.path)
+        self.assertIsNone(spool.peek())
+
+        spool.append({"at": datetime(2016, 1, 1), "value": 1})
+        spool.append({"at": datetime(2016, 1, 2), "value": 2})
+
+        self.assertEqual(1, spool.peek()["value"])
+        self.assertEqual(1, spool.peek()["value"])
+        spool.commit()
+        self.assertEqual(datetime(2016, 1, 2), spool.peek()["at"])
+        spool.commit()
+        self.assertIsNone(spool.peek())
+        spool.close()
+
+    def test_restart_keeps_unread_data(self):
+        spool = Spool(self.path)
+        for i in range(5):
+            spool.append(i)
+        spool.peek()
+        spool.commit()
+        spool.close()
+
+        spool = Spool(self.path)
+        self.assertEqual([1, 2, 3, 4], self.read_all(spool))
+        spool.close()
+
+    def test_torn_tail_is_truncated(self):
+        spool = Spool(self.path)
+        spool.append("first")
+        spool.close()
+
+        segment = [name for name in os.listdir(self.path) if name.endswith(".seg")][0]
+        with open(os.path.join(self.path, segment), "ab") as f:
+            f.write(b"\x10\x00\x00\x00broken")
+
+        spool = Spool(self.path)
+        spool.append("second")
+        self.assertEqual(["first", "second"], self.read_all(spool))
+        spool.close()
+
+    def test_rotation_and_compaction(self):
+        spool = Spool(self.path, segment_bytes=64)
+        for i in range(20):
+            spool.append("value {}".format(i))
+
+        self.assertGreater(spool.stats()["segments"], 1)
+        self.assertEqual(["value {}".format(i) for i in range(20)], self.read_all(spool))
+
+        # the current segment is kept until it gets full.
+        spool.compact()
+        self.assertEqual(1, spool.stats()["segments"])
+        self.assertLess(spool.stats()["bytes"], 64 + 32)
+        spool.close()
+
+    def test_batched_fsync_while_draining(self):
+        spool = Spool(self.path, sync_interval=60.0)
+
+        with patch("radiation_monitor.spool.os.fsync", wraps=os.fsync) as fsync:
+            for i in range(20):
+                spool.append(i)
+                self.assertEqual([i], spool.peek_batch(5))
+                spool.commit()
+                spool.compact()
+
+        self.assertLessEqual(fsync.call_count, 4)
+        self.assertEqual(1, spool.stats()["segments"])
+        spool.close()
+
+        spool = Spool(self.path)
+        self.assertIsNone(spool.peek())
+        spool.close()
+
+    def test_peek_batch(self):
+        spool = Spool(self.path)
+        for i in range(5):
+            spool.append(i)
+
+        self.assertEqual([0, 1, 2], spool.peek_batch(3))
+        self.assertEqual([0, 1, 2], spool.peek_batch(3))
+        spool.commit()
+        self.assertEqual([3, 4], spool.peek_batch(3))
+        spool.commit()
+        self.assertEqual([], spool.peek_batch(3))
+        spool.close()
+
+    def test_max_bytes_drops_oldest(self):
+        spool = Spool(self.path, segment_bytes=64, max_bytes=256)
+        for i in range(100):
+            spool.append("value {}".format(i))
+
+        stats = spool.stats()
+        self.assertLessEqual(stats["bytes"], 256 + 64)
+        self.assertGreater(stats["dropped_bytes"], 0)
+
+        values = self.read_all(spool)
+        self.assertEqual("value 99", values[-1])
+        self.assertLess(len(values), 100)
+        spool.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import unittest
+from radiation_monitor.sample import Sample
+from radiation_monitor.storage import SQLiteStore
+
+
+class TestSQLiteStore(unittest.TestCase):
+    def setUp(self):
+        self.store = SQLiteStore(":memory:")
+
+    def tearDown(self):
+        self.store.close()
+
+    def rollups(self, resolution):
+        return list(self.store.db_.execute(
+            "SELECT device, bucket, count, cpm_min, cpm_max, cpm_sum FROM rollup"
+            " WHERE resolution = ? ORDER BY device, bucket", (resolution,)))
+
+    def test_write_readings(self):
+        self.store.write([Sample("hoge", 0.0, 1451606400.0 + i, 20 + i, 0.1) for i in range(3)])
+
+        self.assertEqual(
+            [("hoge", 1451606400.0, 20), ("hoge", 1451606401.0, 21), ("hoge", 1451606402.0, 22)],
+            list(self.store.db_.execute("SELECT device, epoch, cpm FROM reading ORDER BY epoch")))
+
+    def test_rollups_are_merged_over_writes(self):
+        self.store.write([Sample("hoge", 0.0, 3600.0 + 30 * i, 10 + i, 0.1) for i in range(4)])
+        self.store.write([Sample("hoge", 0.0, 3610.0, 100, 0.8), Sample("fuga", 0.0, 3610.0, 5, 0.04)])
+
+        self.assertEqual(
+            [("fuga", 3600, 1, 5, 5, 5),
+             ("hoge", 3600, 3, 10, 100, 121),
+             ("hoge", 3660, 2, 12, 13, 25)],
+            self.rollups(60))
+        self.assertEqual(
+            [("fuga", 3600, 1, 5, 5, 5), ("hoge", 3600, 5, 10, 100, 146)],
+            self.rollups(3600))
+        self.assertEqual(
+            [("fuga", 0, 1, 5, 5, 5), ("hoge", 0, 5, 10, 100, 146)],
+            self.rollups(86400))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import unittest
+try:
+    from unittest.mock import MagicMock
+except ImportError:
+    from mock import MagicMock
+from radiation_monitor.sample import Sample
+from radiation_monitor.threshold import ThresholdAlert
+from radiation_monitor.threshold import ThresholdDetector
+
+
+class TestThresholdDetector(unittest.TestCase):
+    def setUp(self):
+        self.callback = MagicMock()
+        self.detector = ThresholdDetector(self.callback, 0.5, low=0.3, interval=600)
+
+    def put(self, at, usv, device="a"):
+        self.detector.put(Sample(device, float(at), 1000.0 + at, usv / 0.01, usv))
+
+    def alerts(self):
+        return [c[0][0] for c in self.callback.call_args_list]
+
+    def test_alert_once_while_high(self):
+        for at, usv in enumerate([0.1, 0.2, 0.6, 0.7, 0.4, 0.8, 0.6]):
+            self.put(at, usv)
+
+        alerts = self.alerts()
+        self.assertEqual(1, len(alerts))
+        self.assertIsInstance(alerts[0], ThresholdAlert)
+        self.assertEqual(0.6, alerts[0].usv)
+        self.assertEqual(0.5, alerts[0].threshold)
+        self.assertEqual(60.0, alerts[0]["data"]["Count Per Minute"]["value"])
+        self.assertTrue(self.detector.is_high("a"))
+
+    def test_realert_after_clear_and_interval(self):
+        self.put(0, 0.6)
+        self.put(10, 0.2)
+        self.assertFalse(self.detector.is_high("a"))
+
+        # flapping within the interval is not alerted.
+        self.put(20, 0.6)
+        self.assertEqual(1, self.callback.call_count)
+
+        self.put(30, 0.2)
+        self.put(700, 0.6)
+        self.assertEqual(2, self.callback.call_count)
+
+    def test_pending_alert_while_still_high(self):
+        self.put(0, 0.6)
+        self.put(10, 0.2)
+        self.put(20, 0.6)
+        self.assertEqual(1, self.callback.call_count)
+
+        # still high after the interval.
+        self.put(300, 0.9)
+        self.put(599, 0.9)
+        self.assertEqual(1, self.callback.call_count)
+        self.put(600, 0.4)
+        self.assertEqual(1, self.callback.call_count)
+        self.put(601, 0.9)
+        self.put(4800, 0.9)
+
+        alerts = self.alerts()
+        self.assertEqual([0.6, 0.9], [alert.usv for alert in alerts])
+        self.assertEqual(601.0, alerts[1].monotonic)
+
+        # cleared before the interval passes.
+        self.put(4810, 0.2)
+        self.put(4820, 0.6)
+        self.assertEqual(3, self.callback.call_count)
+        self.put(4830, 0.2)
+        self.put(4840, 0.6)
+        self.put(4850, 0.2)
+        self.put(5500, 0.4)
+        self.assertEqual(3, self.callback.call_count)
+
+    def test_devices_are_independent(self):
+        self.put(0, 0.6, device="a")
+        self.put(1, 0.6, device="b")
+        self.put(2, 0.1, device="c")
+
+        self.assertEqual(["a", "b"], [alert.device for alert in self.alerts()])
+
+    def test_default_low(self):
+        detector = ThresholdDetector(self.callback, 1.0, interval=0)
+        for at, usv in enumerate([1.0, 0.85, 1.0, 0.79, 1.0]):
+            detector.put(Sample("a", float(at), float(at), 0, usv))
+
+        self.assertEqual(2, self.callback.call_count)
+
+
+if __name__ == "__main__":
+    unittest.main()
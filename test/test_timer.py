@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+#   Copyright 2016 Takashi Ando - http://blog.rinka-blossom.com/
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import threading
+import time
+import unittest
+from radiation_monitor.timer import Scheduler, RecursiveTimer
+from radiation_monitor.timer import NotStartedYetError, AlreadyRunningError
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        # the clock moves only by advance() so that the tests never depend
+        # on the load of the machine.
+        self.now = 0.0
+        self.runs = queue.Queue()
+        self.scheduler = Scheduler(clock=lambda: self.now)
+        self.scheduler.start()
+
+    def tearDown(self):
+        if self.scheduler.is_alive():
+            self.scheduler.stop()
+
+    def advance(self, seconds):
+        with self.scheduler.cond:
+            self.now += seconds
+            self.scheduler.cond.notify()
+
+    def run_job(self, name=None):
+        self.runs.put((name, self.now))
+
+    def wait_runs(self, count):
+        return [self.runs.get(timeout=5) for i in range(count)]
+
+    def test_wakeups_follow_deadlines(self):
+        # long interval not to time out the wait on the real clock.
+        job = self.scheduler.every(60.0, self.run_job)
+
+        for i in range(1, 21):
+            self.advance(60.0)
+            self.assertEqual([(None, i * 60.0)], self.wait_runs(1))
+
+        self.scheduler.stop()
+
+        # one wakeup per run with no polling in between.
+        self.assertEqual(20, job.runs)
+        self.assertLessEqual(self.scheduler.wakeups, job.runs + 1)
+        self.assertEqual(0.0, job.jitter_max)
+
+    def test_no_drift(self):
+        job = self.scheduler.every(1.0, self.run_job)
+
+        self.advance(1.25)
+        self.wait_runs(1)
+        self.assertEqual(0.25, job.jitter_last)
+
+        # the n-th run is on n * interval, not on the sum of delays.
+        self.advance(0.75)
+        self.assertEqual([(None, 2.0)], self.wait_runs(1))
+        self.assertEqual(0.0, job.jitter_last)
+
+        # the runs missed by the late thread are skipped.
+        self.advance(2.5)
+        self.assertEqual([(None, 4.5)], self.wait_runs(1))
+        self.advance(0.5)
+        self.assertEqual([(None, 5.0)], self.wait_runs(1))
+        self.assertEqual(4, job.runs)
+
+    def test_many_jobs_on_one_thread(self):
+        counts = {"fast": 0, "slow": 0}
+
+        threads = threading.active_count()
+        self.scheduler.every(1.0, self.run_job, name="fast")
+        self.scheduler.every(5.0, self.run_job, name="slow")
+
+        for i in range(1, 26):
+            self.advance(1.0)
+            for name, now in self.wait_runs(1 if i % 5 else 2):
+                counts[name] += 1
+
+        self.assertEqual(threading.active_count(), threads)
+        self.scheduler.stop()
+
+        self.assertEqual({"fast": 25, "slow": 5}, counts)
+        self.assertTrue(self.runs.empty())
+
+    def test_cancel_is_immediate(self):
+        job = self.scheduler.every(1.0, self.run_job)
+
+        self.advance(1.0)
+        self.wait_runs(1)
+        self.scheduler.cancel(job)
+        self.advance(1.0)
+
+        # the scheduler thread is idle with the empty heap.
+        self.scheduler.stop()
+        self.assertTrue(self.runs.empty())
+        self.assertEqual(1, job.runs)
+        self.assertTrue(job.is_cancelled)
+
+    def test_stop_is_immediate(self):
+        self.scheduler.every(3600, lambda: None)
+
+        start = time.monotonic()
+        self.scheduler.stop()
+
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertFalse(self.scheduler.is_alive())
+
+    def test_target_raises(self):
+        def target():
+            self.run_job()
+            raise ValueError("test")
+
+        self.scheduler.every(1.0, target)
+
+        for i in range(3):
+            self.advance(1.0)
+            self.wait_runs(1)
+
+        self.assertTrue(self.scheduler.is_alive())
+
+
+class TestRecursiveTimer(unittest.TestCase):
+    def test_run_with_kwargs(self):
+        called = []
+        rt = RecursiveTimer(0.02, lambda val: called.append(val), val=1)
+
+        rt.start()
+        time.sleep(0.11)
+        rt.cancel()
+
+        self.assertGreaterEqual(len(called), 3)
+        self.assertEqual(set(called), {1})
+        self.assertFalse(rt.is_alive())
+
+    def test_errors(self):
+        rt = RecursiveTimer(3600, lambda: None)
+        self.assertRaises(NotStartedYetError, rt.cancel)
+
+        rt.start()
+        self.assertRaises(AlreadyRunningError, rt.start)
+
+        start = time.monotonic()
+        rt.cancel()
+        self.assertLess(time.monotonic() - start, 0.1)
+
+        # can be started again after cancel.
+        rt.start()
+        self.assertTrue(rt.is_alive())
+        rt.cancel()
+
+
+if __name__ == "__main__":
+    unittest.main()